@@ -1,6 +1,8 @@
 import re
 import datetime
 import logging
+import threading
+from collections import OrderedDict
 
 import numpy as np
 
@@ -9,6 +11,7 @@ from scipy.optimize import fmin
 from astropy import units
 from astropy.utils import data as au_data
 from skyfield import jpllib, api as skyfield_api
+from skyfield.starlib import Star
 
 import so3g
 from pixell import enmap
@@ -70,11 +73,22 @@ class SlowSource:
         """Returns a SlowSource for planet ``name``, with position and
         peculiar velocity measured at time timestamp (float, unix).
 
+        """
+        return cls.for_named_sources([name], timestamp)[0]
+
+    @classmethod
+    def for_named_sources(cls, names, timestamp):
+        """Like for_named_source, but for a list of planet names; returns
+        a list of SlowSource.  The ephemeris is evaluated in a single
+        vectorized call.
+
         """
         dt = 3600
-        ra0, dec0, distance = get_source_pos(name, timestamp)
-        ra1, dec1, distance = get_source_pos(name, timestamp + dt)
-        return cls(timestamp, ra0, dec0, ((ra1-ra0+180) % 360 - 180)/dt, (dec1-dec0)/dt)
+        ra, dec, distance = get_source_positions(
+            names, np.array([timestamp, timestamp + dt]))
+        return [cls(timestamp, ra0, dec0, ((ra1-ra0+180) % 360 - 180)/dt,
+                    (dec1-dec0)/dt)
+                for (ra0, ra1), (dec0, dec1) in zip(ra, dec)]
 
     def pos(self, timestamps):
         """Get the (approximate) source position at the times given by the
@@ -217,15 +231,14 @@ def filter_for_sources(tod=None, signal=None, source_flags=None,
             filt = tod_ops.filters.low_pass_butter4(low_pass)
 
         n_det, n = signal.shape
-        a, b, t_1, t_2 = tod_ops.fft_ops.build_rfft_object(n_det, n, 'BOTH')
-        a[:] = signal_pca
-        t_1()
-        times = tod.timestamps
-        delta_t = (times[-1]-times[0])/(tod.samps.count - 1)
-        freqs = np.fft.rfftfreq(n, delta_t)
-        filt.apply(freqs, tod, target=b)
-        signal_pca = t_2()
-        del a, b
+        with tod_ops.fft_ops.cached_rfft_object(n_det, n, 'BOTH') as (a, b, t_1, t_2):
+            a[:] = signal_pca
+            t_1()
+            times = tod.timestamps
+            delta_t = (times[-1]-times[0])/(tod.samps.count - 1)
+            freqs = np.fft.rfftfreq(n, delta_t)
+            filt.apply(freqs, tod, target=b)
+            signal_pca = t_2().copy()
 
     # Measure TOD means (after gap fill, low pass, etc).
     if isinstance(n_modes, str) and n_modes == 'all':
@@ -252,6 +265,111 @@ def filter_for_sources(tod=None, signal=None, source_flags=None,
         tod.wrap(wrap, signal, [(0, 'dets'), (1, 'samps')])
     return signal
 
+class EphemerisCache:
+    """Cache of the skyfield objects needed to compute source
+    positions: the ephemeris (SpiceKernel), the timescale, and the
+    observatory (site) vectors.  Loading these is much more expensive
+    than evaluating them, so the functions in this module share a
+    process-wide instance, EPHEMERIS_CACHE.
+
+    At most max_entries ephemeris files are held in the cache; when
+    that is exceeded the least recently used one is dropped (along
+    with its observatories).  Dropped kernels are not closed
+    explicitly, since they may still be in use by a caller or another
+    thread; the file is closed when the kernel is garbage collected.
+
+    """
+    def __init__(self, max_entries=2):
+        self.max_entries = max_entries
+        self._kernels = OrderedDict()  # filename -> (kernel, {site: obs})
+        self._timescale = None
+        self._lock = threading.Lock()
+
+    def _get(self, filename):
+        # Returns (kernel, observatories dict); lock must be held.
+        if filename is None:
+            filename = core.get_local_file("de421.bsp")
+        if filename in self._kernels:
+            self._kernels.move_to_end(filename)
+        else:
+            self._kernels[filename] = (jpllib.SpiceKernel(filename), {})
+            while len(self._kernels) > self.max_entries:
+                self._kernels.popitem(last=False)
+        return self._kernels[filename]
+
+    def kernel(self, filename=None):
+        """Get the SpiceKernel for filename (defaults to de421.bsp,
+        which will be downloaded on first use)."""
+        with self._lock:
+            return self._get(filename)[0]
+
+    def timescale(self):
+        """Get the skyfield Timescale."""
+        with self._lock:
+            if self._timescale is None:
+                self._timescale = skyfield_api.load.timescale()
+            return self._timescale
+
+    def observatory(self, site="_default", filename=None):
+        """Get the skyfield vector for an observing site (str or
+        so3g.proj.EarthlySite), based on the ephemeris in filename."""
+        if isinstance(site, str):
+            key = site
+            site = so3g.proj.SITES[site]
+        else:
+            key = (site.lon, site.lat, site.elev)
+        with self._lock:
+            kernel, observatories = self._get(filename)
+            if key not in observatories:
+                observatories[key] = site.skyfield_site(kernel)
+            return observatories[key]
+
+    def clear(self):
+        """Drop all cached objects.  As for eviction, the kernels are
+        not closed explicitly."""
+        with self._lock:
+            self._kernels.clear()
+            self._timescale = None
+
+
+#: Process-wide EphemerisCache instance.
+EPHEMERIS_CACHE = EphemerisCache()
+
+
+def _get_target(planets, source_name):
+    for k in [
+        source_name,
+        source_name + " barycenter",
+    ]:
+        try:
+            return planets[k]
+        except (ValueError, KeyError):
+            pass
+    options = list(planets.names().values())
+    raise ValueError(
+        f'Failed to find a match for "{source_name}" in ephemeris: {options}'
+    )
+
+
+def _get_skyfield_time(timestamp):
+    # Convert unix timestamp(s) to skyfield Time.  Passing whole days
+    # separately means leap seconds are looked up on the right date.
+    timescale = EPHEMERIS_CACHE.timescale()
+    days = np.floor(np.asarray(timestamp, dtype=float) / 86400)
+    return timescale.utc(1970, 1, 1 + days, 0, 0, timestamp - days * 86400)
+
+
+def _match_fixed_source(source_name):
+    # Check against fixed-position template 'Jxxx[+-]yyy'; returns
+    # (ra, dec) in radians or None.
+    m = re.match(
+        r'J(?P<ra_deg>\d+(\.\d*)?)(?P<dec_deg>[+-]\d+(\.\d*)?)', source_name)
+    if m:
+        return (float(m['ra_deg']) * coords.DEG,
+                float(m['dec_deg']) * coords.DEG)
+    return None
+
+
 def _get_astrometric(source_name, timestamp, site="_default"):
     """
     Derive skyfield's Astrometric object of a celestial source at a
@@ -263,42 +381,16 @@ def _get_astrometric(source_name, timestamp, site="_default"):
     Args:
       source_name: Planet name; in capitalized format, e.g. "Jupiter",
         or fixed source specification.
-      timestamp: unix timestamp.
+      timestamp: unix timestamp, or array of them.
       site (str or so3g.proj.EarthlySite): if this is a string, the
         site will be looked up in so3g.proj.SITES dict.
 
     Returns:
       astrometric: skyfield's astrometric object
     """
-    # Get the ephemeris
-    de_filename = core.get_local_file("de421.bsp")
-
-    planets = jpllib.SpiceKernel(de_filename)
-    for k in [
-        source_name,
-        source_name + " barycenter",
-    ]:
-        try:
-            target = planets[k]
-            break
-        except (ValueError, KeyError):
-            pass
-    else:
-        options = list(planets.names().values())
-        raise ValueError(
-            f'Failed to find a match for "{source_name}" in ephemeris: {options}'
-        )
-
-    if isinstance(site, str):
-        site = so3g.proj.SITES[site]
-
-    observatory = site.skyfield_site(planets)
-
-    timescale = skyfield_api.load.timescale()
-    sf_timestamp = timescale.from_datetime(
-        datetime.datetime.fromtimestamp(timestamp, tz=skyfield_api.utc)
-    )
-    astrometric = observatory.at(sf_timestamp).observe(target)
+    target = _get_target(EPHEMERIS_CACHE.kernel(), source_name)
+    observatory = EPHEMERIS_CACHE.observatory(site)
+    astrometric = observatory.at(_get_skyfield_time(timestamp)).observe(target)
     return astrometric
 
 
@@ -311,7 +403,7 @@ def get_source_pos(source_name, timestamp, site='_default'):
     Args:
       source_name: Planet name; in capitalized format, e.g. "Jupiter",
         or fixed source specification.
-      timestamp: unix timestamp.
+      timestamp: unix timestamp, or array of them.
       site (str or so3g.proj.EarthlySite): if this is a string, the
         site will be looked up in so3g.proj.SITES dict.
 
@@ -320,6 +412,9 @@ def get_source_pos(source_name, timestamp, site='_default'):
       dec (float): in radians.
       distance (float): in AU.
 
+      If timestamp is an array, each of these is an array with the
+      same shape.
+
     Note:
 
       Before checking in the ephemeris, the source_name will be
@@ -329,13 +424,13 @@ def get_source_pos(source_name, timestamp, site='_default'):
       processed.  In that case, the distance is returned as Inf.
 
     """
-    # Check against fixed-position template...
-    m = re.match(
-        r'J(?P<ra_deg>\d+(\.\d*)?)(?P<dec_deg>[+-]\d+(\.\d*)?)', source_name)
-    if m:
-        ra, dec = float(m['ra_deg']) * \
-            coords.DEG, float(m['dec_deg']) * coords.DEG
-        return ra, dec, float('inf')
+    fixed = _match_fixed_source(source_name)
+    if fixed:
+        if np.ndim(timestamp):
+            shape = np.shape(timestamp)
+            return (np.full(shape, fixed[0]), np.full(shape, fixed[1]),
+                    np.full(shape, float('inf')))
+        return fixed[0], fixed[1], float('inf')
     
     # Derive from skyfield astrometric object
     amet0 = _get_astrometric(source_name, timestamp, site)
@@ -353,7 +448,7 @@ def get_source_azel(source_name, timestamp, site='_default'):
     Args:
         source_name: Planet name; in capitalized format, e.g. "Jupiter"
         timestamp (float): The Unix timestamp representing the time for 
-          which to calculate azimuth and elevation.
+          which to calculate azimuth and elevation.  May be an array.
         site (str or so3g.proj.EarthlySite): if this is a string, the
         site will be looked up in so3g.proj.SITES dict.
 
@@ -361,12 +456,68 @@ def get_source_azel(source_name, timestamp, site='_default'):
       az (float): in radians.
       el (float): in radians.
       distance (float): in AU.
+
+      If timestamp is an array, each of these is an array with the
+      same shape.
     """
     amet0 = _get_astrometric(source_name, timestamp, site)
     el, az, distance = amet0.apparent().altaz()
     return az.to(units.rad).value, el.to(units.rad).value, distance.to(units.au).value
 
 
+def get_source_positions(source_list, timestamps, site='_default',
+                         azel=False):
+    """Get the positions of several sources at several times.  The
+    ephemeris, observatory and time conversion are shared among all
+    sources, and each source is evaluated for all timestamps at once.
+
+    Args:
+      source_list: list of source names, as accepted by
+        get_source_pos, or tuples (name, ra, dec) giving a fixed
+        position in degrees (as in SOURCE_LIST).
+      timestamps: array of unix timestamps.
+      site (str or so3g.proj.EarthlySite): if this is a string, the
+        site will be looked up in so3g.proj.SITES dict.
+      azel (bool): If True, return apparent horizon coordinates (as
+        in get_source_azel) instead of equatorial coordinates.
+
+    Returns:
+      Three arrays, each with shape (len(source_list),
+      len(timestamps)): ra and dec (or az and el) in radians, and
+      distance in AU (Inf for fixed-position sources).
+
+    """
+    timestamps = np.asarray(timestamps, dtype=float)
+    shape = (len(source_list),) + timestamps.shape
+    lon, lat, distance = np.zeros(shape), np.zeros(shape), np.zeros(shape)
+    here = None
+    for i, source in enumerate(source_list):
+        if isinstance(source, (list, tuple)):
+            fixed = float(source[1]) * coords.DEG, float(source[2]) * coords.DEG
+        else:
+            fixed = _match_fixed_source(source)
+        if fixed and not azel:
+            lon[i], lat[i], distance[i] = fixed[0], fixed[1], float('inf')
+            continue
+        if here is None:
+            here = EPHEMERIS_CACHE.observatory(site).at(
+                _get_skyfield_time(timestamps))
+        if fixed:
+            target = Star(ra_hours=fixed[0] / coords.DEG / 15,
+                          dec_degrees=fixed[1] / coords.DEG)
+        else:
+            target = _get_target(EPHEMERIS_CACHE.kernel(), source)
+        amet = here.observe(target)
+        if azel:
+            el, az, dist = amet.apparent().altaz()
+            lon[i], lat[i] = az.to(units.rad).value, el.to(units.rad).value
+        else:
+            ra, dec, dist = amet.radec()
+            lon[i], lat[i] = ra.to(units.rad).value, dec.to(units.rad).value
+        distance[i] = float('inf') if fixed else dist.to(units.au).value
+    return lon, lat, distance
+
+
 def get_nearby_sources(tod=None, source_list=None, distance=1.):
     """Identify solar system objects (especially "planets") that might be
     within a TOD's scan footprint.
@@ -410,15 +561,19 @@ def get_nearby_sources(tod=None, source_list=None, distance=1.):
     if source_list is None:
         source_list = SOURCE_LIST
 
+    # Evaluate all the named sources at once.
+    t = tod.timestamps[0]
+    named = [s for s in source_list if not isinstance(s, (list, tuple))]
+    slow_sources = dict(zip(named, SlowSource.for_named_sources(named, t)))
+
     positions = []
     for source_name in source_list:
-        t = tod.timestamps[0]
         if isinstance(source_name, (list, tuple)):
             source_name, ra, dec = source_name
             sl = coords.planets.SlowSource(t, float(ra) * coords.DEG,
                                            float(dec) * coords.DEG)
         else:
-            sl = coords.planets.SlowSource.for_named_source(source_name, t)
+            sl = slow_sources[source_name]
         x = w.distance_from([[sl.dec], [sl.ra]])
         md = x[w[0] != 0].min()
         logger.debug(('Source {:12} is at ({:8.4f},{:8.4f}); '
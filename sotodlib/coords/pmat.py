@@ -1,6 +1,9 @@
 import so3g.proj
 import numpy as np
 import scipy
+import tempfile
+import threading
+import weakref
 from pixell import enmap, tilemap
 
 from .helpers import _get_csl, _valid_arg, _not_both
@@ -121,9 +124,25 @@ class P:
       each tile is assigned to a single thread (each thread may be in
       charge of multiple tiles).
 
+    If precompute is True, then the pixel indices and spin projection
+    factors for every sample are computed on first use and cached,
+    and subsequent to_map / from_map / to_weights calls use those
+    rather than recomputing the pointing.  This is useful when the
+    same P is applied many times (e.g. in iterative map-making).  The
+    cache is stored as int32 (pixels) and precompute_dtype (phases;
+    'float16' halves the memory at the cost of ~1e-3 relative
+    precision in the spin factors), and is allocated through
+    PRECOMP_BUDGET, which may spill it to memory-mapped scratch
+    files.  The cache is rebuilt if sight, fp, geom or comps are
+    replaced.  Precomputation is only supported for non-tiled
+    geometries with nearest-neighbor interpolation and comps in
+    ('T', 'QU', 'TQU'); otherwise the pointing is computed on the
+    fly as usual.
+
     """
     def __init__(self, sight=None, fp=None, geom=None, comps='T',
-                 cuts=None, threads=None, det_weights=None, interpol=None):
+                 cuts=None, threads=None, det_weights=None, interpol=None,
+                 precompute=False, precompute_dtype='float32'):
         self.sight = sight
         self.fp = fp
         self.geom = wrap_geom(geom)
@@ -133,13 +152,17 @@ class P:
         self.active_tiles = None
         self.det_weights = det_weights
         self.interpol = interpol
+        self.precompute = precompute
+        self.precompute_dtype = precompute_dtype
+        self._precomp = None
 
     @classmethod
     def for_tod(cls, tod, sight=None, geom=None, comps='T',
                 rot=None, cuts=None, threads=None, det_weights=None,
                 timestamps=None, focal_plane=None, boresight=None,
                 boresight_equ=None, wcs_kernel=None, weather='typical',
-                site='so', interpol=None, hwp=False):
+                site='so', interpol=None, hwp=False, precompute=False,
+                precompute_dtype='float32'):
         """Set up a Projection Matrix for a TOD.  This will ultimately call
         the main P constructor, but some missing arguments will be
         extracted from tod and computed along the way.
@@ -203,7 +226,8 @@ class P:
 
         return cls(sight=sight, fp=fp, geom=geom, comps=comps,
                    cuts=cuts, threads=threads, det_weights=det_weights,
-                   interpol=interpol)
+                   interpol=interpol, precompute=precompute,
+                   precompute_dtype=precompute_dtype)
 
     @classmethod
     def for_geom(cls, tod, geom, comps='TQU', timestamps=None,
@@ -267,6 +291,14 @@ class P:
         if dest is None:  dest  = self.zeros(comps=comps)
 
         proj, threads = self._get_proj_threads(cuts=cuts)
+        precomp = self._get_precomp(comps)
+        if precomp is not None:
+            for d0, d1, pixels, phases in precomp.chunks():
+                precomp.engine.to_map(
+                    self._prepare_map(dest), pixels, phases, signal[d0:d1],
+                    _slice_dets(det_weights, d0, d1),
+                    unwrap_ranges(_slice_threads(threads, d0, d1)))
+            return dest
         proj.to_map(signal, self._get_asm(), output=self._prepare_map(dest),
                 det_weights=det_weights, comps=comps, threads=unwrap_ranges(threads))
         return dest
@@ -305,6 +337,14 @@ class P:
             dest = self.zeros((_n, _n))
 
         proj, threads = self._get_proj_threads(cuts=cuts)
+        precomp = self._get_precomp(comps)
+        if precomp is not None:
+            for d0, d1, pixels, phases in precomp.chunks():
+                precomp.engine.to_weight_map(
+                    self._prepare_map(dest), pixels, phases,
+                    _slice_dets(det_weights, d0, d1),
+                    unwrap_ranges(_slice_threads(threads, d0, d1)))
+            return dest
         proj.to_weights(self._get_asm(), output=self._prepare_map(dest),
                 det_weights=det_weights, comps=comps, threads=unwrap_ranges(threads))
         return dest
@@ -402,7 +442,13 @@ class P:
         if dest is None:
             dest = np.zeros(tod_shape, np.float32)
         assert(dest.shape == tod_shape)  # P.fp/P.sight and dest argument disagree
-        proj.from_map(self._prepare_map(signal_map), self._get_asm(), signal=dest, comps=comps)
+        precomp = self._get_precomp(comps)
+        if precomp is not None:
+            for d0, d1, pixels, phases in precomp.chunks():
+                precomp.engine.from_map(self._prepare_map(signal_map),
+                                        pixels, phases, dest[d0:d1])
+        else:
+            proj.from_map(self._prepare_map(signal_map), self._get_asm(), signal=dest, comps=comps)
 
         if wrap is not None:
             if wrap in tod:
@@ -492,18 +538,138 @@ class P:
             threads = self.threads
         return proj, threads
 
-    def _get_asm(self):
+    def _get_asm(self, dets=None):
         """Bundles self.fp and self.sight into an "Assembly" for calling
-        so3g.proj routines."""
-        so3g_fp = so3g.proj.FocalPlane()
-        for i, q in enumerate(self.fp):
-            so3g_fp[f'a{i}'] = q
+        so3g.proj routines.  Pass a slice as dets to include only
+        those detectors."""
+        fp = self.fp
+        if dets is not None:
+            fp = np.asarray(fp)[dets]
+        if hasattr(so3g.proj.FocalPlane, 'coeffs'):
+            # Newer so3g: build from the quaternion array at once.
+            so3g_fp = so3g.proj.FocalPlane(quats=np.asarray(fp))
+        else:
+            so3g_fp = so3g.proj.FocalPlane()
+            for i, q in enumerate(fp):
+                so3g_fp[f'a{i}'] = so3g.proj.quat.quat(*q) \
+                    if isinstance(q, np.ndarray) else q
         return so3g.proj.Assembly.attach(self.sight, so3g_fp)
 
+    def _get_precomp(self, comps):
+        """Return the _PrecompPointing for the present configuration,
+        computing it if necessary; or None if precompute is not
+        enabled or not supported for this configuration."""
+        if not self.precompute or comps != self.comps:
+            return None
+        comp_index = {'T': [0], 'QU': [1, 2], 'TQU': [0, 1, 2]}.get(comps)
+        if self.tiled or comp_index is None or \
+           self.interpol not in [None, 'nn', 'nearest']:
+            return None
+        refs = (self.sight, self.sight.Q, self.fp, self.geom)
+        if self._precomp is not None and self._precomp.comps == comps and all(
+                [a is b for a, b in zip(self._precomp.refs, refs)]):
+            return self._precomp
+        self._precomp = None  # release old arrays first.
+        logger.info('_get_precomp: computing pointing for %i dets' % len(self.fp))
+        proj = self._get_proj()
+        n_det, n_samp = len(self.fp), len(self.sight.Q)
+        pixels, phases = None, None
+        for d0 in range(0, n_det, _PrecompPointing.chunk_size):
+            d1 = min(d0 + _PrecompPointing.chunk_size, n_det)
+            pix, ph = proj.get_pointing_matrix(self._get_asm(slice(d0, d1)))
+            if pixels is None:
+                pixels = PRECOMP_BUDGET.empty(
+                    (n_det, n_samp, pix[0].shape[-1]), 'int32')
+                phases = PRECOMP_BUDGET.empty(
+                    (n_det, n_samp, len(comp_index)), self.precompute_dtype)
+            pixels[d0:d1] = pix
+            phases[d0:d1] = np.array(ph)[..., comp_index]
+        self._precomp = _PrecompPointing(refs, comps, pixels, phases)
+        return self._precomp
+
     def _prepare_map(self, map):
         if self.tiled: return map.tiles
         else:          return map
 
+class _PrecompPointing:
+    """Cached pixel indices [dets, samps, 2] and spin projection factors
+    [dets, samps, comps] for a P, with helpers to apply them in
+    detector chunks (which limits the temporary memory needed to
+    convert compact phases to float32)."""
+    chunk_size = 256
+
+    def __init__(self, refs, comps, pixels, phases):
+        self.refs = refs
+        self.comps = comps
+        self.pixels = pixels
+        self.phases = phases
+        self.engine = so3g.ProjEng_Precomp_NonTiled()
+
+    def chunks(self):
+        n_det = len(self.pixels)
+        for d0 in range(0, n_det, self.chunk_size):
+            d1 = min(d0 + self.chunk_size, n_det)
+            yield (d0, d1, np.asarray(self.pixels[d0:d1]),
+                   np.asarray(self.phases[d0:d1], dtype='float32'))
+
+
+class PrecompBudget:
+    """Accounting for the memory used by precomputed pointing (see P,
+    precompute=True), shared by all P objects in the process.  Arrays
+    are allocated in RAM until max_bytes (None for no limit) are in
+    use; after that, arrays are allocated as memory-mapped files in
+    scratch_dir (None for the system default temporary directory).
+    The scratch files are unlinked immediately, so disk space is
+    returned once the arrays are released.
+
+    """
+    def __init__(self, max_bytes=None, scratch_dir=None):
+        self.max_bytes = max_bytes
+        self.scratch_dir = scratch_dir
+        self.nbytes = 0
+        self._lock = threading.Lock()
+
+    def _release(self, nbytes):
+        with self._lock:
+            self.nbytes -= nbytes
+
+    def empty(self, shape, dtype):
+        """Return an uninitialized array, either in RAM or
+        memory-mapped to a scratch file."""
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with self._lock:
+            in_ram = (self.max_bytes is None or
+                      self.nbytes + nbytes <= self.max_bytes)
+            if in_ram:
+                self.nbytes += nbytes
+        if in_ram:
+            output = np.empty(shape, dtype)
+            weakref.finalize(output, self._release, nbytes)
+            return output
+        logger.info(f'PrecompBudget: spilling {nbytes} bytes to scratch file')
+        with tempfile.NamedTemporaryFile(dir=self.scratch_dir,
+                                         prefix='pmat_precomp_') as fout:
+            return np.memmap(fout, dtype=dtype, mode='w+', shape=shape)
+
+
+#: The PrecompBudget used by P.  Set PRECOMP_BUDGET.max_bytes and
+#: .scratch_dir to control where precomputed pointing is stored.
+PRECOMP_BUDGET = PrecompBudget()
+
+
+def _slice_dets(det_weights, d0, d1):
+    if det_weights is None:
+        return None
+    return det_weights[d0:d1]
+
+def _slice_threads(threads, d0, d1):
+    # threads is either a list of RangesMatrix [threads, dets, samps]
+    # or (if threads=False) a single RangesMatrix [dets, samps].
+    if isinstance(threads, list):
+        return [t[:, d0:d1] for t in threads]
+    return threads[d0:d1]
+
+
 class P_PrecompDebug:
     def __init__(self, geom, pixels, phases):
         self.geom   = wrap_geom(geom).nopre
@@ -277,6 +277,38 @@ class LabelAxis(AxisInterface):
             return ax
 
 
+class DeferredField:
+    """Base class for AxisManager data fields that are not loaded into
+    memory until first accessed (see AxisManager.load with
+    lazy=True).  Subclasses must provide ``shape`` and a ``load()``
+    method that returns the actual data.  When the field is accessed
+    through the AxisManager, the placeholder is replaced by the
+    result of ``load()``.
+
+    """
+    shape = None
+
+    def load(self):
+        raise NotImplementedError()
+
+    def copy(self):
+        # The placeholder is read-only, so can be shared.
+        return self
+
+    def __array__(self, dtype=None, copy=None):
+        data = np.asarray(self.load())
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+
+    def __getitem__(self, sel):
+        return self.load()[sel]
+
+    @staticmethod
+    def concatenate(items, axis=0):
+        return np.concatenate([np.asarray(x) for x in items], axis=axis)
+
+
 class AxisManager:
     """A container for numpy arrays and other multi-dimensional
     data-carrying objects (including other AxisManagers).  This object
@@ -359,7 +391,10 @@ class AxisManager:
 
     def __getitem__(self, name):
         if name in self._fields:
-            return self._fields[name]
+            v = self._fields[name]
+            if isinstance(v, DeferredField):
+                v = self._fields[name] = v.load()
+            return v
         if name in self._axes:
             return self._axes[name]
         raise KeyError(name)
@@ -843,7 +878,8 @@ class AxisManager:
             self._assignments.update(aman._assignments)
         return self
 
-    def save(self, dest, group=None, overwrite=False, compression=None):
+    def save(self, dest, group=None, overwrite=False, compression=None,
+             field_compression=None, chunks=None, background=False):
         """Write this AxisManager data to an HDF5 group.  This is an
         experimental feature primarily intended to assist with
         debugging.  The schema is subject to change, and it's possible
@@ -857,9 +893,27 @@ class AxisManager:
             dest).
           overwrite (bool): If True, remove any existing thing at the
             specified address before writing there.
-          compression (str or None): Compression filter to apply. E.g.
-            'gzip'. This string is passed directly to HDF5 dataset
-            routines.
+          compression (str, dict or None): Compression filter to
+            apply. E.g. 'gzip'. This string is passed directly to HDF5
+            dataset routines.  A dict may be passed instead, to
+            provide several filter arguments to h5py create_dataset;
+            e.g. ``{'compression': 'lzf', 'shuffle': True}`` is a fast
+            option suitable for float32 signal (filter dicts from
+            hdf5plugin can also be used here).
+          field_compression (dict or None): Overrides of compression
+            for particular fields, keyed by field name (use "." to
+            address fields in child AxisManagers, e.g.
+            'flags.glitches').
+          chunks (bool or None): If True, ndarray fields are written
+            with chunk shapes aligned to the axes (a few whole dets
+            rows by a block of samples, see CHUNK_BYTES in
+            axisman_io).  If None, this is done only for fields that
+            are compressed.  If False, h5py defaults are used.
+          background (bool): If True, the data are written by a
+            background thread, and a concurrent.futures.Future is
+            returned; call .result() on it to wait for completion (and
+            to raise any errors).  The data arrays must not be
+            modified until the write completes.
 
         Notes:
           If dest is a string, it is taken to be an HDF5 filename and
@@ -893,10 +947,14 @@ class AxisManager:
 
         """
         from .axisman_io import _save_axisman
-        return _save_axisman(self, dest, group=group, overwrite=overwrite, compression=compression)
+        return _save_axisman(self, dest, group=group, overwrite=overwrite,
+                             compression=compression,
+                             field_compression=field_compression,
+                             chunks=chunks, background=background)
 
     @classmethod
-    def load(cls, src, group=None, fields=None):
+    def load(cls, src, group=None, fields=None, restrict=None,
+             lazy=False):
         """Load a saved AxisManager from an HDF5 file and return it.  See docs
         for save() function.
 
@@ -917,9 +975,28 @@ class AxisManager:
         directly referenced by the requested fields; this behavior is
         subject to change.
 
+        If restrict is specified, it must be a dict mapping axis name
+        to a selector, as would be passed to ``.restrict()``.  The
+        result is the same as calling ``.restrict()`` on the loaded
+        AxisManager, but only the selected parts of each dataset are
+        read from disk.  For example::
+
+          axisman = AxisManager.load('test.h5', 'x/y/z',
+                                     restrict={'dets': ['det0', 'det4'],
+                                               'samps': (1000, 2000)})
+
+        If lazy is True, ndarray fields are not read until they are
+        first accessed through the AxisManager.  If src is a filename,
+        the file is closed before returning, and is opened again
+        (briefly) to read each deferred field; so it must remain
+        readable, and unchanged, until then.  If src is an open h5py
+        File or Group, the deferred fields read from it, and it must
+        not be closed until they have been accessed.
+
         """
         from .axisman_io import _load_axisman
-        return _load_axisman(src, group, cls, fields=fields)
+        return _load_axisman(src, group, cls, fields=fields,
+                             restrict=restrict, lazy=lazy)
 
 
 def simplify_slice(sslice, shape):
@@ -1,7 +1,9 @@
 import so3g
 import numpy as np
 import json
+import copy
 import h5py
+from concurrent.futures import ThreadPoolExecutor
 
 ## "temporary" fix to deal with scipy>1.8 changing the sparse setup
 try:
@@ -23,26 +25,21 @@ def flatten_RangesMatrix(rm):
       Dict with arrays called 'shape', 'intervals', and 'ends'.
     """
     shape = rm.shape
-    if len(shape) == 2:
-        intervals = [r.ranges().reshape(-1) for r in rm.ranges]
-        ends = np.cumsum([len(i) for i in intervals])
-        intervals = np.hstack(intervals)
-        return {
-            'shape': np.array(shape),
-            'intervals': intervals,
-            'ends': ends,
-        }
-    last_end = 0
-    ends, intervals = [], []
-    for r in rm.ranges:
-        subrm = flatten_RangesMatrix(r)
-        ends.append(subrm['ends'] + last_end)
-        intervals.append(subrm['intervals'])
-        last_end += subrm['ends'][-1]
+    # Collect the Ranges objects, in row-major order.
+    leaves = [rm]
+    while len(leaves) and isinstance(leaves[0], so3g.proj.RangesMatrix):
+        leaves = [r for x in leaves for r in x.ranges]
+    intervals = [r.ranges().reshape(-1) for r in leaves]
+    ends = np.cumsum(np.fromiter(map(len, intervals), dtype=int,
+                                 count=len(intervals)))
+    if len(intervals):
+        intervals = np.concatenate(intervals)
+    else:
+        intervals = np.zeros(0, dtype='int32')
     return {
         'shape': np.array(shape),
-        'intervals': np.hstack(intervals),
-        'ends': np.hstack(ends),
+        'intervals': intervals,
+        'ends': ends,
     }
 
 def expand_RangesMatrix(flat_rm):
@@ -57,7 +54,7 @@ def expand_RangesMatrix(flat_rm):
     if shape[0] == 0:
         return so3g.proj.RangesMatrix([], child_shape=shape[1:])
     # Otherwise non-trivial
-    count = np.product(shape[:-1])
+    count = np.prod(shape[:-1])
     start, stride = 0, count // shape[0]
     for i in range(0, len(ends), stride):
         _e = ends[i:i+stride] - start
@@ -67,6 +64,28 @@ def expand_RangesMatrix(flat_rm):
         start = ends[i+stride-1]
     return so3g.proj.RangesMatrix(ranges, child_shape=shape[1:])
 
+def _select_RangesMatrix_rows(flat_rm, index):
+    """Given a dict like the one returned by flatten_RangesMatrix,
+    return a similar dict containing only the rows (along the first
+    dimension) listed in index.
+
+    """
+    shape, intervals, ends = [
+        np.asarray(flat_rm[k]) for k in ['shape', 'intervals', 'ends']]
+    stride = int(np.prod(shape[1:-1]))
+    leaves = (np.asarray(index)[:, None] * stride
+              + np.arange(stride)).ravel()
+    starts = np.concatenate([[0], ends[:-1]]).astype(int)
+    lens = (ends[leaves] - starts[leaves]).astype(int)
+    new_ends = np.cumsum(lens)
+    gather = (np.repeat(starts[leaves] - (new_ends - lens), lens)
+              + np.arange(new_ends[-1] if len(new_ends) else 0))
+    return {
+        'shape': np.array([len(index)] + list(shape[1:])),
+        'intervals': intervals[gather],
+        'ends': new_ends,
+    }
+
 ## Flatten and Expand sparse arrays
 def flatten_csr_array(arr):
     """Extract information from scipy.sparse.csr_array for saving in
@@ -123,10 +142,70 @@ def _safe_scalars(x):
     # Must be fine then!
     return x
 
-def _save_axisman(axisman, dest, group=None, overwrite=False, compression=None):
+#: Target size, in bytes, of the axis-aligned chunks used when
+#: writing compressed ndarray fields.
+CHUNK_BYTES = 2**20
+
+_writer = None
+
+def _get_writer():
+    # Single background thread, so that queued writes happen in order.
+    global _writer
+    if _writer is None:
+        _writer = ThreadPoolExecutor(1)
+    return _writer
+
+def _filter_kwargs(spec):
+    """Convert a compression spec (None, str, or dict of h5py
+    create_dataset filter arguments) to a dict of kwargs.
+
     """
-    See AxisManager.save.
+    if spec is None:
+        return {}
+    if isinstance(spec, str):
+        return {'compression': spec}
+    return dict(spec)
+
+def _chunk_shape(shape, itemsize, axis_types, target=None):
+    """Choose a chunk shape for an array of the given shape.  Each
+    entry of axis_types is 'label' (e.g. dets), 'offset' (e.g. samps)
+    or None.  Chunks span a few whole label rows and a block of
+    samples, so that reading a subset of dets or a range of samples
+    touches as few chunks as possible.
+
+    """
+    if target is None:
+        target = CHUNK_BYTES
+    if len(shape) == 0 or 0 in shape:
+        return None
+    chunk = [1 if t == 'label' else n for n, t in zip(shape, axis_types)]
+    def nbytes():
+        return int(np.prod(chunk)) * itemsize
+    # Shrink sample axes, then anything, until under target.
+    for only_offset in [True, False]:
+        while nbytes() > target:
+            dims = [i for i, t in enumerate(axis_types)
+                    if chunk[i] > 1 and (t == 'offset' or not only_offset)]
+            if len(dims) == 0:
+                break
+            i = max(dims, key=lambda i: chunk[i])
+            chunk[i] = (chunk[i] + 1) // 2
+    # Grow label axes up to the target.
+    for i, t in enumerate(axis_types):
+        if t == 'label' and nbytes() < target:
+            chunk[i] = min(shape[i], max(1, target // nbytes()) * chunk[i])
+    return tuple(chunk)
+
+def _plan_axisman(axisman, compression=None, field_compression=None,
+                  chunks=None, prefix=''):
+    """Scheme out the HDF5 representation of axisman.  Returns a dict
+    with the group attributes, datasets (name, data, kwargs) and
+    sub-groups (name, plan) to be written.
+
     """
+    if field_compression is None:
+        field_compression = {}
+
     # Scheme it out...
     schema = []
     for k, assign in axisman._assignments.items():
@@ -185,72 +264,122 @@ def _save_axisman(axisman, dest, group=None, overwrite=False, compression=None):
     # Sanitize ...
     schema = _safe_scalars(schema)
 
-    # Resolve the destination group.
-    file_to_close = None
-    if isinstance(dest, str):
-        file_to_close = h5py.File(dest, 'a')
-        dest = file_to_close['/']
-    assert isinstance(dest, h5py.Group)  # filename or Group expected
-    if group is not None:
-        if group in dest:
-            dest = dest[group]
-        else:
-            dest = dest.create_group(group)
-
-    # Needs emptying?  This might be slower than just del dest[group],
-    # but it also works for '/' or Groups passed in by reference only.
-    for target in [dest, dest.attrs]:
-        for k in list(target.keys()):
-            if overwrite:
-                del target[k]
-            else:
-                raise RuntimeError(
-                    f'Destination group "{dest.name}" is not empty; '
-                    f'pass overwite=True to clobber.')
-
-    dest.attrs['_axisman'] = json.dumps({
+    plan = {'attrs': {}, 'datasets': [], 'groups': []}
+    plan['attrs']['_axisman'] = json.dumps({
         'version': 0,
         'schema': schema,
         })
     scalars = {}
     units = {}
 
+    def array_kwargs(item, data):
+        kw = _filter_kwargs(field_compression.get(
+            prefix + item['name'], compression))
+        if data.ndim == 0 or data.size == 0:
+            return {}
+        use_chunks = chunks if chunks is not None else len(kw) > 0
+        if use_chunks:
+            axis_types = []
+            for a in item['axes']:
+                ax = axisman._axes.get(a)
+                axis_types.append(
+                    'label' if isinstance(ax, LabelAxis) else
+                    'offset' if isinstance(ax, OffsetAxis) else None)
+            kw['chunks'] = _chunk_shape(data.shape, data.dtype.itemsize,
+                                        axis_types)
+        return kw
+
     for item in schema:
-        data = axisman[item['name']]
+        name = item['name']
+        data = axisman[name]
         if item['encoding'] == 'scalar':
-            scalars[item['name']] = data
-        elif item['encoding'] == 'ndarray':
-            dest.create_dataset(item['name'], data=_retype_for_write(data), compression=compression)
-        elif item['encoding'] == 'quantity':
-            dest.create_dataset(item['name'], data=_retype_for_write(data), compression=compression)
-            units[item['name']] = data.unit.to_string()
+            scalars[name] = data
+        elif item['encoding'] in ['ndarray', 'quantity']:
+            data = _retype_for_write(np.asarray(data))
+            plan['datasets'].append((name, data, array_kwargs(item, data)))
+            if item['encoding'] == 'quantity':
+                units[name] = axisman[name].unit.to_string()
         elif item['encoding'] == 'scalar_quantity':
-            scalars[item['name']] = data.value
-            units[item['name']] = data.unit.to_string()
-        elif item['encoding'] == 'rangesmatrix':
-            g = dest.create_group(item['name'])
-            for k, v in flatten_RangesMatrix(data).items():
-                g.create_dataset(k, data=v, compression=compression)
-        elif item['encoding'] == 'csrarray':
-            g = dest.create_group(item['name'])
-            for k, v in flatten_csr_array(data).items():
-                g.create_dataset(k, data=v, compression=compression)
+            scalars[name] = data.value
+            units[name] = data.unit.to_string()
+        elif item['encoding'] in ['rangesmatrix', 'csrarray']:
+            if item['encoding'] == 'rangesmatrix':
+                flat = flatten_RangesMatrix(data)
+            else:
+                flat = flatten_csr_array(data)
+            kw = _filter_kwargs(field_compression.get(
+                prefix + name, compression))
+            plan['groups'].append((name, {
+                'attrs': {}, 'groups': [],
+                'datasets': [(k, v, kw if np.ndim(v) else {})
+                             for k, v in flat.items()]}))
         elif item['encoding'] == 'axisman':
-            g = dest.create_group(item['name'])
-            _save_axisman(data, g, compression=compression)
+            plan['groups'].append((name, _plan_axisman(
+                data, compression=compression,
+                field_compression=field_compression, chunks=chunks,
+                prefix=prefix + name + '.')))
         elif item['encoding'] == 'axis':
             pass #
         else:
             print(f'Unhandled {item["name"]}->{item["encoding"]}')
 
     if len(scalars):
-        dest.attrs['_scalars'] = json.dumps(scalars)
+        plan['attrs']['_scalars'] = json.dumps(scalars)
 
     if len(units):
-        dest.attrs['_units'] = json.dumps(units)
+        plan['attrs']['_units'] = json.dumps(units)
+
+    return plan
 
-    if file_to_close:
-        file_to_close.close()
+def _write_plan(plan, dest):
+    for k, v in plan['attrs'].items():
+        dest.attrs[k] = v
+    for name, data, kwargs in plan['datasets']:
+        dest.create_dataset(name, data=data, **kwargs)
+    for name, subplan in plan['groups']:
+        _write_plan(subplan, dest.create_group(name))
+
+def _write_axisman(plan, dest, group=None, overwrite=False):
+    # Resolve the destination group.
+    file_to_close = None
+    if isinstance(dest, str):
+        file_to_close = h5py.File(dest, 'a')
+        dest = file_to_close['/']
+    try:
+        assert isinstance(dest, h5py.Group)  # filename or Group expected
+        if group is not None:
+            if group in dest:
+                dest = dest[group]
+            else:
+                dest = dest.create_group(group)
+
+        # Needs emptying?  This might be slower than just del dest[group],
+        # but it also works for '/' or Groups passed in by reference only.
+        for target in [dest, dest.attrs]:
+            for k in list(target.keys()):
+                if overwrite:
+                    del target[k]
+                else:
+                    raise RuntimeError(
+                        f'Destination group "{dest.name}" is not empty; '
+                        f'pass overwite=True to clobber.')
+
+        _write_plan(plan, dest)
+    finally:
+        if file_to_close:
+            file_to_close.close()
+
+def _save_axisman(axisman, dest, group=None, overwrite=False, compression=None,
+                  field_compression=None, chunks=None, background=False):
+    """
+    See AxisManager.save.
+    """
+    plan = _plan_axisman(axisman, compression=compression,
+                         field_compression=field_compression, chunks=chunks)
+    if background:
+        return _get_writer().submit(_write_axisman, plan, dest,
+                                    group=group, overwrite=overwrite)
+    _write_axisman(plan, dest, group=group, overwrite=overwrite)
 
 def _get_subfields(fields, prefix):
     if fields is None:
@@ -263,9 +392,133 @@ def _get_subfields(fields, prefix):
         return None
     return subfields
 
-def _load_axisman(src, group=None, cls=None, fields=None):
+def _is_full(sel, n):
+    return isinstance(sel, slice) and sel.indices(n) == (0, n, 1)
+
+def _normalize_selector(sel, n):
+    """Convert sel (a slice, or an array of indices or bools) into a
+    slice with step 1 and explicit bounds, or an array of indices.
+
     """
-    See AxisManager.load.
+    if isinstance(sel, slice):
+        start, stop, step = sel.indices(n)
+        if step == 1:
+            return slice(start, max(start, stop))
+        return np.arange(start, stop, step)
+    sel = np.asarray(sel)
+    if sel.dtype == bool:
+        return np.nonzero(sel)[0]
+    return np.arange(n)[sel]
+
+
+class _H5DeferredArray(DeferredField):
+    """Placeholder for (a hyperslab of) an HDF5 dataset, which will be
+    read when the data are needed.  The selection is a tuple with
+    one entry per dimension, each a slice (with step 1) or an array
+    of indices.
+
+    If reopen is True, no reference to the dataset (or its file) is
+    kept; the file is opened again, briefly, when the data are read.
+
+    """
+    def __init__(self, dset, sel=None, reopen=False):
+        self.dset = dset
+        self.dset_dtype = dset.dtype
+        self.filename, self.path = None, None
+        if reopen:
+            self.dset = None
+            self.filename, self.path = dset.file.filename, dset.name
+        if sel is None:
+            sel = [slice(None)] * len(dset.shape)
+        self.sel = tuple([_normalize_selector(s, n)
+                          for s, n in zip(sel, dset.shape)])
+
+    @property
+    def shape(self):
+        return tuple([s.stop - s.start if isinstance(s, slice) else len(s)
+                      for s in self.sel])
+
+    @property
+    def dtype(self):
+        return _retype_for_read(np.zeros(0, self.dset_dtype)).dtype
+
+    @property
+    def ndim(self):
+        return len(self.sel)
+
+    def load(self):
+        # Read the bounding hyperslab, then apply any index arrays.
+        read_sel, post = [], []
+        for s in self.sel:
+            if isinstance(s, slice):
+                read_sel.append(s)
+                post.append(None)
+            else:
+                lo = s.min() if len(s) else 0
+                hi = s.max() + 1 if len(s) else 0
+                read_sel.append(slice(lo, hi))
+                post.append(s - lo)
+        if self.dset is None:
+            with h5py.File(self.filename, 'r') as f:
+                data = f[self.path][tuple(read_sel)]
+        else:
+            data = self.dset[tuple(read_sel)]
+        for axis, p in enumerate(post):
+            if p is not None:
+                data = np.take(data, p, axis=axis)
+        return _retype_for_read(data)
+
+    def __getitem__(self, sel):
+        # Compose simple (per-axis) selections without reading data;
+        # this keeps the field deferred through AxisManager.restrict.
+        if not isinstance(sel, tuple):
+            sel = (sel,)
+        n_arr = sum([isinstance(s, np.ndarray) for s in sel])
+        if len(sel) > len(self.sel) or n_arr > 1 or \
+           not all([isinstance(s, slice) or
+                    (isinstance(s, np.ndarray) and s.ndim == 1)
+                    for s in sel]):
+            return self.load()[sel]
+        new_sel = []
+        for s0, n, s in zip(self.sel, self.shape,
+                            sel + (slice(None),) * (len(self.sel) - len(sel))):
+            if _is_full(s, n):
+                new_sel.append(s0)
+                continue
+            s = _normalize_selector(s, n)
+            if isinstance(s0, slice) and isinstance(s, slice):
+                new_sel.append(slice(s0.start + s.start, s0.start + s.stop))
+            elif isinstance(s0, slice):
+                new_sel.append(s0.start + s)
+            else:
+                new_sel.append(s0[s])
+        output = copy.copy(self)
+        output.sel = tuple(new_sel)
+        return output
+
+
+def _read_rangesmatrix(src, sel):
+    rm_flat = {k: src[k][:] for k in ['shape', 'intervals', 'ends']}
+    shape = rm_flat['shape']
+    sel = list(sel)
+    if len(shape) > 1 and len(sel) and not _is_full(sel[0], shape[0]):
+        # Select rows before expanding, rather than after.
+        index = _normalize_selector(sel[0], shape[0])
+        if isinstance(index, slice):
+            index = np.arange(index.start, index.stop)
+        rm_flat = _select_RangesMatrix_rows(rm_flat, index)
+        sel[0] = slice(None)
+    rm = expand_RangesMatrix(rm_flat)
+    if not all([_is_full(s, n) for s, n in zip(sel, shape)]):
+        rm = rm[AxisManager._broadcast_selector(sel)]
+    return rm
+
+
+def _load_axisman(src, group=None, cls=None, fields=None, restrict=None,
+                  lazy=False, _reopen=False):
+    """
+    See AxisManager.load.  If _reopen, deferred fields do not keep
+    the file open (see _H5DeferredArray).
     """
     if cls is None:
         cls = AxisManager
@@ -278,6 +531,7 @@ def _load_axisman(src, group=None, cls=None, fields=None):
             src = f[group]
     else:
         f = None
+    reopen = _reopen or (lazy and f is not None)
 
     info = json.loads(src.attrs['_axisman'])
     assert(info['version'] == 0)
@@ -291,46 +545,84 @@ def _load_axisman(src, group=None, cls=None, fields=None):
     if '_units' in src.attrs:
         units = json.loads(src.attrs['_units'])
 
-    # Reconstruct axes.
+    # Reconstruct axes, applying any restrictions.
     axes = []
+    sels = {}
     for item in schema:
         if item['encoding'] == 'axis':
             if item['type'] == 'label':
-                axes.append((LabelAxis(*item['args'])))
+                ax = LabelAxis(*item['args'])
             elif item['type'] == 'offset':
-                axes.append((OffsetAxis(*item['args'])))
+                ax = OffsetAxis(*item['args'])
             elif item['type'] == 'index':
-                axes.append((IndexAxis(*item['args'])))
+                ax = IndexAxis(*item['args'])
+            if restrict is not None and ax.name in restrict:
+                count = ax.count
+                ax, sl = ax.restriction(restrict[ax.name])
+                sels[ax.name] = _normalize_selector(sl, count)
+            axes.append(ax)
     axisman = cls(*axes)
+
+    # Each data field is decoded by a function, called when the field
+    # is wrapped below.
+    readers = []
     for item in schema:
         subfields = _get_subfields(fields, item['name'])
         if (fields is not None) and (item['name'] not in fields) and subfields is None:
             continue
+        name = item['name']
+        sel = tuple([sels.get(a, slice(None)) for a in item.get('axes', [])])
+        if item['encoding'] in ['ndarray', 'quantity']:
+            def reader(name=name, sel=sel, encoding=item['encoding']):
+                x = _H5DeferredArray(src[name], sel, reopen=reopen)
+                if encoding == 'quantity':
+                    return x.load() << u.Unit(units[name])
+                if lazy:
+                    return x
+                return x.load()
+        elif item['encoding'] == 'axisman':
+            def reader(name=name, subfields=subfields,
+                       special_axes=item.get('special_axes')):
+                x = _load_axisman(src[name], fields=subfields,
+                                  restrict=restrict, lazy=lazy,
+                                  _reopen=reopen)
+                if special_axes is not None:
+                    x = FlagManager.promote(x, *special_axes)
+                return x
+        elif item['encoding'] == 'rangesmatrix':
+            def reader(name=name, sel=sel):
+                return _read_rangesmatrix(src[name], sel)
+        elif item['encoding'] == 'csrarray':
+            def reader(name=name, sel=sel):
+                x = src[name]
+                csr_flat = {k: x[k][:] for k in ['shape', 'data', 'indices', 'indptr']}
+                x = expand_csr_array(csr_flat)
+                if not all([_is_full(s, n) for s, n in zip(sel, x.shape)]):
+                    x = x[AxisManager._broadcast_selector(
+                        [_normalize_selector(s, n) for s, n in zip(sel, x.shape)])]
+                return x
+        else:
+            reader = None
+        readers.append((item, reader))
+
+    for item, reader in readers:
         assign = [(i, a) for i, a in enumerate(item.get('axes', [])) if a is not None]
+        if reader is not None:
+            x = reader()
         if item['encoding'] == 'axis':
             pass
         elif item['encoding'] == 'scalar':
             axisman.wrap(item['name'], scalars[item['name']])
-        elif item['encoding'] == 'ndarray':
-            axisman.wrap(item['name'], _retype_for_read(src[item['name']][:]), assign)
-        elif item['encoding'] == 'quantity':
-            axisman.wrap(item['name'], _retype_for_read(src[item['name']][:]) << u.Unit(units[item['name']]), assign)
+        elif item['encoding'] in ['ndarray', 'quantity', 'rangesmatrix',
+                                  'csrarray']:
+            axisman.wrap(item['name'], x, assign)
         elif item['encoding'] == 'scalar_quantity':
             axisman.wrap(item['name'], scalars[item['name']] << u.Unit(units[item['name']]), assign)
         elif item['encoding'] == 'axisman':
-            x = _load_axisman(src[item['name']], fields=subfields)
-            if item['subclass'] == 'FlagManager':
-                x = FlagManager.promote(x, *item['special_axes'])
             axisman.wrap(item['name'], x)
-        elif item['encoding'] == 'rangesmatrix':
-            x = src[item['name']]
-            rm_flat = {k: x[k][:] for k in ['shape', 'intervals', 'ends']}
-            axisman.wrap(item['name'], expand_RangesMatrix(rm_flat), assign)
-        elif item['encoding'] == 'csrarray':
-            x = src[item['name']]
-            csr_flat = {k: x[k][:] for k in ['shape', 'data', 'indices', 'indptr']}
-            axisman.wrap(item['name'], expand_csr_array(csr_flat), assign)
         else:
             print('No decoder for:', item)
 
+    if f is not None:
+        f.close()
     return axisman
@@ -2,11 +2,13 @@ from collections import OrderedDict as odict
 import yaml
 import os
 import importlib
+import json
 import logging
+import threading
 import numpy as np
 
 from . import metadata
-from .util import tag_substr
+from .util import tag_substr, get_multi_index
 from .axisman import AxisManager, OffsetAxis, AxisInterface
 
 logger = logging.getLogger(__name__)
@@ -76,6 +78,9 @@ class Context(odict):
         self.obsfiledb = None
         self.obs_detdb = None
 
+        # Set to a MetaCache to memoize get_meta results.
+        self.meta_cache = None
+
         for to_import in self.get('imports', []):
             importlib.import_module(to_import)
 
@@ -138,8 +143,9 @@ class Context(odict):
                     db_file = os.path.join(os.path.split(self.filename)[0], db_file)
                 db_file = os.path.abspath(db_file)
                 logger.info(f'Loading {key} from {self[key]} -> {db_file}.')
+                in_memory = key in self.get('in_memory_dbs', [])
                 try:
-                    db = cls.from_file(db_file, force_new_db=False)
+                    db = cls.from_file(db_file, force_new_db=in_memory)
                 except Exception as e:
                     logger.error(f'DB failure when loading {key} from {self[key]} -> {db_file}\n')
                     raise e
@@ -161,6 +167,7 @@ class Context(odict):
                 free_tags=None,
                 no_signal=None,
                 loader_type=None,
+                n_threads=None,
     ):
         """Load TOD and supporting metadata for some observation.
 
@@ -202,6 +209,10 @@ class Context(odict):
           loader_type (str): Name of the registered TOD loader
             function to use (this will override whatever is specified
             in context.yaml).
+          n_threads (int): Number of worker threads the TOD loader may
+            use to decode data in parallel (e.g. one detset per
+            thread, for obs-book data).  If None, this is not passed
+            to the loader and the loader default (serial) is used.
 
         Notes:
           It is acceptable to pass the ``obs_id`` argument by position
@@ -280,8 +291,12 @@ class Context(odict):
         if loader_type is None:
             loader_type = self.get('obs_loader_type', 'default')
         loader_func = OBSLOADER_REGISTRY[loader_type]  # Register your loader?
+        loader_kwargs = {}
+        if n_threads is not None:
+            loader_kwargs['n_threads'] = n_threads
         aman = loader_func(self.obsfiledb, obs_id, dets=dets,
-                           samples=samples, no_signal=no_signal)
+                           samples=samples, no_signal=no_signal,
+                           **loader_kwargs)
 
         if aman is None:
             return meta
@@ -354,6 +369,14 @@ class Context(odict):
           try to re-use entries already present rather than loading
           them a second time.
 
+          If self.meta_cache is set to a :class:`MetaCache`, the
+          metadata for all detectors in the observation are loaded
+          on the first request and kept in the cache; this and later
+          requests for the same observation (e.g. for each detset in
+          turn) are then served by restricting a copy of the cached
+          AxisManager.  If loading the full metadata fails, the
+          request is loaded directly instead.
+
         """
         def _warn_conflict(preamble, **kwargs):
             fails = {k: v for k, v in kwargs.items() if v is not None}
@@ -408,6 +431,42 @@ class Context(odict):
             if 'samps' in meta:
                 samples = meta.samps.offset, meta.samps.offset + meta.samps.count
 
+        # Make the request for SuperLoader
+        request = {'obs:obs_id': obs_id}
+        if detsets is not None:
+            request['dets:detset'] = detsets
+        _add_dets_request(request, dets)
+
+        metadata_list = self._get_warn_missing('metadata', [])
+        meta = None
+        if self.meta_cache is not None and not check:
+            meta = self._get_meta_cached(
+                metadata_list, request, free_tags, free_tag_fields,
+                det_info_scan, ignore_missing, on_missing)
+        if meta is None:
+            det_info = self._get_base_det_info(obs_id)
+            meta = self.loader.load(metadata_list, request, det_info=det_info, check=check,
+                                    free_tags=free_tags, free_tag_fields=free_tag_fields,
+                                    det_info_scan=det_info_scan, ignore_missing=ignore_missing,
+                                    on_missing=on_missing)
+        if check:
+            return meta
+
+        if samples is not None:
+            if 'samps' in meta:
+                meta.restrict('samps', slice(*samples))
+            else:
+                start, stop = samples
+                assert(start >= 0 and stop >= 0)  # This could be loosened using obsfiledb
+                axm = AxisManager(OffsetAxis('samps', stop - start, start, obs_id))
+                meta = meta.merge(axm)
+        return meta
+
+    def _get_base_det_info(self, obs_id):
+        """Get the det_info for obs_id from the detdb and obsfiledb, to
+        seed the metadata loader.
+
+        """
         # Call a hook after preparing obs_id but before loading obs
         self._call_hook('before-use-detdb', obs_id=obs_id)
 
@@ -434,45 +493,134 @@ class Context(odict):
         detsets_info = self.obsfiledb.get_det_table(obs_id)
         det_info = metadata.merge_det_info(det_info, detsets_info)
 
-        # Make the request for SuperLoader
-        request = {'obs:obs_id': obs_id}
-        if detsets is not None:
-            request['dets:detset'] = detsets
+        return det_info
+
+    def get_meta_batch(self,
+                       obs_ids,
+                       dets=None,
+                       free_tags=None,
+                       ignore_missing=False,
+                       on_missing=None,
+                       det_info_scan=False,
+                       on_error='raise'):
+        """Load supporting metadata for several observations.
+
+        This returns the same thing as calling :func:`get_meta` for
+        each obs_id, but each metadata entry is processed for all the
+        observations at once (see :meth:`SuperLoader.load_batch`), so
+        ManifestDb queries are combined and each metadata file and
+        dataset is read only once, even when it is shared by many
+        observations.
 
-        # Convert dets argument to request entry(s)
-        if isinstance(dets, dict):
-            for k, v in dets.items():
-                if not k.startswith('dets:'):
-                    k = 'dets:' + k
-                if k in request:
-                    raise ValueError(f'Duplicate specification of dets field "{k}"')
-                request[k] = v
-        elif isinstance(dets, metadata.ResultSet):
-            request['dets:readout_id'] = dets['readout_id']
-        elif hasattr(dets, '__getitem__'):
-            # lists, tuples, arrays ...
-            request['dets:readout_id'] = dets
-        elif dets is not None:
-            # Try a cast ...
-            request['dets:readout_id'] = list(dets)
+        Args:
+          obs_ids (list of str): The observations.  As in get_meta,
+            each may carry colon-coded free tags.
+          dets, free_tags, ignore_missing, on_missing, det_info_scan:
+            As in get_meta; these apply to all observations.
+          on_error (str): 'raise' to raise the first error
+            encountered; 'return' to put the Exception in place of the
+            result for any observation that fails.
+
+        Returns:
+          A list with the metadata AxisManager (or Exception) for each
+          obs_id.
 
+        """
+        free_tag_fields = self.get('obs_colon_tags', [])
         metadata_list = self._get_warn_missing('metadata', [])
-        meta = self.loader.load(metadata_list, request, det_info=det_info, check=check,
-                                free_tags=free_tags, free_tag_fields=free_tag_fields,
-                                det_info_scan=det_info_scan, ignore_missing=ignore_missing,
-                                on_missing=on_missing)
-        if check:
-            return meta
 
-        if samples is not None:
-            if 'samps' in meta:
-                meta.restrict('samps', slice(*samples))
+        # Group the observations by free tags, which the loader
+        # applies to a whole batch.
+        groups = {}
+        for i, obs_id in enumerate(obs_ids):
+            tags = list(free_tags) if free_tags else []
+            if ':' in obs_id:
+                tokens = obs_id.split(':')
+                obs_id = tokens[0]
+                tags.extend(tokens[1:])
+            groups.setdefault(tuple(tags), []).append((i, obs_id))
+
+        results = [None] * len(obs_ids)
+        for tags, group in groups.items():
+            requests, det_infos, index = [], [], []
+            for i, obs_id in group:
+                try:
+                    det_info = self._get_base_det_info(obs_id)
+                    request = {'obs:obs_id': obs_id}
+                    _add_dets_request(request, dets)
+                except Exception as e:
+                    if on_error == 'raise':
+                        raise
+                    results[i] = e
+                    continue
+                requests.append(request)
+                det_infos.append(det_info)
+                index.append(i)
+            metas = self.loader.load_batch(
+                metadata_list, requests, det_info=det_infos,
+                free_tags=list(tags), free_tag_fields=free_tag_fields,
+                det_info_scan=det_info_scan, ignore_missing=ignore_missing,
+                on_missing=on_missing, on_error=on_error)
+            for i, meta in zip(index, metas):
+                results[i] = meta
+        return results
+
+    def _get_meta_cached(self, metadata_list, request, free_tags,
+                         free_tag_fields, det_info_scan, ignore_missing,
+                         on_missing):
+        """Serve a get_meta request from self.meta_cache, loading
+        the unrestricted metadata for the observation if needed.  The
+        base det_info is only looked up on a cache miss.  Returns None
+        if the unrestricted metadata could not be loaded.
+
+        """
+        obs_id = request['obs:obs_id']
+        key = (obs_id, det_info_scan, ignore_missing,
+               json.dumps([metadata_list, on_missing], sort_keys=True,
+                          default=str))
+        full = self.meta_cache.get(key)
+        if full is None:
+            det_info = self._get_base_det_info(obs_id)
+            try:
+                full = self.loader.load(metadata_list, {'obs:obs_id': obs_id},
+                                        det_info=det_info,
+                                        det_info_scan=det_info_scan,
+                                        ignore_missing=ignore_missing,
+                                        on_missing=on_missing)
+            except Exception as e:
+                logger.info(f'Could not load full metadata for {obs_id} '
+                            f'for caching ({e}); loading the request directly.')
+                return None
+            self.meta_cache.put(key, full)
+
+        # Apply the free tags and dets:* selections, as the loader would.
+        info = dict(_unpack_det_info(full.det_info))
+        mask = np.ones(full.dets.count, bool)
+        for tag in free_tags:
+            matched = False
+            for field in free_tag_fields:
+                if field in info:
+                    s = (np.asarray(info[field]) == tag)
+                    if s.any():
+                        mask *= s
+                        matched = True
+            if not matched:
+                raise RuntimeError(
+                    f'One or more free tags was left unconsumed: {[tag]}')
+        for k, v in request.items():
+            if not k.startswith('dets:'):
+                continue
+            k = k[5:]
+            if k not in info:
+                raise RuntimeError(
+                    f'One or more dets:* selections was left unconsumed: {["dets:" + k]}')
+            if isinstance(v, (list, tuple, np.ndarray)):
+                mask *= (get_multi_index(v, info[k]) >= 0)
             else:
-                start, stop = samples
-                assert(start >= 0 and stop >= 0)  # This could be loosened using obsfiledb
-                axm = AxisManager(OffsetAxis('samps', stop - start, start, obs_id))
-                meta = meta.merge(axm)
-        return meta
+                mask *= (np.asarray(info[k]) == v)
+        if not mask.any():
+            logger.warning(f'All detectors have been eliminated from processing.')
+        return full.restrict('dets', full.dets.vals[mask], in_place=False)
 
     def get_det_info(self,
                      obs_id=None,
@@ -492,24 +640,113 @@ class Context(odict):
                                  filename=filename, detsets=detsets, free_tags=free_tags,
                                  on_missing=on_missing, det_info_scan=True)
         # Convert
-        def _unpack(aman):
-            items = []
-            for k in aman.keys():
-                if isinstance(aman[k], AxisManager):
-                    sub_items = _unpack(aman[k])
-                    for _k, _c in sub_items:
-                        items.append((f'{k}.{_k}', _c))
-                elif isinstance(aman[k], AxisInterface):
-                    pass
-                else:
-                    items.append((k, aman[k]))
-            return items
-
-        items = _unpack(meta.det_info)
+        items = _unpack_det_info(meta.det_info)
         return metadata.ResultSet([k for k, v in items],
                                   zip(*[v for k, v in items]))
 
 
+class MetaCache:
+    """LRU cache for Context.get_meta.  Holds the unrestricted
+    metadata AxisManager of recently used observations, up to a total
+    of max_bytes (the least recently used entries are evicted first;
+    a single entry larger than max_bytes is not kept).  To use it::
+
+      ctx = Context('context.yaml')
+      ctx.meta_cache = MetaCache(max_bytes=2e9)
+
+    Call clear() if the underlying databases or files change.
+
+    """
+    def __init__(self, max_bytes=1e9):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._items = odict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._items.move_to_end(key)
+            return self._items[key][0]
+
+    def put(self, key, aman):
+        nbytes = _aman_nbytes(aman)
+        with self._lock:
+            if key in self._items:
+                self.nbytes -= self._items.pop(key)[1]
+            if nbytes > self.max_bytes:
+                return
+            self._items[key] = (aman, nbytes)
+            self.nbytes += nbytes
+            while self.nbytes > self.max_bytes:
+                _, (_, n) = self._items.popitem(last=False)
+                self.nbytes -= n
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
+
+
+def _add_dets_request(request, dets):
+    """Convert the dets argument of get_obs / get_meta to request
+    entry(s).
+
+    """
+    if isinstance(dets, dict):
+        for k, v in dets.items():
+            if not k.startswith('dets:'):
+                k = 'dets:' + k
+            if k in request:
+                raise ValueError(f'Duplicate specification of dets field "{k}"')
+            request[k] = v
+    elif isinstance(dets, metadata.ResultSet):
+        request['dets:readout_id'] = dets['readout_id']
+    elif hasattr(dets, '__getitem__'):
+        # lists, tuples, arrays ...
+        request['dets:readout_id'] = dets
+    elif dets is not None:
+        # Try a cast ...
+        request['dets:readout_id'] = list(dets)
+
+
+def _unpack_det_info(aman):
+    # Flatten a det_info AxisManager into a list of (key, array),
+    # with keys for nested AxisManagers joined by '.'.
+    items = []
+    for k in aman.keys():
+        if isinstance(aman[k], AxisManager):
+            sub_items = _unpack_det_info(aman[k])
+            for _k, _c in sub_items:
+                items.append((f'{k}.{_k}', _c))
+        elif isinstance(aman[k], AxisInterface):
+            pass
+        else:
+            items.append((k, aman[k]))
+    return items
+
+
+def _aman_nbytes(aman):
+    # Approximate memory footprint of an AxisManager.
+    total = 0
+    for v in aman._fields.values():
+        if isinstance(v, AxisManager):
+            total += _aman_nbytes(v)
+        else:
+            total += getattr(v, 'nbytes', 0)
+    for ax in aman._axes.values():
+        total += getattr(getattr(ax, 'vals', None), 'nbytes', 0)
+    return total
+
+
 def _read_cfg(filename=None, envvar=None, default=None):
     """Load a YAML file.  If filename is None, use the filename specified
     in the environment variable called envvar.  If that is not defined
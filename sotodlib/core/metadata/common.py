@@ -2,6 +2,13 @@ import sqlite3
 import gzip
 import os
 
+#: Memory-map size (bytes) requested for read-only database connections.
+SQLITE_MMAP_SIZE = 256 * 2**20
+
+#: Page cache size requested for read-only database connections.  As
+#: per sqlite convention, a negative number is a size in KiB.
+SQLITE_CACHE_SIZE = -64 * 2**10
+
 
 def sqlite_to_file(db, filename, overwrite=True, fmt=None):
     """Write an sqlite db to file.  Supports several output formats.
@@ -27,9 +34,15 @@ def sqlite_to_file(db, filename, overwrite=True, fmt=None):
         if os.path.exists(filename):
             os.remove(filename)
         new_db = sqlite3.connect(filename)
-        script = ' '.join(db.iterdump())
-        new_db.executescript(script)
-        new_db.commit()
+        if db.in_transaction:
+            # The backup API would wait for the transaction to finish;
+            # dump the database instead (uncommitted changes included).
+            script = ' '.join(db.iterdump())
+            new_db.executescript(script)
+            new_db.commit()
+        else:
+            db.backup(new_db)
+        new_db.close()
     elif fmt == 'dump':
         with open(filename, 'w') as fout:
             for line in db.iterdump():
@@ -60,10 +73,12 @@ def sqlite_from_file(filename, fmt=None, force_new_db=True):
         if filename.endswith('.gz'):
             fmt = 'gz'
     if fmt == 'sqlite':
-        db0 = sqlite3.connect(f'file:{filename}?mode=ro', uri=True)
+        db0 = sqlite_connect_readonly(filename)
         if not force_new_db:
             return db0
-        data = ' '.join(db0.iterdump())
+        db = sqlite_to_memory(db0)
+        db0.close()
+        return db
     elif fmt == 'dump':
         with open(filename, 'r') as fin:
             data = fin.read()
@@ -76,3 +91,111 @@ def sqlite_from_file(filename, fmt=None, force_new_db=True):
     db.executescript(data)
     return db
 
+
+
+def sqlite_tune_readonly(conn, mmap_size=None, cache_size=None):
+    """Set pragmas on an sqlite3.Connection that will only be used for
+    lookups: memory-mapped I/O, a larger page cache, and query_only
+    (so that any attempt to write fails immediately).
+
+    Args:
+      conn (sqlite3.Connection): the connection.
+      mmap_size (int): bytes of the file to memory-map; defaults to
+        SQLITE_MMAP_SIZE.
+      cache_size (int): page cache size, in the sqlite pragma
+        convention (negative for KiB); defaults to SQLITE_CACHE_SIZE.
+
+    Returns:
+      The connection.
+
+    """
+    if mmap_size is None:
+        mmap_size = SQLITE_MMAP_SIZE
+    if cache_size is None:
+        cache_size = SQLITE_CACHE_SIZE
+    conn.execute(f'pragma mmap_size={int(mmap_size)}')
+    conn.execute(f'pragma cache_size={int(cache_size)}')
+    conn.execute('pragma query_only=1')
+    return conn
+
+
+def sqlite_connect_readonly(filename, in_memory=False):
+    """Open an sqlite database file in read-only mode, and return the
+    sqlite3.Connection.
+
+    Args:
+      filename (str): path to the file.
+      in_memory (bool): If True, the database is copied into memory
+        (see sqlite_to_memory) and the file is closed.  This is
+        worthwhile for small databases that are queried heavily.
+
+    The connection is tuned with sqlite_tune_readonly.  In the
+    in_memory case the copy is left writable, so that the caller can
+    add indexes to it; call sqlite_tune_readonly when done.
+
+    """
+    conn = sqlite3.connect(f'file:{filename}?mode=ro', uri=True)
+    if in_memory:
+        db = sqlite_to_memory(conn)
+        conn.close()
+        return db
+    return sqlite_tune_readonly(conn)
+
+
+def sqlite_to_memory(conn):
+    """Copy an sqlite database into a new :memory: database, and return
+    the new sqlite3.Connection.  This uses the sqlite backup API,
+    which copies the pages directly and is much faster than
+    re-running a dump of the database.
+
+    """
+    db = sqlite3.connect(':memory:')
+    conn.backup(db)
+    return db
+
+
+def sqlite_list_tables(conn):
+    """Return the names of the (non-internal) tables in an sqlite
+    database.
+
+    """
+    return [r[0] for r in conn.execute(
+        "select name from sqlite_master where type='table' "
+        "and name not like 'sqlite_%'")]
+
+
+def sqlite_create_indexes(conn, index_defs, commit=True, tables=None):
+    """Create indexes in an sqlite database, if they do not already
+    exist.
+
+    Args:
+      conn (sqlite3.Connection): the connection.
+      index_defs (dict): Maps index name to the index target,
+        e.g. {'files_obs_id': '`files` (`obs_id`)'}.
+      commit (bool): Whether to commit when done.
+      tables (list): If not None, only create the indexes on these
+        tables (e.g. the tables that were just created).
+
+    Returns:
+      The list of index names that are present (indexes that could
+      not be created, for example because the connection is read-only
+      or the table does not exist, are left out).
+
+    """
+    if conn.execute('pragma query_only').fetchone()[0]:
+        return []
+    present = []
+    for name, target in index_defs.items():
+        if tables is not None and target.split('`')[1] not in tables:
+            continue
+        try:
+            conn.execute(f'create index if not exists `{name}` on {target}')
+        except sqlite3.OperationalError:
+            continue
+        present.append(name)
+    if commit and len(present):
+        try:
+            conn.commit()
+        except sqlite3.OperationalError:
+            return []
+    return present
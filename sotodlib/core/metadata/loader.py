@@ -66,6 +66,10 @@ class SuperLoader:
         self.obsdb = obsdb
         self.manifest_cache = {}
         self.working_dir = working_dir
+        # Copy sqlite ManifestDbs into memory when first used?
+        self.in_memory_manifests = (
+            context is not None and
+            'metadata' in context.get('in_memory_dbs', []))
 
     @staticmethod
     def register_metadata(name, loader_class):
@@ -136,17 +140,21 @@ class SuperLoader:
           already applied.
 
         """
-        if isinstance(spec, dict):
-            spec = MetadataSpec.from_dict(spec)
+        result = self.load_one_batch(spec, [request], [det_info])[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
 
-        # Load the database, match the request,
+    def _get_manifest(self, spec):
+        # Returns (ManifestDb, dbpath) for a MetadataSpec.
         if isinstance(spec.db, str):
             # The usual case.
             dbfile = os.path.join(self.working_dir, spec.db)
             dbpath = os.path.split(dbfile)[0]
             if dbfile not in self.manifest_cache:
                 if dbfile.endswith('sqlite'):
-                    man = core.metadata.ManifestDb.readonly(dbfile)
+                    man = core.metadata.ManifestDb.readonly(
+                        dbfile, in_memory=self.in_memory_manifests)
                 else:
                     man = core.metadata.ManifestDb.from_file(dbfile)
                 self.manifest_cache[dbfile] = man
@@ -155,53 +163,173 @@ class SuperLoader:
             # Useful for testing and hacking
             dbpath = self.working_dir
             man = spec.db
+        return man, dbpath
+
+    def load_one_batch(self, spec, requests, det_infos):
+        """Process a single metadata entry (spec) for several requests
+        (e.g. different observations) at once.  This is equivalent to
+        calling load_one for each (request, det_info) pair, but the
+        ManifestDb is queried once for all the requests, and each
+        Loader's batch_from_loadspec is called once with the index
+        data of all the requests (so that, e.g., each HDF5 file and
+        dataset is read only once).
+
+        Returns:
+          A list with one entry per request: either the loaded item,
+          or the Exception raised while trying to load it.
+
+        """
+        if isinstance(spec, dict):
+            spec = MetadataSpec.from_dict(spec)
+
+        # Load the database, match the requests,
+        try:
+            man, dbpath = self._get_manifest(spec)
+        except Exception as e:
+            return [e] * len(requests)
+        outputs = [None] * len(requests)
 
-        # Do we have all the keys we need?
         required_obs_keys = _filter_items(
             'obs:', man.scheme.get_required_params(), remove=False)
-        missing_obs_keys = (set(required_obs_keys) - set(request.keys()))
-        if len(missing_obs_keys):
-            raise RuntimeError(
-                f'Metadata request is indexed by {request.keys()} but '
-                f'ManifestDb requires {required_obs_keys}.')
-
         required_dets_keys = _filter_items(
             'dets:', man.scheme.get_required_params(), remove=False)
-        missing_dets_keys = list((set(required_dets_keys) - set(request.keys())))
-
-        if len(missing_dets_keys):
-            # Make request to ManifestDb for each detector bundle.
-            short_keys = _filter_items('dets:', missing_dets_keys)
-            try:
-                subreqs = det_info.subset(keys=short_keys).distinct()
-            except:
-                raise RuntimeError(
-                    f'Metadata request requires keys={missing_dets_keys} '
-                    f'but det_info={det_info}.')
-            subreqs.keys = missing_dets_keys # back with dets: prefix ...
-        else:
-            subreqs = ResultSet([], [()])  # length 1!
 
-        index_lines = []
-        for subreq in subreqs:
-            # Reject any subreq that explicitly contradicts request on any key.
-            if any([subreq.get(k, v) != v for k, v in request.items()]):
+        # Gather the sub-requests of all requests.
+        subreqs_all, owners = [], []
+        for i, (request, det_info) in enumerate(zip(requests, det_infos)):
+            # Do we have all the keys we need?
+            missing_obs_keys = (set(required_obs_keys) - set(request.keys()))
+            if len(missing_obs_keys):
+                outputs[i] = RuntimeError(
+                    f'Metadata request is indexed by {request.keys()} but '
+                    f'ManifestDb requires {required_obs_keys}.')
                 continue
-            subreq.update(request)
 
-            try:
-                _lines = man.match(subreq, multi=True, prefix=dbpath)
-            except Exception as e:
-                text = str(e)
-                raise LoaderError('Exception when matching subrequest.',
-                                  f"An exception occurred while processing sub-request:\n\n"
-                                  f"  subreq={subreq}\n\n")
+            missing_dets_keys = list((set(required_dets_keys) - set(request.keys())))
+            if len(missing_dets_keys):
+                # Make request to ManifestDb for each detector bundle.
+                short_keys = _filter_items('dets:', missing_dets_keys)
+                try:
+                    subreqs = det_info.subset(keys=short_keys).distinct()
+                except:
+                    outputs[i] = RuntimeError(
+                        f'Metadata request requires keys={missing_dets_keys} '
+                        f'but det_info={det_info}.')
+                    continue
+                subreqs.keys = missing_dets_keys # back with dets: prefix ...
+            else:
+                subreqs = ResultSet([], [()])  # length 1!
+
+            for subreq in subreqs:
+                # Reject any subreq that explicitly contradicts request on any key.
+                if any([subreq.get(k, v) != v for k, v in request.items()]):
+                    continue
+                subreq.update(request)
+                subreqs_all.append(subreq)
+                owners.append(i)
+
+        try:
+            matches = man.match_many(subreqs_all, prefix=dbpath)
+        except Exception:
+            # Redo them one at a time, to pin errors on the right request.
+            matches = []
+            for subreq, i in zip(subreqs_all, owners):
+                try:
+                    matches.append(man.match(subreq, multi=True, prefix=dbpath))
+                except Exception as e:
+                    matches.append([])
+                    if outputs[i] is None:
+                        outputs[i] = LoaderError(
+                            'Exception when matching subrequest.',
+                            f"An exception occurred while processing sub-request:\n\n"
+                            f"  subreq={subreq}\n\n")
+
+        index_lines = [[] for _ in requests]
+        for subreq, i, _lines in zip(subreqs_all, owners, matches):
             for _line in _lines:
                 # Now reject any _line if they contradict subreq.
                 if any([subreq.get(k, v) != v for k, v in _line.items()]):
                     continue
                 _line.update(subreq)
-                index_lines.append(_line)
+                index_lines[i].append(_line)
+
+        # Plan the loads for each request.
+        jobs = []
+        for i, (request, det_info) in enumerate(zip(requests, det_infos)):
+            if outputs[i] is not None:
+                continue
+            try:
+                jobs.extend([(i, line) for line in self._screen_index_lines(
+                    man, dbpath, request, det_info, index_lines[i])])
+            except Exception as e:
+                outputs[i] = e
+
+        # Load the index_lines, in one batch per loader.
+        by_loader = {}
+        for job in jobs:
+            loader = spec.loader
+            if loader is None:
+                loader = job[1].get('loader', REGISTRY['_default'])
+            by_loader.setdefault(loader, []).append(job)
+
+        loader_kwargs = {}
+        if spec.load_fields is not None:
+            loader_kwargs['load_fields'] = spec.load_fields
+        loaded = {}
+        for loader, _jobs in by_loader.items():
+            try:
+                loader_class = REGISTRY[loader]
+            except KeyError:
+                for i, _ in _jobs:
+                    outputs[i] = LoaderError(
+                        'Loader function not found.',
+                        f'No metadata loader registered under name "{loader}"')
+                continue
+            loader_object = loader_class()  # pass obs info?
+            _jobs = [job for job in _jobs if outputs[job[0]] is None]
+            try:
+                items = loader_object.batch_from_loadspec(
+                    [line for i, line in _jobs], **loader_kwargs)
+            except Exception:
+                # Redo them one at a time, to pin errors on the right request.
+                items = []
+                for i, line in _jobs:
+                    try:
+                        items.append(loader_object.from_loadspec(line, **loader_kwargs))
+                    except Exception as e:
+                        items.append(e)
+            for job, item in zip(_jobs, items):
+                loaded[id(job)] = item
+
+        # Restrict and combine the results for each request.
+        results = [[] for _ in requests]
+        for job in jobs:
+            i, index_line = job
+            if outputs[i] is not None:
+                continue
+            mi1 = loaded[id(job)]
+            try:
+                if isinstance(mi1, Exception):
+                    raise mi1
+                results[i].append(self._restrict_item(
+                    spec, mi1, index_line, det_infos[i]))
+            except Exception as e:
+                outputs[i] = e
+
+        for i, result in enumerate(results):
+            if outputs[i] is not None:
+                continue
+            # Check that we got results, then combine them in to single ResultSet.
+            logger.debug(f'Concatenating {len(result)} results: {result}')
+            assert(len(result) > 0)
+            if len(result) == 1:
+                outputs[i] = result[0]
+            else:
+                outputs[i] = result[0].concatenate(result)
+        return outputs
+
+    def _screen_index_lines(self, man, dbpath, request, det_info, index_lines):
+        # Returns the index_lines that need to be loaded for a request.
 
         # Pre-screen the index_lines for dets:* assignments; plan to
         # skip lines that aren't relevant according to det_info.
@@ -225,7 +353,7 @@ class SuperLoader:
             # metadata (even though we'll throw out all the actual
             # results).  You can get here if someone passes dets=[].
             candidate_index_lines = man.inspect(request, False, prefix=dbpath)
-            index_lines.append(candidate_index_lines[0])
+            index_lines = [candidate_index_lines[0]]
             to_skip = [False]
 
         elif all(to_skip):
@@ -233,94 +361,70 @@ class SuperLoader:
             # the output.
             to_skip[0] = False
 
-        # Load each index_line.
-        results = []
+        output = []
         for skip, index_line in zip(to_skip, index_lines):
             if skip:
                 logger.debug(f'Skipping load for index_line={index_line}')
                 continue
             logger.debug(f'Loading for index_line={index_line}')
-
-            loader = spec.loader
-            if loader is None:
-                loader = index_line.get('loader', REGISTRY['_default'])
-            try:
-                loader_class = REGISTRY[loader]
-            except KeyError:
-                raise LoaderError(
-                    'Loader function not found.',
-                    f'No metadata loader registered under name "{loader}"')
-
-            loader_object = loader_class()  # pass obs info?
-            loader_kwargs = {}
-            if spec.load_fields is not None:
-                loader_kwargs['load_fields'] = spec.load_fields
-            mi1 = loader_object.from_loadspec(index_line, **loader_kwargs)
-
-            # Restrict returned values according to the specs in index_line.
-
-            if isinstance(mi1, ResultSet):
-                # For simple tables, the restrictions can be
-                # integrated into the table, to be dealt with later.
-                det_restricts = _filter_items('dets:', index_line, remove=False)
-                mask = np.ones(len(mi1), bool)
-                keep_cols = list(mi1.keys)
-                new_cols = []
-                for k, v in det_restricts.items():
-                    if k in mi1.keys:
-                        mask *= (mi1[k] == v)
-                    else:
-                        new_cols.append((k, v))
-                a = mi1.subset(keys=keep_cols, rows=mask)
-                mi2 = ResultSet([k for k, v in new_cols],
-                                [[v for k, v in new_cols]] * len(a))
-                mi2.merge(a)
-
-            elif isinstance(mi1, core.AxisManager):
-                # For AxisManager, allow user to drop some items
-                # before proceeding.  This only catches fields at root
-                # level of the AxisManager.
-                for pattern in spec.drop_fields:
-                    to_drop = fnmatch.filter(mi1._fields.keys(), pattern)
-                    for k in to_drop:
-                        mi1.move(k, None)
-
-                # If the dets axis is present, it *must* reconcile
-                # 1-to-1 with some field in det_info, and that may be
-                # used to toss things out based on index_line.
-                if 'dets' in mi1:
-                    det_restricts = _filter_items('dets:', index_line, remove=True)
-                    dets_key = 'readout_id'
-                    new_dets, i_new, i_info = core.util.get_coindices(
-                        mi1.dets.vals, det_info[dets_key])
-
-                    mask = np.ones(len(i_new), bool)
-                    if len(i_info):
-                        for k, v in det_restricts.items():
-                            mask *= (det_info[k][i_info] == v)
-                    if mask.all() and len(new_dets) == mi1.dets.count:
-                        mi2 = mi1
-                    else:
-                        mi2 = mi1.restrict('dets', new_dets[mask])
+            output.append(index_line)
+        return output
+
+    def _restrict_item(self, spec, mi1, index_line, det_info):
+        # Restrict returned values according to the specs in index_line.
+
+        if isinstance(mi1, ResultSet):
+            # For simple tables, the restrictions can be
+            # integrated into the table, to be dealt with later.
+            det_restricts = _filter_items('dets:', index_line, remove=False)
+            mask = np.ones(len(mi1), bool)
+            keep_cols = list(mi1.keys)
+            new_cols = []
+            for k, v in det_restricts.items():
+                if k in mi1.keys:
+                    mask *= (mi1[k] == v)
                 else:
+                    new_cols.append((k, v))
+            a = mi1.subset(keys=keep_cols, rows=mask)
+            mi2 = ResultSet([k for k, v in new_cols],
+                            [[v for k, v in new_cols]] * len(a))
+            mi2.merge(a)
+
+        elif isinstance(mi1, core.AxisManager):
+            # For AxisManager, allow user to drop some items
+            # before proceeding.  This only catches fields at root
+            # level of the AxisManager.
+            for pattern in spec.drop_fields:
+                to_drop = fnmatch.filter(mi1._fields.keys(), pattern)
+                for k in to_drop:
+                    mi1.move(k, None)
+
+            # If the dets axis is present, it *must* reconcile
+            # 1-to-1 with some field in det_info, and that may be
+            # used to toss things out based on index_line.
+            if 'dets' in mi1:
+                det_restricts = _filter_items('dets:', index_line, remove=True)
+                dets_key = 'readout_id'
+                new_dets, i_new, i_info = core.util.get_coindices(
+                    mi1.dets.vals, det_info[dets_key])
+
+                mask = np.ones(len(i_new), bool)
+                if len(i_info):
+                    for k, v in det_restricts.items():
+                        mask *= (det_info[k][i_info] == v)
+                if mask.all() and len(new_dets) == mi1.dets.count:
                     mi2 = mi1
-
+                else:
+                    mi2 = mi1.restrict('dets', new_dets[mask])
             else:
-                raise LoaderError(
-                    'Invalid metadata carrier.',
-                    'Returned object is non-specialized type {}: {}'
-                    .format(mi1.__class__, mi1))
-
-            results.append(mi2)
-
-        # Check that we got results, then combine them in to single ResultSet.
-        logger.debug(f'Concatenating {len(results)} results: {results}')
-        assert(len(results) > 0)
-        if len(results) == 1:
-            result = results[0]
+                mi2 = mi1
+
         else:
-            result = results[0].concatenate(results)
-        return result
+            raise LoaderError(
+                'Invalid metadata carrier.',
+                'Returned object is non-specialized type {}: {}'
+                .format(mi1.__class__, mi1))
+        return mi2
 
     def load(self, spec_list, request, det_info=None, free_tags=[],
              free_tag_fields=[], dest=None, check=False, det_info_scan=False,
@@ -365,96 +469,64 @@ class SuperLoader:
           and returned to the caller.
 
         """
-        # Augmented request -- note that dets:* restrictions from
-        # request will be added back into this by check tags.
-        aug_request = _filter_items('obs:', request, False)
-
-        if on_missing is None:
-            on_missing = {}
+        return self.load_batch(
+            spec_list, [request], det_info=[det_info], free_tags=free_tags,
+            free_tag_fields=free_tag_fields, dest=[dest], check=check,
+            det_info_scan=det_info_scan, ignore_missing=ignore_missing,
+            on_missing=on_missing)[0]
+
+    def load_batch(self, spec_list, requests, det_info=None, free_tags=[],
+                   free_tag_fields=[], dest=None, check=False,
+                   det_info_scan=False, ignore_missing=False,
+                   on_missing=None, on_error='raise'):
+        """Like :meth:`load`, but for a list of requests (typically, one
+        per observation).  Each metadata entry is loaded for all the
+        requests at once, using :meth:`load_one_batch`; this avoids
+        repeating database queries and file reads that are shared
+        between observations.
 
-        if self.obsdb is not None and 'obs:obs_id' in request:
-            if dest is None:
-                dest = core.AxisManager()
-            obs_man = core.AxisManager()
-            obs_info = self.obsdb.get(request['obs:obs_id'], add_prefix='obs:')
-            if obs_info is None:
-                logger.warning(
-                    f"Observation {request['obs:obs_id']} not found in obsdb; "
-                    "trying to proceed anyway. You might have metadata failures.")
-                obs_man.wrap('obs_id', request['obs:obs_id'])
-            else:
-                obs_info.update(aug_request)
-                aug_request.update(obs_info)
-                for k, v in _filter_items('obs:', obs_info).items():
-                    obs_man.wrap(k, v)
-            dest.wrap('obs_info', obs_man)
-
-        def reraise(spec, e):
-            logger.error(
-                f"An error occurred while processing a meta entry:\n\n"
-                f"  spec:    {spec}\n\n"
-                f"  request: {request}\n\n")
-            if isinstance(e, LoaderError):
-                # Present all args to logger instead...
-                for a in e.args[1:]:
-                    logger.error(a)
-                e = LoaderError(e.args[0])
-            raise e
-
-        def check_tags(det_info, aug_request, final=False):
-            mask = np.ones(len(det_info), bool)
-            unmatched = list(free_tags)
-            for tag in free_tags:
-                for field in free_tag_fields:
-                    if field in det_info.keys:
-                        s = (det_info[field] == tag)
-                        if s.any():
-                            mask *= s
-                            unmatched.remove(tag)
-            if final and len(unmatched):
-                raise RuntimeError(
-                    f'One or more free tags was left unconsumed: {unmatched}')
-
-            det_reqs = _filter_items('dets:', request, True)
-            unmatched = []
-            for k, v in det_reqs.items():
-                if k in det_info.keys:
-                    if isinstance(v, (list, np.ndarray)):
-                        mask *= (core.util.get_multi_index(v, det_info[k]) >= 0)
-                    else:
-                        mask *= (det_info[k] == v)
-                        aug_request['dets:' + k] = v
-                else:
-                    unmatched.append('dets:' + k)
-            if final and len(unmatched):
-                raise RuntimeError(
-                    f'One or more dets:* selections was left unconsumed: {unmatched}')
+        Args:
+          spec_list (list of dicts): As in load.
+          requests (list of dict): The requests.
+          det_info (list): The det_info for each request.
+          dest (list or None): The dest for each request.
+          on_error (str): 'raise' to raise the first error
+            encountered; 'return' to return the Exception in place of
+            the result for any request that fails.
 
-            if not np.all(mask):
-                logger.debug(f' ... free tags / request reduce det_info (row count '
-                             f'{len(det_info)} -> {mask.sum()})')
-                det_info = det_info.subset(rows=mask)
+        Other arguments are as in load, and apply to all requests.
 
-            if len(mask) > 0 and len(det_info) == 0:
-                logger.warning(f'All detectors have been eliminated from processing.')
-                logger.warning(f'  dets:*: {det_reqs}')
-                logger.warning(f'  free_tags: {free_tags}')
+        Returns:
+          A list with the result for each request, as returned by load.
 
-            return det_info, aug_request
+        """
+        assert on_error in ['raise', 'return']
+        if det_info is None:
+            det_info = [None] * len(requests)
+        if dest is None:
+            dest = [None] * len(requests)
+        if on_missing is None:
+            on_missing = {}
 
-        det_info, aug_request = check_tags(det_info, aug_request)
-        n_dets = len(det_info)
+        states = []
+        for _request, _det_info, _dest in zip(requests, det_info, dest):
+            state = _LoadState(self, _request, _det_info, _dest,
+                               free_tags, free_tag_fields)
+            try:
+                state.check_tags()
+                state.n_dets = len(state.det_info)
+            except Exception as e:
+                if on_error == 'raise':
+                    raise
+                state.error = e
+            states.append(state)
 
         # Process each item.
-        items = []
         for spec in spec_list:
             spec, _spec = MetadataSpec.from_dict(spec), spec
             if det_info_scan and not spec.det_info:
                 continue
 
-            logger.debug(f'Processing metadata spec={_spec} with augmented '
-                         f'request={aug_request}')
-
             label = spec.label
             _on_missing = spec.on_missing
             if label is not None and label in on_missing:
@@ -463,96 +535,208 @@ class SuperLoader:
 
             assert _on_missing in ['trim', 'skip', 'fail']
 
-            try:
-                item = self.load_one(spec, aug_request, det_info)
-                error = None
-            except Exception as e:
-                if check:
-                    error = e
-                elif ignore_missing or _on_missing == 'skip':
-                    logger.warning(f'Failed to load metadata for spec={_spec}; ignoring.')
-                    continue
-                else:
-                    reraise(_spec, e)
-
-            if spec.det_info and error is None:
-                item_keys = _filter_items('dets:', item.keys)
+            active = [state for state in states if state.error is None]
+            items = self.load_one_batch(spec, [state.aug_request for state in active],
+                                        [state.det_info for state in active])
+            for state, item in zip(active, items):
+                try:
+                    state.add_item(spec, _spec, item, _on_missing, check,
+                                   ignore_missing)
+                except Exception as e:
+                    if on_error == 'raise':
+                        raise
+                    state.error = e
+
+        outputs = []
+        for state in states:
+            if state.error is None:
                 try:
-                    det_info = merge_det_info(
-                        det_info, item,
-                        on_missing=_on_missing)
-                except IncompleteMetadataError as e:
-                    if check:
-                        # I guess we report this, either way.
-                        error = e
-                    elif _on_missing == 'fail':
-                        reraise(_spec, e)
-                    elif _on_missing == 'skip':
-                        # print a warning I guess
-                        logger.warning(f'Skipping failed det_info load, spec={_spec}')
-
-                item = None
-
-                # The check_tags call can cause truncation of the
-                # dataset, and that's ok.
-                det_info, aug_request = check_tags(det_info, aug_request)
-                n_dets = len(det_info)
+                    state.check_tags(final=True)
+                except Exception as e:
+                    if on_error == 'raise':
+                        raise
+                    state.error = e
+            if state.error is not None:
+                outputs.append(state.error)
+            elif check:
+                outputs.append(state.items)
+            else:
+                state.dest.wrap('det_info', convert_det_info(state.det_info))
+                outputs.append(state.dest)
+        return outputs
+
+
+class _LoadState:
+    """Progress of SuperLoader.load_batch for a single request."""
+    def __init__(self, loader, request, det_info, dest, free_tags,
+                 free_tag_fields):
+        self.request = request
+        self.det_info = det_info
+        self.dest = dest
+        self.free_tags = free_tags
+        self.free_tag_fields = free_tag_fields
+        self.items = []
+        self.error = None
+        self.n_dets = None
 
-            if check:
-                items.append((spec, error))
-                continue
+        # Augmented request -- note that dets:* restrictions from
+        # request will be added back into this by check tags.
+        self.aug_request = _filter_items('obs:', request, False)
 
-            if item is None:
-                # Exit for the det_info case.
-                continue
+        if loader.obsdb is not None and 'obs:obs_id' in request:
+            if self.dest is None:
+                self.dest = core.AxisManager()
+            obs_man = core.AxisManager()
+            obs_info = loader.obsdb.get(request['obs:obs_id'], add_prefix='obs:')
+            if obs_info is None:
+                logger.warning(
+                    f"Observation {request['obs:obs_id']} not found in obsdb; "
+                    "trying to proceed anyway. You might have metadata failures.")
+                obs_man.wrap('obs_id', request['obs:obs_id'])
+            else:
+                obs_info.update(self.aug_request)
+                self.aug_request.update(obs_info)
+                for k, v in _filter_items('obs:', obs_info).items():
+                    obs_man.wrap(k, v)
+            self.dest.wrap('obs_info', obs_man)
+
+    def reraise(self, spec, e):
+        logger.error(
+            f"An error occurred while processing a meta entry:\n\n"
+            f"  spec:    {spec}\n\n"
+            f"  request: {self.request}\n\n")
+        if isinstance(e, LoaderError):
+            # Present all args to logger instead...
+            for a in e.args[1:]:
+                logger.error(a)
+            e = LoaderError(e.args[0])
+        raise e
+
+    def check_tags(self, final=False):
+        det_info = self.det_info
+        mask = np.ones(len(det_info), bool)
+        unmatched = list(self.free_tags)
+        for tag in self.free_tags:
+            for field in self.free_tag_fields:
+                if field in det_info.keys:
+                    s = (det_info[field] == tag)
+                    if s.any():
+                        mask *= s
+                        unmatched.remove(tag)
+        if final and len(unmatched):
+            raise RuntimeError(
+                f'One or more free tags was left unconsumed: {unmatched}')
+
+        det_reqs = _filter_items('dets:', self.request, True)
+        unmatched = []
+        for k, v in det_reqs.items():
+            if k in det_info.keys:
+                if isinstance(v, (list, np.ndarray)):
+                    mask *= (core.util.get_multi_index(v, det_info[k]) >= 0)
+                else:
+                    mask *= (det_info[k] == v)
+                    self.aug_request['dets:' + k] = v
+            else:
+                unmatched.append('dets:' + k)
+        if final and len(unmatched):
+            raise RuntimeError(
+                f'One or more dets:* selections was left unconsumed: {unmatched}')
+
+        if not np.all(mask):
+            logger.debug(f' ... free tags / request reduce det_info (row count '
+                         f'{len(det_info)} -> {mask.sum()})')
+            det_info = det_info.subset(rows=mask)
+
+        if len(mask) > 0 and len(det_info) == 0:
+            logger.warning(f'All detectors have been eliminated from processing.')
+            logger.warning(f'  dets:*: {det_reqs}')
+            logger.warning(f'  free_tags: {self.free_tags}')
+
+        self.det_info = det_info
+
+    def add_item(self, spec, _spec, item, _on_missing, check, ignore_missing):
+        """Process the result of load_one for a metadata entry (which
+        may be an Exception)."""
+        logger.debug(f'Processing metadata spec={_spec} with augmented '
+                     f'request={self.aug_request}')
+        error = None
+        if isinstance(item, Exception):
+            if check:
+                error = item
+            elif ignore_missing or _on_missing == 'skip':
+                logger.warning(f'Failed to load metadata for spec={_spec}; ignoring.')
+                return
+            else:
+                self.reraise(_spec, item)
 
-            # Make everything an axisman.
-            if isinstance(item, ResultSet):
-                # Note this might raise an IncompleteDetInfoError.
-                item = broadcast_resultset(item, det_info=det_info)
-
-            elif not isinstance(item, core.AxisManager):
-                logger.error(
-                    f'The decoded item {item} is not an AxisManager or '
-                    f'other well-understood type.  Request was: {request}.')
-
-            if 'dets' in item:
-                # You have to check for detector loss here -- compare
-                # item.dets.vals to what's in det_info.
-                i0 = core.util.get_multi_index(
-                    item.dets.vals, det_info['readout_id'])
-
-                n_dets_item = len(set(i0[i0>=0]))
-                if n_dets_item < n_dets:
-                    message = (f"Only {n_dets_item} of {n_dets} detectors "
-                               "have data for metadata specified by "
-                               f"spec={_spec}. ")
-                    if _on_missing == 'trim':
-                        logger.warning(message + 'Trimming.')
-                    elif _on_missing == 'fail':
-                        raise IncompleteMetadataError(message)
-                    else:  # skip
-                        logger.warning(message + 'Discarding.')
-                        continue
-
-            # Unpack it.
+        if spec.det_info and error is None:
             try:
-                dest = unpack_item(spec.unpack, item, dest=dest)
-            except Exception as e:
-                reraise(_spec, e)
+                self.det_info = merge_det_info(
+                    self.det_info, item,
+                    on_missing=_on_missing)
+            except IncompleteMetadataError as e:
+                if check:
+                    # I guess we report this, either way.
+                    error = e
+                elif _on_missing == 'fail':
+                    self.reraise(_spec, e)
+                elif _on_missing == 'skip':
+                    # print a warning I guess
+                    logger.warning(f'Skipping failed det_info load, spec={_spec}')
 
-            if 'dets' in dest:
-                logger.debug(f'load(): dest now has shape {dest.shape}')
-                n_dets = dest.dets.count
+            item = None
 
-        check_tags(det_info, aug_request, final=True)
+            # The check_tags call can cause truncation of the
+            # dataset, and that's ok.
+            self.check_tags()
+            self.n_dets = len(self.det_info)
 
         if check:
-            return items
+            self.items.append((spec, error))
+            return
 
-        dest.wrap('det_info', convert_det_info(det_info))
+        if item is None:
+            # Exit for the det_info case.
+            return
 
-        return dest
+        # Make everything an axisman.
+        if isinstance(item, ResultSet):
+            # Note this might raise an IncompleteDetInfoError.
+            item = broadcast_resultset(item, det_info=self.det_info)
+
+        elif not isinstance(item, core.AxisManager):
+            logger.error(
+                f'The decoded item {item} is not an AxisManager or '
+                f'other well-understood type.  Request was: {self.request}.')
+
+        if 'dets' in item:
+            # You have to check for detector loss here -- compare
+            # item.dets.vals to what's in det_info.
+            i0 = core.util.get_multi_index(
+                item.dets.vals, self.det_info['readout_id'])
+
+            n_dets_item = len(set(i0[i0>=0]))
+            if n_dets_item < self.n_dets:
+                message = (f"Only {n_dets_item} of {self.n_dets} detectors "
+                           "have data for metadata specified by "
+                           f"spec={_spec}. ")
+                if _on_missing == 'trim':
+                    logger.warning(message + 'Trimming.')
+                elif _on_missing == 'fail':
+                    raise IncompleteMetadataError(message)
+                else:  # skip
+                    logger.warning(message + 'Discarding.')
+                    return
+
+        # Unpack it.
+        try:
+            self.dest = unpack_item(spec.unpack, item, dest=self.dest)
+        except Exception as e:
+            self.reraise(_spec, e)
+
+        if 'dets' in self.dest:
+            logger.debug(f'load(): dest now has shape {self.dest.shape}')
+            self.n_dets = self.dest.dets.count
 
 
 def _filter_items(prefix, d, remove=True):
@@ -604,18 +788,15 @@ def merge_det_info(det_info, new_info, multi=True, on_missing='trim'):
             f'Cannot merge det_info: no common keys in '
             f'{det_info} and {new_info}.')
 
-    new_index = list(zip(*[new_info[k] for k in join_on]))
-    det_index = list(zip(*[det_info[k] for k in join_on]))
-
     # Perform the row-row matching, accepting that rows of new_info
     # may match multiple entries of det_info.  (This is so new_info
     # can have a det_id = 'NO_MATCH' entry.)
-    i0 = core.util.get_multi_index(
-        new_index, det_index)
-    i1 = np.arange(len(det_index))
+    i0 = _get_row_index(new_info, det_info, join_on)
+    i1 = np.arange(len(det_info))
     i0, i1 = i0[i0>=0], i1[i0>=0]
 
     if not multi and len(i0) != len(set(i0)):
+        new_index = list(zip(*[new_info[k] for k in join_on]))
         offenders = collections.Counter(i0)
         offenders = [new_index[i] for i, v in offenders.items() if v > 1][:10]
         raise ValueError(
@@ -695,7 +876,22 @@ def unconvert_det_info(aman):
                 columns.append((prefix + k, v))
         return columns
     keys, columns = zip(*get_cols(aman))
-    return ResultSet(keys, zip(*columns))
+    return ResultSet.from_columns(keys, [np.array(c) for c in columns])
+
+
+def _get_row_index(short_rs, long_rs, keys):
+    """For each row of long_rs, find the index of the first row of
+    short_rs that has the same values in all the columns listed in
+    keys; -1 if there is no such row.  See core.util.get_multi_index.
+
+    """
+    short_arr = short_rs.subset(keys=keys).asarray()
+    long_arr = long_rs.subset(keys=keys).asarray()
+    if core.util._common_key_dtype(short_arr.dtype, long_arr.dtype) is not None:
+        return core.util.get_multi_index(short_arr, long_arr)
+    return core.util.get_multi_index(
+        list(zip(*[short_rs[k] for k in keys])),
+        list(zip(*[long_rs[k] for k in keys])))
 
 
 def broadcast_resultset(
@@ -769,14 +965,10 @@ def broadcast_resultset(
         if k.startswith(prefix):
             index_cols[k] = k[len(prefix):]
 
-    # Construct a map that takes a (tuple of dets:* values) to
-    # specific row index of rs.
-    row_map = {}
-    for i, row in enumerate(rs):
-        key = tuple([row[k] for k in index_cols.keys()])
-        if key in row_map:
-            raise ValueError("Duplicate entries for combined unique key.")
-        row_map[key] = i
+    # The (tuple of dets:* values) must identify a unique row of rs.
+    index_rs = rs.subset(keys=index_cols.keys())
+    if len(index_rs.distinct()) != len(index_rs):
+        raise ValueError("Duplicate entries for combined unique key.")
 
     # Get index of rs that corresponds to each row in det_info.
     missing_keys = [k for k in index_cols.values()
@@ -785,10 +977,11 @@ def broadcast_resultset(
         raise IncompleteDetInfoError(
             f"Loaded metadata requires det_info keys {missing_keys}.")
 
-    indices = np.array(
-        [row_map.get(tuple(row.values()), -1)
-         for row in det_info.subset(keys=index_cols.values())],
-        dtype=int)
+    if len(index_cols) == 0:
+        indices = np.zeros(len(det_info), dtype=int) - (len(rs) == 0)
+    else:
+        index_rs.keys = list(index_cols.values())
+        indices = _get_row_index(index_rs, det_info, index_rs.keys)
     mask = (indices >= 0)
     dets = det_info[axis_key][mask]
     indices = indices[mask]  # drop any det_info items not matched
@@ -155,6 +155,33 @@ class ManifestScheme:
         entries.append('UNIQUE(' + ','.join(uniques) + ')')
         return entries
 
+    def _get_index_defs(self):
+        """
+        Returns index definitions for the map and files tables, as a
+        dict suitable for common.sqlite_create_indexes.  Each input
+        field gets an index that leads with that field's column(s) and
+        also covers the other input columns, so that queries on any
+        subset of the Index Data can be resolved from an index.  (The
+        UNIQUE constraint already provides that for the first field.)
+        """
+        in_cols = []
+        for name, purpose, match, dtype in self.cols:
+            if purpose != 'in':
+                continue
+            if match == 'exact':
+                in_cols.append((name, ['`%s`' % name]))
+            else:
+                in_cols.append((name, ['`%s__lo`' % name, '`%s__hi`' % name]))
+        index_defs = {'files_name': '`files` (`name`)'}
+        for i, (name, cols) in enumerate(in_cols):
+            if i == 0 and len(self.cols) and self.cols[0][0] == name:
+                continue
+            others = [c for _name, _cols in in_cols if _name != name
+                      for c in _cols]
+            index_defs['map_%s' % name] = '`map` (%s)' % ','.join(
+                cols + others + ['`file_id`'])
+        return index_defs
+
     def _format_row(self, r):
         """Rewrite a dict of index and/or endpoint data from the database so
         that it is compatible with the format expected by
@@ -357,6 +384,7 @@ class ManifestDb:
             ('input_scheme', TABLE_DEFS['input_scheme']),
             ('files', TABLE_DEFS['files']),
             ('map', manifest_scheme._get_map_table_def())]
+        tables = common.sqlite_list_tables(self.conn)
         c = self.conn.cursor()
         for table_name, column_defs in table_defs:
             q = ('create table if not exists `%s` (' % table_name  +
@@ -370,6 +398,19 @@ class ManifestDb:
         self.conn.commit()
 
         self.scheme = ManifestScheme.from_database(self.conn)
+        if 'map' not in tables:
+            self.create_indexes()
+
+    def create_indexes(self):
+        """
+        Create the indexes for the scheme, if they do not already
+        exist (and the database is writable).  Indexes are created
+        along with new tables; use this to add them to databases made
+        by older versions of this code.  Returns the list of index
+        names that are present.
+        """
+        return common.sqlite_create_indexes(
+            self.conn, self.scheme._get_index_defs())
 
     def copy(self, map_file=None, overwrite=False):
         """
@@ -427,22 +468,33 @@ class ManifestDb:
 
         """
         conn = common.sqlite_from_file(filename, fmt=fmt, force_new_db=force_new_db)
-        return cls(conn)
+        db = cls(conn)
+        if force_new_db:
+            # Index the in-memory copy.
+            db.create_indexes()
+        return db
 
     @classmethod
-    def readonly(cls, filename):
+    def readonly(cls, filename, in_memory=False):
         """Instantiate an ManifestDb connected to an sqlite database on disk,
         and return it.  The database remains mapped to disk, in readonly mode.
 
         Args:
           filename (str): path to the file.
+          in_memory (bool): If True, copy the database into memory
+            (and index it there) instead of leaving it mapped to
+            disk.  This speeds up lookups in heavily used dbs.
 
         Returns:
           ManifestDb.
 
         """
-        conn = sqlite3.connect('file:%s?mode=ro' % filename, uri=True)
-        return cls(conn)
+        conn = common.sqlite_connect_readonly(filename, in_memory=in_memory)
+        db = cls(conn)
+        if in_memory:
+            db.create_indexes()
+            common.sqlite_tune_readonly(db.conn)
+        return db
 
     def _get_file_id(self, filename, create=False):
         """
@@ -496,6 +548,58 @@ class ManifestDb:
             raise ValueError('Matched multiple rows with index data: %s' % rows)
         return rows[0]
 
+    def match_many(self, params_list, prefix=None):
+        """Like match(params, multi=True, prefix=prefix), but for a list
+        of Index Data dicts.  The requests are matched with a single
+        query (or a few, for very long lists), which is much faster
+        than calling match for each one.
+
+        Returns:
+          A list with one entry per item in params_list; each entry is
+          a list of Endpoint Data dicts (with 0, 1, or more items).
+
+        """
+        results = [[] for _ in params_list]
+        if len(params_list) == 0:
+            return results
+        in_cols = [(name, match) for name, purpose, match, dtype
+                   in self.scheme.cols if purpose == 'in']
+        _, _, rp = self.scheme.get_match_query(
+            {name: None for name, match in in_cols})
+        cols = ['files`.`name'] + list(rp)
+        conds = ['1']
+        for i, (name, match) in enumerate(in_cols):
+            if match == 'exact':
+                conds.append('map.`%s`=req._p%i' % (name, i))
+            else:
+                conds.append('(map.`%s__lo` <= req._p%i) and (req._p%i < map.`%s__hi`)'
+                             % (name, i, i, name))
+        req_cols = ','.join(['_idx'] + ['_p%i' % i for i in range(len(in_cols))])
+        row_q = '(%s)' % ','.join(['?'] * (len(in_cols) + 1))
+        # Stay well inside sqlite's limit on the number of parameters.
+        chunk = max(1, 900 // (len(in_cols) + 1))
+        c = self.conn.cursor()
+        for i0 in range(0, len(params_list), chunk):
+            block = params_list[i0:i0 + chunk]
+            vals = []
+            for i, params in enumerate(block):
+                vals.append(i0 + i)
+                for name, match in in_cols:
+                    if name not in params:
+                        raise ValueError('Parameter %s is not optional.' % name)
+                    vals.append(params[name])
+            c.execute('with req(%s) as (values %s) ' % (req_cols, ','.join([row_q] * len(block))) +
+                      'select req._idx, `%s` ' % ('`,`'.join(cols)) +
+                      'from req join map on %s ' % ' and '.join(conds) +
+                      'join files on map.file_id=files.id order by req._idx, map.id',
+                      vals)
+            for r in c:
+                row = dict(zip(['filename'] + list(rp), r[1:]))
+                if prefix is not None:
+                    row['filename'] = os.path.join(prefix, row['filename'])
+                results[r[0]].append(row)
+        return results
+
     def inspect(self, params={}, strict=True, prefix=None):
         """Given (partial) Index Data and Endpoint Data, find and return the
         complete matching records.
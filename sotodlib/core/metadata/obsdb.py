@@ -17,6 +17,12 @@ TABLE_DEFS = {
     ],
 }
 
+# Indexes for selecting observations by time or by tag.
+INDEX_DEFS = {
+    'obs_timestamp': '`obs` (`timestamp`)',
+    'tags_tag': '`tags` (`tag`, `obs_id`)',
+}
+
 
 class ObsDb(object):
     """Observation database.
@@ -51,7 +57,9 @@ class ObsDb(object):
             argument is None (the default), then the
             sqlite3.Connection is opened on ':memory:'.
           init_db (bool): If True, then any ObsDb tables that do not
-            already exist in the database will be created.
+            already exist in the database will be created (and
+            indexed).  Indexes are not added to existing tables; see
+            create_indexes.
 
         Notes:
           If map_file is provided, the database will be connected to
@@ -72,16 +80,30 @@ class ObsDb(object):
             c.execute("SELECT name FROM sqlite_master "
                       "WHERE type='table' and name not like 'sqlite_%';")
             tables = [r[0] for r in c]
-            changes = False
+            new_tables = []
             for k, v in TABLE_DEFS.items():
                 if k not in tables:
                     q = ('create table if not exists `%s` (' % k +
                          ','.join(v) + ')')
                     c.execute(q)
-                    changes = True
-            if changes:
+                    new_tables.append(k)
+            if new_tables:
+                common.sqlite_create_indexes(self.conn, INDEX_DEFS,
+                                             commit=False, tables=new_tables)
                 self.conn.commit()
 
+    def create_indexes(self):
+        """Create the indexes for selecting by timestamp and tag
+        (INDEX_DEFS), if they do not already exist.  Indexes are created
+        along with new tables; use this to add them to databases made
+        by older versions of this code.
+
+        Returns:
+          The list of index names that are present.
+
+        """
+        return common.sqlite_create_indexes(self.conn, INDEX_DEFS)
+
     def __len__(self):
         return self.conn.execute('select count(obs_id) from obs').fetchone()[0]
 
@@ -218,6 +240,9 @@ class ObsDb(object):
             :func:`sotodlib.core.metadata.common.sqlite_from_file`
         """
         conn = common.sqlite_from_file(filename, fmt=fmt, force_new_db=force_new_db)
+        if force_new_db:
+            # Index the in-memory copy.
+            common.sqlite_create_indexes(conn, INDEX_DEFS)
         return cls(conn, init_db=False)
 
     def get(self, obs_id=None, tags=None, add_prefix=''):
@@ -35,6 +35,14 @@ TABLE_DEFS = {
     ],
 }
 
+# Indexes for the common lookups (files by obs_id and detset, detsets
+# by name, frame offsets by file).
+INDEX_DEFS = {
+    'files_obs_id': '`files` (`obs_id`, `detset`)',
+    'files_detset': '`files` (`detset`)',
+    'frame_offsets_file': '`frame_offsets` (`file_name`, `frame_index`)',
+}
+
 
 class ObsFileDb:
     """sqlite3-based database for managing large archives of files.
@@ -62,7 +70,8 @@ class ObsFileDb:
     #: starting with /).
     prefix = ''
 
-    def __init__(self, map_file=None, prefix=None, init_db=True, readonly=False):
+    def __init__(self, map_file=None, prefix=None, init_db=True, readonly=False,
+                 in_memory=False):
         """Instantiate an ObsFileDb.
 
         Arguments:
@@ -70,9 +79,12 @@ class ObsFileDb:
             ':memory:'.
           prefix (string): as described in class documentation.
           init_db (bool): If True, attempt to create the database
-            tables.
+            tables (and indexes).
           readonly (bool): If True, the database file will be mapped
             in read-only mode.  Not valid on dbs held in :memory:.
+          in_memory (bool): If True (and readonly), the database is
+            copied into memory and indexed there, and the file is
+            closed.  This speeds up lookups in heavily used dbs.
 
         """
         if isinstance(map_file, sqlite3.Connection):
@@ -80,15 +92,17 @@ class ObsFileDb:
         else:
             if map_file is None:
                 map_file = ':memory:'
-            self.conn = sqlite3.connect(map_file)
-            uri = False
             if readonly:
                 if map_file == ':memory:':
                     raise ValueError('Cannot honor request for readonly db '
                                      'mapped to :memory:.')
-                map_file, uri = 'file:%s?mode=ro' % map_file, True
-
-            self.conn = sqlite3.connect(map_file, uri=uri)
+                self.conn = common.sqlite_connect_readonly(
+                    map_file, in_memory=in_memory)
+                if in_memory:
+                    common.sqlite_create_indexes(self.conn, INDEX_DEFS)
+                    common.sqlite_tune_readonly(self.conn)
+            else:
+                self.conn = sqlite3.connect(map_file)
 
         self.conn.row_factory = sqlite3.Row  # access columns by name
 
@@ -128,6 +142,9 @@ class ObsFileDb:
         """
         conn = common.sqlite_from_file(filename, fmt=fmt,
                                        force_new_db=force_new_db)
+        if force_new_db:
+            # Index the in-memory copy.
+            common.sqlite_create_indexes(conn, INDEX_DEFS)
         if prefix is None:
             prefix = os.path.split(filename)[0] + '/'
         return cls(conn, init_db=False, prefix=prefix, )
@@ -172,6 +189,7 @@ class ObsFileDb:
         Create the database tables if they do not already exist.
         """
         # Create the tables:
+        tables = common.sqlite_list_tables(self.conn)
         table_defs = TABLE_DEFS.items()
         c = self.conn.cursor()
         for table_name, column_defs in table_defs:
@@ -183,8 +201,25 @@ class ObsFileDb:
             c.execute('insert or ignore into meta (param,value) values (?,?)',
                       ('obsfiledb_version', 2))
 
+        # Index new tables only; opening an existing db should not
+        # write to it.  See create_indexes.
+        common.sqlite_create_indexes(
+            self.conn, INDEX_DEFS, commit=False,
+            tables=[k for k in TABLE_DEFS if k not in tables])
         self.conn.commit()
 
+    def create_indexes(self):
+        """Create the indexes for common lookups (INDEX_DEFS), if they do
+        not already exist.  Indexes are created along with new tables;
+        use this to add them to databases made by older versions of
+        this code.
+
+        Returns:
+          The list of index names that are present.
+
+        """
+        return common.sqlite_create_indexes(self.conn, INDEX_DEFS)
+
     def add_detset(self, detset_name, detector_names, commit=True):
         """Add a detset to the detsets table.
 
@@ -221,6 +256,28 @@ class ObsFileDb:
         if commit:
             self.conn.commit()
 
+    def add_frame_offsets(self, filename, rows, commit=True):
+        """Record the frame index of a file in the frame_offsets table,
+        replacing any existing entries for that file.
+
+        Arguments:
+          filename (str): The filename, as in the files table.
+          rows (list of tuple): Each entry is (frame_index,
+            byte_offset, frame_type, sample_start, sample_stop).  The
+            frame_type is a string such as 'Scan'; the sample range
+            (observation sample indices, as in the files table) may be
+            None for frames that do not carry samples.
+
+        """
+        self.conn.execute('delete from frame_offsets where file_name=?',
+                          (filename,))
+        self.conn.executemany(
+            'insert into frame_offsets (file_name,frame_index,byte_offset,'
+            'frame_type,sample_start,sample_stop) values (?,?,?,?,?,?)',
+            [(filename,) + tuple(row) for row in rows])
+        if commit:
+            self.conn.commit()
+
     # Retrieval
 
     def get_obs(self):
@@ -292,6 +349,35 @@ class ObsFileDb:
             output[r[0]].append((os.path.join(prefix, r[1]), r[2], r[3]))
         return output
 
+    def get_frame_offsets(self, obs_id, detsets=None, prefix=None):
+        """Get the frame indexes (see add_frame_offsets) of the files
+        associated with a particular obs_id and detsets.
+
+        Returns:
+
+          dict where the key is the full filename (as returned by
+          get_files) and the value is a list of tuples (frame_index,
+          byte_offset, frame_type, sample_start, sample_stop), sorted
+          by frame_index.  Files that have not been indexed are not
+          included.
+
+        """
+        if prefix is None:
+            prefix = self.prefix
+        q = ('select files.name, frame_index, byte_offset, frame_type, '
+             'frame_offsets.sample_start, frame_offsets.sample_stop '
+             'from frame_offsets join files on frame_offsets.file_name=files.name '
+             'where obs_id=?')
+        params = (obs_id,)
+        if detsets is not None:
+            q += ' and detset in (%s)' % ','.join(['?' for _ in detsets])
+            params += tuple(detsets)
+        c = self.conn.execute(q + ' order by files.name, frame_index', params)
+        output = {}
+        for r in c:
+            output.setdefault(os.path.join(prefix, r[0]), []).append(tuple(r[1:]))
+        return output
+
     def lookup_file(self, filename, resolve_paths=True, prefix=None, fail_ok=False):
         """Determine what, if any, obs_id (and detset and sample range) is
         associated with the specified data file.
@@ -37,6 +37,15 @@ class ResultSet(object):
     a numpy array, modify the result, and create and a new ResultSet
     from that using the ``.from_friend`` constructor.
 
+    Internally, the data are stored either as that list of row
+    tuples, or in "columnar" mode as one numpy array per key.  The
+    columnar mode is used for ResultSets created with
+    ``.from_columns`` or ``.from_friend`` (from a structured array),
+    and for the outputs of ``.subset``, ``.distinct``, ``.merge`` and
+    ``.concatenate``, which are vectorized.  Accessing ``.rows``
+    converts the object to row storage, because the caller may then
+    modify the list in place.
+
     You can get a structured numpy array using:
 
       >>> ret.asarray()
@@ -62,8 +71,13 @@ class ResultSet(object):
     #: columns.
     keys = None
 
-    #: Once instantiated, a list of the raw data tuples.
-    rows = None
+    # Row storage (list of tuples), or None in columnar mode.
+    _rows = None
+
+    # Columnar storage (list of arrays, in the order of self.keys), or
+    # None in row mode.
+    _columns = None
+    _nrows = 0
 
     def __init__(self, keys, src=None):
         self.keys = list(keys)
@@ -72,6 +86,69 @@ class ResultSet(object):
         else:
             self.rows = [tuple(x) for x in src]
 
+    @property
+    def rows(self):
+        """A list of the raw data tuples.  If the ResultSet is in
+        columnar mode, it is converted to row storage.
+
+        """
+        if self._rows is None:
+            self._rows = list(self._iter_tuples())
+            self._columns = None
+        return self._rows
+
+    @rows.setter
+    def rows(self, value):
+        self._rows = value
+        self._columns = None
+
+    @classmethod
+    def from_columns(cls, keys, columns):
+        """Return a new ResultSet, in columnar mode, with the data in
+        columns (a list of arrays, one for each entry in keys).  The
+        arrays are not copied.
+
+        """
+        keys = list(keys)
+        columns = [np.asarray(c) for c in columns]
+        if len(keys) != len(columns):
+            raise ValueError("Number of keys and columns do not match.")
+        if len(set(map(len, columns))) > 1:
+            raise ValueError("Columns do not all have the same length.")
+        self = cls(keys)
+        self._rows = None
+        self._columns = columns
+        self._nrows = len(columns[0]) if len(columns) else 0
+        return self
+
+    def _get_columns(self, keys=None):
+        """Return a list of arrays, one for each key in keys (defaults
+        to self.keys).  In columnar mode, these are the stored arrays
+        and must not be modified.
+
+        """
+        if keys is None:
+            idx = list(range(len(self.keys)))
+        else:
+            idx = [self.keys.index(k) for k in keys]
+        if self._columns is not None:
+            return [self._columns[i] for i in idx]
+        return [_column_array([r[i] for r in self._rows]) for i in idx]
+
+    def _iter_tuples(self):
+        if self._columns is None:
+            return iter(self._rows)
+        if len(self._columns) == 0:
+            return iter([()] * self._nrows)
+        return zip(*[c.tolist() for c in self._columns])
+
+    def _with_columns(self, keys, columns, nrows=None):
+        # Construct a columnar ResultSet of the same class.
+        output = self.__class__.from_columns(keys, columns)
+        if nrows is not None:
+            output._nrows = nrows
+        return output
+
     @classmethod
     def from_friend(cls, source):
         """Return a new ResultSet populated with data from source.
@@ -85,13 +162,18 @@ class ResultSet(object):
         """
         if isinstance(source, np.ndarray):
             keys = source.dtype.names  # structured array?
-            return cls(keys, list(source))
+            if keys is None:
+                raise TypeError(f"Cannot construct {cls} from unstructured array.")
+            return cls.from_columns(keys, [np.array(source[k]) for k in keys])
         if isinstance(source, ResultSet):
-            return cls(source.keys, source.rows)
+            return source.copy()
         raise TypeError(f"No implementation to construct {cls} from {source.__class__}.")
 
     def copy(self):
-        return self.__class__(self.keys, self.rows)
+        if self._columns is not None:
+            # Stored arrays are never modified in place, so can be shared.
+            return self._with_columns(self.keys, self._columns, len(self))
+        return self.__class__(self.keys, self._rows)
 
     def subset(self, keys=None, rows=None):
         """Returns a copy of the object, selecting only the keys and rows
@@ -108,20 +190,17 @@ class ResultSet(object):
         """
         if keys is None:
             keys = self.keys
-            def key_sel_func(row):
-                return row
-        else:
-            key_idx = [self.keys.index(k) for k in keys]
-            def key_sel_func(row):
-                return [row[i] for i in key_idx]
-        if rows is None:
-            new_rows = map(key_sel_func, self.rows)
-        elif isinstance(rows, np.ndarray) and rows.dtype == bool:
-            assert(len(rows) == len(self.rows))
-            new_rows = [key_sel_func(r) for r, s in zip(self.rows, rows) if s]
-        else:
-            new_rows = [key_sel_func(self.rows[i]) for i in rows]
-        return self.__class__(keys, new_rows)
+        keys = list(keys)
+        columns = self._get_columns(keys)
+        nrows = len(self)
+        if rows is not None:
+            if isinstance(rows, np.ndarray) and rows.dtype == bool:
+                assert(len(rows) == len(self))
+            else:
+                rows = np.asarray(rows, dtype=int)
+            nrows = len(np.arange(len(self))[rows])
+            columns = [c[rows] for c in columns]
+        return self._with_columns(keys, columns, nrows)
 
     @classmethod
     def from_cursor(cls, cursor, keys=None):
@@ -154,7 +233,7 @@ class ResultSet(object):
         if simplify_keys:  # remove prefixes
             keys = [k.split('.')[-1] for k in keys]
             assert(len(set(keys)) == len(keys))  # distinct.
-        columns = tuple(map(np.array, zip(*self.rows)))
+        columns = [_coerce_column(c) for c in self._get_columns()]
         if hdf_compat:
             # Translate any Unicode columns to strings.
             new_cols = []
@@ -165,7 +244,7 @@ class ResultSet(object):
                     new_cols.append(c)
             columns = new_cols
         dtype = [(k, c.dtype, c.shape[1:]) for k, c in zip(keys, columns)]
-        output = np.ndarray(shape=len(columns[0]), dtype=dtype)
+        output = np.ndarray(shape=len(self), dtype=dtype)
         for k, c in zip(keys, columns):
             output[k] = c
         return output
@@ -176,7 +255,30 @@ class ResultSet(object):
         duplicates removed.  The rows are sorted (according to python
         sort).
         """
-        return self.__class__(self.keys, sorted(list(set(self.rows))))
+        if self._columns is None or len(self.keys) == 0:
+            return self.__class__(self.keys,
+                                  sorted(list(set(self._iter_tuples()))))
+        columns = self._columns
+        if any(c.dtype.kind == 'O' or c.ndim != 1 for c in columns):
+            return self.__class__(self.keys,
+                                  sorted(list(set(self._iter_tuples()))))
+        # Replace each column by its (sorted) unique values and integer
+        # codes; combining the codes in mixed radix gives a single
+        # integer key whose order is the python tuple sort order.
+        key, radix = np.zeros(len(self), dtype=np.int64), 1
+        for c in columns:
+            u, inv = np.unique(c, return_inverse=True)
+            radix *= max(len(u), 1)
+            if radix >= 2**62:
+                break
+            key = key * len(u) + inv.ravel()
+        else:
+            key, first = np.unique(key, return_index=True)
+            return self._with_columns(self.keys,
+                                      [c[first] for c in columns])
+        # Too many combinations for an int64 key.
+        return self.__class__(self.keys,
+                              sorted(list(set(self._iter_tuples()))))
 
     def strip(self, patterns=[]):
         """For any keys that start with a string in patterns, remove that
@@ -250,7 +352,13 @@ class ResultSet(object):
                                            keystr, len(self)))
 
     def __len__(self):
-        return len(self.rows)
+        if self._columns is not None:
+            return self._nrows
+        return len(self._rows)
+
+    def __iter__(self):
+        for row in self._iter_tuples():
+            yield OrderedDict(zip(self.keys, row))
 
     def append(self, item):
         vals = []
@@ -266,20 +374,36 @@ class ResultSet(object):
         if self.keys != items.keys:
             raise ValueError("Keys do not match: {} <- {}".format(
                 self.keys, items.keys))
-        self.rows.extend(items.rows)
+        if self._columns is None:
+            self._rows.extend(items._iter_tuples())
+        else:
+            nrows = len(self) + len(items)
+            self._columns = _concat_columns([self._columns,
+                                             items._get_columns()])
+            self._nrows = nrows
 
     def __getitem__(self, item):
         # Simple row look-up... convert to dict.
         if isinstance(item, int) or isinstance(item, np.integer):
-            return OrderedDict([(k,v) for k, v in
-                                zip(self.keys, self.rows[item])])
+            if self._columns is None:
+                row = self._rows[item]
+            else:
+                if not -len(self) <= item < len(self):
+                    raise IndexError("ResultSet index out of range")
+                row = [_to_python(c[item]) for c in self._columns]
+            return OrderedDict([(k,v) for k, v in zip(self.keys, row)])
         # Look-up by column...
         if isinstance(item, str):
             index = self.keys.index(item)
-            return np.array([x[index] for x in self.rows])
+            if self._columns is not None:
+                return _coerce_column(self._columns[index]).copy()
+            return np.array([x[index] for x in self._rows])
         # Slicing.
-        output = self.__class__(self.keys, self.rows[item])
-        return output
+        if self._columns is None:
+            return self.__class__(self.keys, self._rows[item])
+        return self._with_columns(self.keys,
+                                  [c[item] for c in self._columns],
+                                  len(range(len(self))[item]))
 
     def __iadd__(self, other):
         self.extend(other)
@@ -293,10 +417,13 @@ class ResultSet(object):
     @staticmethod
     def concatenate(items, axis=0):
         assert(axis == 0)
-        output = items[0].copy()
         for item in items[1:]:
-            output += item
-        return output
+            if item.keys != items[0].keys:
+                raise ValueError("Keys do not match: {} <- {}".format(
+                    items[0].keys, item.keys))
+        columns = _concat_columns([item._get_columns() for item in items])
+        return items[0]._with_columns(items[0].keys, columns,
+                                      sum(map(len, items)))
 
     def merge(self, src):
         """Merge with src, which must have same number of rows as self.
@@ -308,6 +435,64 @@ class ResultSet(object):
         for k in src.keys:
             if k in self.keys:
                 raise ValueError("Duplicate key: %s" % k)
+        nrows = len(self)
         new_keys = self.keys + src.keys
-        new_rows = [r0 + r1 for r0, r1 in zip(self.rows, src.rows)]
-        self.keys, self.rows = new_keys, new_rows
+        new_columns = self._get_columns() + src._get_columns()
+        self.keys, self._rows = new_keys, None
+        self._columns, self._nrows = new_columns, nrows
+
+
+def _to_python(x):
+    # Convert numpy scalars to the corresponding python type, so that
+    # row dicts look the same in row and columnar mode.
+    if isinstance(x, np.generic):
+        return x.item()
+    return x
+
+
+def _column_array(values):
+    # Build a column from a list of python values.  Values of a
+    # single scalar type are stored in a typed array; otherwise an
+    # object array is used, so the values are returned unchanged
+    # (rather than, e.g., ints cast to float or str).
+    types = set(map(type, values))
+    if len(types) == 1 and types.pop() in (str, int, float, bool):
+        try:
+            return np.array(values)
+        except OverflowError:
+            pass
+    output = np.empty(len(values), dtype=object)
+    for i, v in enumerate(values):
+        output[i] = v
+    return output
+
+
+def _coerce_column(column):
+    # For asarray and column look-up, object columns are converted as
+    # np.array would convert the row values.
+    if column.dtype.kind == 'O':
+        return np.array(column.tolist())
+    return column
+
+
+def _concat_columns(column_lists):
+    """Concatenate several lists of columns (each a list of arrays in
+    the same key order) into a single list of arrays.
+
+    """
+    output = []
+    for parts in zip(*column_lists):
+        nonempty = [p for p in parts if len(p)]
+        if len(nonempty) == 0:
+            output.append(parts[0])
+            continue
+        kinds = set(p.dtype.kind for p in nonempty)
+        if len(kinds) == 1 and 'O' not in kinds:
+            try:
+                output.append(np.concatenate(nonempty))
+                continue
+            except (TypeError, ValueError):
+                pass
+        # Mixed types; keep the values as they are.
+        output.append(_column_array(sum([p.tolist() for p in nonempty], [])))
+    return output
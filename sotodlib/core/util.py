@@ -78,7 +78,16 @@ def get_multi_index(short_list, long_list):
        np.array([short_list.index(x) if x in short_list else -1
                  for x in long_list])
 
+    If both arguments are numpy arrays (including structured arrays,
+    which is how multi-column keys should be passed) with compatible
+    dtypes, the matching is done with a vectorized sort / search.
+
     """
+    if isinstance(short_list, np.ndarray) and isinstance(long_list, np.ndarray):
+        dtype = _common_key_dtype(short_list.dtype, long_list.dtype)
+        if dtype is not None and short_list.ndim == long_list.ndim == 1:
+            return _get_multi_index_np(short_list.astype(dtype),
+                                       long_list.astype(dtype))
     w0 = sorted([(j, i) for i, j in enumerate(short_list)])
     w1 = sorted([(j, i) for i, j in enumerate(long_list)])
     i0, i1 = 0, 0
@@ -99,3 +108,42 @@ def get_multi_index(short_list, long_list):
         return np.zeros(0, int)
     indices.sort()
     return np.array([i0 for i1, i0 in indices])
+
+def _common_key_dtype(dt0, dt1):
+    """Return a dtype to which both dt0 and dt1 can be cast for exact
+    comparison of keys, or None if there is no safe choice (e.g. one
+    is a string and the other a number, or object types are
+    involved).
+
+    """
+    groups = ['U', 'S', 'biuf']
+    if dt0.names is not None or dt1.names is not None:
+        if dt0.names is None or dt1.names is None or \
+           len(dt0.names) != len(dt1.names):
+            return None
+        fields = []
+        for n, n0, n1 in zip(dt0.names, dt0.names, dt1.names):
+            f0, f1 = dt0.fields[n0][0], dt1.fields[n1][0]
+            dt = _common_key_dtype(f0, f1)
+            if dt is None:
+                return None
+            fields.append((n, dt))
+        return np.dtype(fields)
+    if dt0.shape != () or dt1.shape != ():
+        return None
+    for g in groups:
+        if dt0.kind in g and dt1.kind in g:
+            return np.promote_types(dt0, dt1)
+    return None
+
+def _get_multi_index_np(short_arr, long_arr):
+    # Vectorized get_multi_index; arrays must have the same dtype.
+    # np.unique uses a stable sort for return_index, so duplicates in
+    # short_arr resolve to their first occurrence.
+    if len(short_arr) == 0:
+        return np.full(len(long_arr), -1, dtype=int)
+    uniq, first = np.unique(short_arr, return_index=True)
+    pos = np.searchsorted(uniq, long_arr)
+    pos[pos >= len(uniq)] = 0
+    hit = (uniq[pos] == long_arr)
+    return np.where(hit, first[pos], -1).astype(int)
@@ -1,4 +1,5 @@
 import numpy as np
+import pyfftw
 from scipy.optimize import curve_fit
 from sotodlib import core, tod_ops
 from sotodlib.tod_ops import bin_signal, filters, apodize
@@ -50,6 +51,8 @@ def get_hwpss(aman, signal=None, hwp_angle=None, bin_signal=True, bins=360,
         set it to `None`.
     flags : RangesMatrix, optional
         Flags to be masked out before extracting HWPSS. If Default is None, and no mask will be applied.
+        In the non-binned case the flagged samples of each detector are excluded from the
+        linear regression (see ``hwpss_batched_fit``).
     merge_stats : bool, optional
         Whether to add the extracted HWPSS statistics to `aman` as new axes. Default is `True`.
     hwpss_stats_name : str, optional
@@ -144,10 +147,10 @@ def get_hwpss(aman, signal=None, hwp_angle=None, bin_signal=True, bins=360,
             fitsig_binned, coeffs, covars, redchi2s = hwpss_linreg(
                 x=hwp_angle_bin_centers, ys=binned_hwpss, yerrs=hwpss_sigma_bin, modes=modes)
         else:
-            params_init = guess_hwpss_params(
-                x=hwp_angle_bin_centers, ys=binned_hwpss, modes=modes)
-            fitsig_binned, coeffs, covars, redchi2s = hwpss_curvefit(x=hwp_angle_bin_centers, ys=binned_hwpss, yerrs=hwpss_sigma_bin,
-                                                                     modes=modes, params_init=params_init)
+            # The model is linear in the coefficients, so the
+            # curve-fit optimum is given in closed form.
+            fitsig_binned, coeffs, covars, redchi2s = hwpss_batched_fit(
+                x=hwp_angle_bin_centers, ys=binned_hwpss, yerrs=hwpss_sigma_bin, modes=modes)
         # tod template
         fitsig_tod = harms_func(hwp_angle, modes, coeffs)
 
@@ -160,15 +163,14 @@ def get_hwpss(aman, signal=None, hwp_angle=None, bin_signal=True, bins=360,
         hwpss_stats.wrap('redchi2s', redchi2s, [(0, 'dets')])
 
     else:
-        if flags is None:
-            m = np.ones([aman.dets.count, aman.samps.count], dtype=bool)
-        else:
-            m = ~flags.mask()
-
         hwpss_sigma_tod = estimate_sigma_tod(signal, hwp_angle)
         hwpss_stats.wrap('sigma_tod', hwpss_sigma_tod, [(0, 'dets')])
 
-        if lin_reg:
+        if lin_reg and flags is not None:
+            fitsig_tod, coeffs, covars, redchi2s = hwpss_batched_fit(
+                x=hwp_angle, ys=signal, yerrs=hwpss_sigma_tod, modes=modes,
+                flags=flags)
+        elif lin_reg:
             fitsig_tod, coeffs, covars, redchi2s = hwpss_linreg(
                 x=hwp_angle, ys=signal, yerrs=hwpss_sigma_tod, modes=modes)
 
@@ -328,7 +330,121 @@ def hwpss_linreg(x, ys, yerrs, modes):
     return fitsig, coeffs, covars, redchi2s
 
 
-def harms_func(x, modes, coeffs):
+def hwpss_batched_fit(x, ys, yerrs, modes, flags=None, chunk_size=2**16):
+    """
+    Closed-form weighted least-squares fit of the harmonic model (see
+    ``harms_func``) to all detectors at once.
+
+    Because the model is linear in its coefficients, this gives the
+    same optimum as ``hwpss_curvefit`` (with ``absolute_sigma=True``),
+    without a per-detector loop.  Each detector may have its own set
+    of excluded samples: NaN values in ys, and samples flagged in
+    flags.  The per-detector normal matrices are assembled from sums
+    of cos(f x) and sin(f x) over the valid samples, for the sum and
+    difference frequencies f of the modes, using product-to-sum
+    identities.
+
+    Parameters
+    ----------
+    x : numpy.ndarray
+        The independent variable (HWP angle), shape (n_samps,).
+    ys : numpy.ndarray
+        The data, shape (n_dets, n_samps).
+    yerrs : numpy.ndarray
+        The per-detector error estimate, shape (n_dets,).
+    modes : list of int
+        The frequencies of the sine and cosine basis functions to use.
+    flags : RangesMatrix, Ranges or bool array, optional
+        Samples to exclude (True = excluded), (n_dets, n_samps) or
+        (n_samps,).
+    chunk_size : int, optional
+        Number of samples to process at a time.
+
+    Returns
+    -------
+    fitsig : numpy.ndarray
+        The fitted signal, evaluated at all x.
+    coeffs : numpy.ndarray
+        The fitted coefficients, (n_dets, 2*len(modes)).
+    covars : numpy.ndarray
+        The covariance matrices of the coefficients, (n_dets,
+        2*len(modes), 2*len(modes)).
+    redchi2s : numpy.ndarray
+        The reduced chi-square of the fit, computed over the valid
+        samples of each detector.
+    """
+    ys = np.atleast_2d(ys)
+    n_dets, n_samps = ys.shape
+    modes = np.asarray(modes)
+    n_modes = 2 * len(modes)
+    yerrs = np.asarray(yerrs, dtype=float)
+
+    # Frequencies needed for the normal matrix (0 included).
+    freqs = np.unique(np.abs(np.concatenate(
+        [(modes[:, None] + modes[None, :]).ravel(),
+         (modes[:, None] - modes[None, :]).ravel()])))
+    f_index = {f: i for i, f in enumerate(freqs)}
+
+    trig_sums = np.zeros((n_dets, 2 * len(freqs)))
+    rhs = np.zeros((n_dets, n_modes))
+    y2 = np.zeros(n_dets)
+    counts = np.zeros(n_dets)
+    for i0 in range(0, n_samps, chunk_size):
+        i1 = min(i0 + chunk_size, n_samps)
+        _x = x[i0:i1]
+        w = ~np.isnan(ys[:, i0:i1])
+        if flags is not None:
+            if isinstance(flags, np.ndarray):
+                m = flags[..., i0:i1]
+            elif len(flags.shape) == 1:
+                m = flags[i0:i1].mask()
+            else:
+                m = flags[:, i0:i1].mask()
+            w &= ~m
+        w = w.astype(float)
+        y = np.where(w > 0, ys[:, i0:i1], 0.)
+        basis = np.concatenate([np.cos(np.outer(freqs, _x)),
+                                np.sin(np.outer(freqs, _x))])
+        trig_sums += w @ basis.T
+        rhs += y @ harms_func(_x, modes, None, dtype=float).T
+        y2 += np.sum(y**2, axis=-1)
+        counts += np.sum(w, axis=-1)
+
+    C = trig_sums[:, :len(freqs)]
+    S = trig_sums[:, len(freqs):]
+
+    def _cos(f):
+        return C[:, f_index[abs(f)]]
+
+    def _sin(f):
+        return np.sign(f) * S[:, f_index[abs(f)]]
+
+    # Normal matrix; basis order is sin(m0 x), cos(m0 x), sin(m1 x), ...
+    normal = np.empty((n_dets, n_modes, n_modes))
+    for i, a in enumerate(modes):
+        for j, b in enumerate(modes):
+            normal[:, 2*i, 2*j] = 0.5 * (_cos(a - b) - _cos(a + b))
+            normal[:, 2*i+1, 2*j+1] = 0.5 * (_cos(a - b) + _cos(a + b))
+            normal[:, 2*i, 2*j+1] = 0.5 * (_sin(a + b) + _sin(a - b))
+            normal[:, 2*i+1, 2*j] = 0.5 * (_sin(a + b) - _sin(a - b))
+
+    coeffs = np.full((n_dets, n_modes), np.nan)
+    covars = np.full((n_dets, n_modes, n_modes), np.nan)
+    redchi2s = np.full(n_dets, np.nan)
+    ok = counts > n_modes
+    I = np.linalg.pinv(normal[ok], hermitian=True)
+    coeffs[ok] = np.einsum('dij,dj->di', I, rhs[ok])
+    covars[ok] = I * yerrs[ok, None, None]**2
+    # chi2 = sum(y^2) - 2 c.b + c.N.c, over valid samples.
+    chi2 = (y2[ok] - 2 * np.einsum('di,di->d', coeffs[ok], rhs[ok])
+            + np.einsum('di,dij,dj->d', coeffs[ok], normal[ok], coeffs[ok]))
+    redchi2s[ok] = chi2 / yerrs[ok]**2 / (counts[ok] - n_modes)
+
+    fitsig = harms_func(x, modes, coeffs)
+    return fitsig, coeffs, covars, redchi2s
+
+
+def harms_func(x, modes, coeffs, dtype='float32'):
     """
     calculates the harmonics function given the input values, modes and coefficients.
 
@@ -337,12 +453,13 @@ def harms_func(x, modes, coeffs):
     x (numpy.ndarray): Input values
     modes (list): List of modes to be used in the harmonics function
     coeffs (numpy.ndarray): Coefficients of the harmonics function
+    dtype (numpy.dtype): dtype of the harmonic basis vectors
 
     Returns
     -------
     numpy.ndarray: The calculated harmonics function.
     """
-    vects = np.zeros([2*len(modes), x.shape[0]], dtype='float32')
+    vects = np.zeros([2*len(modes), x.shape[0]], dtype=dtype)
     for i, mode in enumerate(modes):
         vects[2*i, :] = np.sin(mode*x)
         vects[2*i+1, :] = np.cos(mode*x)
@@ -564,7 +681,8 @@ def subtract_hwpss(aman, signal='signal', hwpss_template_name='hwpss_model',
 
 
 def demod_tod(aman, signal=None, demod_mode=4,
-              bpf_cfg=None, lpf_cfg=None):
+              bpf_cfg=None, lpf_cfg=None, fused=False, decimate=1,
+              det_chunk=256):
     """
     Demodulate TOD based on HWP angle
 
@@ -588,6 +706,21 @@ def demod_tod(aman, signal=None, demod_mode=4,
         is used.
         Example) lpf_cfg = {'type': 'butter4', 'cutoff': 1.9}
         See filters.get_lpf for details.
+    fused : bool, optional
+        If True, use the single-pass engine (see :func:`demod_tod_fused`),
+        which shares one forward FFT of the signal between dsT and
+        the demodulated outputs, low-pass filters demodQ and demodU
+        together with a single complex FFT, and writes directly into
+        the output arrays.  The results agree with the default path
+        to float32 precision.
+    decimate : int, optional
+        Only with fused=True.  If greater than 1, the outputs are
+        produced at 1/decimate of the input sample rate, by truncating
+        their (low-passed) spectra before the inverse FFT.  In this
+        case aman is not modified and a new AxisManager is returned.
+    det_chunk : int, optional
+        Only with fused=True.  Number of detectors to process at once;
+        this bounds the size of the temporary FFT buffers.
 
     Returns
     -------
@@ -596,6 +729,8 @@ def demod_tod(aman, signal=None, demod_mode=4,
         'dsT' for the original signal filtered with `lpf`, 'demodQ' for the demodulated
         signal real component filtered with `lpf` and multiplied by 2, and 'demodU' for
         the demodulated signal imaginary component filtered with `lpf` and multiplied by 2.
+        If decimate > 1, those fields are instead returned in a new
+        AxisManager (see :func:`demod_tod_fused`).
 
     """
     if signal is None:
@@ -629,7 +764,13 @@ def demod_tod(aman, signal=None, demod_mode=4,
                    'cutoff': lpf_cutoff,
                    'trans_width': 0.1}
     lpf = filters.get_lpf(lpf_cfg)
-        
+
+    if fused:
+        return demod_tod_fused(aman, signal, bpf, lpf, demod_mode=demod_mode,
+                               decimate=decimate, det_chunk=det_chunk)
+    if decimate != 1:
+        raise ValueError("decimate is only supported with fused=True")
+
     phasor = np.exp(demod_mode * 1.j * aman.hwp_angle)
     demod = tod_ops.fourier_filter(aman, bpf, detrend=None,
                                    signal_name=signal_name) * phasor
@@ -649,3 +790,136 @@ def demod_tod(aman, signal=None, demod_mode=4,
     aman['demodU'] = demod.imag
     aman['demodU'] = tod_ops.fourier_filter(
         aman, lpf, signal_name='demodU', detrend=None) * 2.
+
+
+def demod_tod_fused(aman, signal, bpf, lpf, demod_mode=4, decimate=1,
+                    det_chunk=256):
+    """Single-pass HWP demodulation engine used by ``demod_tod(...,
+    fused=True)``.
+
+    For each block of detectors, the signal is transformed once.  The
+    band-passed signal is obtained from that spectrum, multiplied by
+    the phasor, and low-pass filtered with one complex FFT round trip,
+    whose real and imaginary parts are demodQ/2 and demodU/2.  dsT is
+    low-pass filtered from the original spectrum.  The zero-padding
+    and frequency conventions are the same as in
+    :func:`tod_ops.fourier_filter`.  The filters must not depend on
+    the detector.
+
+    Args:
+      aman (AxisManager): Must have timestamps and hwp_angle.
+      signal (ndarray): The (dets, samps) signal.
+      bpf, lpf: Band-pass and low-pass Fourier filters (e.g. from
+        filters.get_bpf and filters.get_lpf).
+      demod_mode (int): HWP harmonic to demodulate.
+      decimate (int): Output decimation factor.
+      det_chunk (int): Number of detectors per block.
+
+    Returns:
+      None, if decimate == 1; dsT, demodQ and demodU are wrapped into
+      aman.  Otherwise, a new AxisManager with aman's dets axis, a
+      samps axis of ceil(n_samps / decimate) samples, and fields
+      timestamps, hwp_angle (and boresight, if present in aman)
+      sub-sampled to that rate, plus dsT, demodQ and demodU.
+
+    """
+    decimate = int(decimate)
+    if decimate < 1:
+        raise ValueError("decimate must be a positive integer")
+    signal = np.atleast_2d(signal)
+    n_det, n = signal.shape
+    times = aman.timestamps
+    delta_t = (times[-1] - times[0]) / n
+
+    # Padded length, divisible by decimate; and decimated lengths.
+    m = -(-n // decimate)
+    n_pad = tod_ops.fft_ops.find_superior_integer(m) * decimate
+    m_pad = n_pad // decimate
+    m_pos = (m_pad + 1) // 2
+    m_neg = m_pad - m_pos
+
+    rfreqs = np.fft.rfftfreq(n_pad, delta_t)
+    cfreqs = np.abs(np.fft.fftfreq(n_pad, delta_t))
+    phasor = np.exp(demod_mode * 1.j * aman.hwp_angle).astype('complex64')
+
+    if decimate == 1:
+        for k in ['dsT', 'demodQ', 'demodU']:
+            aman.wrap_new(k, dtype='float32', shape=('dets', 'samps'))
+        dsT, demodQ, demodU = aman.dsT, aman.demodQ, aman.demodU
+    else:
+        dsT, demodQ, demodU = [np.empty((n_det, m), dtype='float32')
+                               for i in range(3)]
+
+    threads = tod_ops.fft_ops._get_num_threads()
+    fftargs = {'threads': threads, 'flags': ['FFTW_ESTIMATE'], 'axes': (-1,)}
+    plans = {}
+    for i0 in range(0, n_det, det_chunk):
+        rows = slice(i0, min(i0 + det_chunk, n_det))
+        nc = rows.stop - rows.start
+        if nc not in plans:
+            z = pyfftw.empty_aligned((nc, n_pad), dtype='complex64')
+            zd = z if decimate == 1 else \
+                pyfftw.empty_aligned((nc, m_pad), dtype='complex64')
+            plans[nc] = (z, zd,
+                         pyfftw.FFTW(z, z, direction='FFTW_FORWARD', **fftargs),
+                         pyfftw.FFTW(zd, zd, direction='FFTW_BACKWARD', **fftargs))
+        z, zd, z_fwd, zd_bwd = plans[nc]
+
+        with tod_ops.fft_ops.cached_rfft_object(nc, n_pad, 'BOTH') as \
+                (a, b, t_1, t_2):
+            a[:, :n] = signal[rows]
+            a[:, n:] = 0
+            t_1()
+            spec = b.copy()
+
+            # Band-pass, back to time domain, and apply the phasor.
+            bpf.apply(rfreqs, aman, b)
+            t_2()
+            np.multiply(a[:, :n], phasor, out=z[:, :n])
+            z[:, n:] = 0
+
+            # Low-pass the complex demodulated signal (i.e. Q and U
+            # together); truncate the spectrum if decimating.
+            z_fwd()
+            lpf.apply(cfreqs, aman, z)
+            if decimate > 1:
+                zd[:, :m_pos] = z[:, :m_pos]
+                zd[:, m_pos:] = z[:, n_pad - m_neg:]
+            zd_bwd()
+            demodQ[rows] = zd.real[:, :m] * (2. / decimate)
+            demodU[rows] = zd.imag[:, :m] * (2. / decimate)
+
+            # dsT, from the original spectrum.
+            lpf.apply(rfreqs, aman, spec)
+            if decimate == 1:
+                b[:] = spec
+                t_2()
+                dsT[rows] = a[:, :n]
+        if decimate > 1:
+            with tod_ops.fft_ops.cached_rfft_object(
+                    nc, m_pad, 'FFTW_BACKWARD') as (a, b, t_b):
+                b[:] = spec[:, :m_pad // 2 + 1]
+                t_b()
+                dsT[rows] = a[:, :m] / decimate
+
+    if decimate == 1:
+        return
+
+    output = core.AxisManager(aman.dets,
+                              core.OffsetAxis('samps', m, 0,
+                                              aman.samps.origin_tag))
+    output.wrap('timestamps', times[::decimate], [(0, 'samps')])
+    output.wrap('hwp_angle', aman.hwp_angle[::decimate], [(0, 'samps')])
+    if 'boresight' in aman:
+        bore = core.AxisManager(output.samps)
+        for k in aman.boresight._fields:
+            v = aman.boresight[k]
+            if v is None:
+                bore.wrap(k, None)
+            else:
+                bore.wrap(k, v[::decimate], [(0, 'samps')])
+        output.wrap('boresight', bore)
+    output.wrap('dsT', dsT, [(0, 'dets'), (1, 'samps')])
+    output.wrap('demodQ', demodQ, [(0, 'dets'), (1, 'samps')])
+    output.wrap('demodU', demodU, [(0, 'dets'), (1, 'samps')])
+    return output
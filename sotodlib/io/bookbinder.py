@@ -12,17 +12,21 @@ import yaml
 import logging
 import sys
 import shutil
+import copy
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 from sotodlib.site_pipeline.util import init_logger
+from .frame_times import (
+    TimingSystemOff, get_frame_times, frame_times_path, FrameTimesCollector,
+    write_frame_times, load_frame_times, split_ts_bits, counters_to_timestamps,
+)
 
 
 log = logging.getLogger('bookbinder')
 if not log.hasHandlers():
     init_logger('bookbinder')
 
-class TimingSystemOff(Exception):
-    """Exception raised when we try to bind books where the timing system is found to be off and the books have imprecise timing counters"""
-    pass
-
 class NoScanFrames(Exception):
     """Exception raised when we try and bind a book but the SMuRF file contains not Scan frames (so no detector data)"""
     pass
@@ -94,6 +98,65 @@ def next_scan(it):
     return None, interm_frames
 
 
+def get_available_memory():
+    """
+    Returns the available system memory in bytes, or None if it cannot be
+    determined.
+    """
+    try:
+        import psutil
+        return psutil.virtual_memory().available
+    except ImportError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (ValueError, OSError, AttributeError):
+        return None
+
+
+class _RecordCollector(logging.Handler):
+    """Logging handler that stores records so they can be sent back to the
+    parent process."""
+    def __init__(self):
+        super().__init__(level=logging.DEBUG)
+        self.records = []
+
+    def emit(self, record):
+        # Format now, since args and exc_info may not be picklable.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        self.records.append(record)
+
+
+def _bind_stream(stream, outdir, times, frame_idxs, file_idxs, ancil):
+    """
+    Binds a single SmurfStreamProcessor in a worker process.
+
+    Returns
+    -------
+    out_files : list
+        Files written by the stream.
+    records : list
+        Log records emitted while binding.
+    error : tuple or None
+        (exception, formatted traceback) if binding failed.
+    """
+    collector = _RecordCollector()
+    log = logging.Logger(f'bookbinder.{stream.stream_id}', level=logging.DEBUG)
+    log.addHandler(collector)
+    stream.log = log
+    ancil.log = log
+    error = None
+    try:
+        stream.bind(outdir, times, frame_idxs, file_idxs, ancil=ancil)
+    except Exception as e:
+        error = (e, traceback.format_exc())
+    return stream.out_files, collector.records, error
+
+
 class HKBlock:
     def __init__(self, name):
         self.name = name
@@ -345,7 +408,7 @@ class AncilProcessor:
         
 class SmurfStreamProcessor:
     def __init__(self, obs_id, files, book_id, readout_ids, 
-                 log=None, allow_bad_timing=False):
+                 log=None, allow_bad_timing=False, use_frame_times=True):
         self.files = files
         self.obs_id = obs_id
         self.stream_id = None
@@ -363,15 +426,31 @@ class SmurfStreamProcessor:
         self.out_files = []
         self.book_id = book_id
         self.allow_bad_timing = allow_bad_timing
+        self.use_frame_times = use_frame_times
 
         if log is None:
             self.log = logging.getLogger('bookbinder')
         else:
             self.log = log
 
+    def _set_stream_info(self, frame):
+        """Populates attributes from the first scan frame"""
+        self.nchans = len(self.readout_ids)
+        self.primary_names = frame['primary'].names
+        self.bias_names = frame['tes_biases'].names
+        self.timing_paradigm = frame['timing_paradigm']
+        self.session_id = frame['session_id']
+        if 'slow_primary' in frame:
+            self.slow_primary = frame['slow_primary']
+        self.sostream_version = frame['sostream_version']
+        self.stream_id = frame['sostream_id']
+
     def preprocess(self):
         """
-        Extracts file times, nchans, and nframes from file list
+        Extracts file times, nchans, and nframes from file list. If
+        ``use_frame_times`` is set, the times are taken from the frame-times
+        sidecars of the files when they exist (see FrameTimesCollector),
+        instead of reading through the files.
         """
         if self.times is not None:  # Already preprocessed
             return
@@ -385,31 +464,45 @@ class SmurfStreamProcessor:
         frame_idxs = []
         frame_idx = 0
         timing = True
-        for frame in get_frame_iter(self.files):
-            if frame.type != core.G3FrameType.Scan:
+        for file in self.files:
+            sidecar = (load_frame_times(file, log=self.log)
+                       if self.use_frame_times else None)
+            if sidecar is not None:
+                if self.nchans is None:
+                    frame, _ = next_scan(iter(core.G3File(file)))
+                    if frame is not None:
+                        self._set_stream_info(frame)
+                for good, t, fc in zip(sidecar['good'], sidecar['times'],
+                                       sidecar['frame_counters']):
+                    if not (good or self.allow_bad_timing):
+                        ## don't change this error message. used in Imprinter CLI
+                        raise TimingSystemOff("Timing counters not incrementing")
+                    timing = timing and good
+                    ts.append(t)
+                    smurf_frame_counters.append(fc)
+                    frame_idxs.append(np.full(len(t), frame_idx, dtype=np.int32))
+                    self.nframes += 1
+                    frame_idx += 1
                 continue
 
-            # Populate attributes from the first scan frame
-            if self.nchans is None:
-                self.nchans = len(self.readout_ids)
-                self.primary_names = frame['primary'].names
-                fc_idx = list(self.primary_names).index("FrameCounter")
-                self.bias_names = frame['tes_biases'].names
-                self.timing_paradigm = frame['timing_paradigm']
-                self.session_id = frame['session_id']
-                if 'slow_primary' in frame:
-                    self.slow_primary = frame['slow_primary']
-                self.sostream_version = frame['sostream_version']
-                self.stream_id = frame['sostream_id']
-
-            good, t = get_frame_times(frame, self.allow_bad_timing)
-            timing = timing and good
-            ts.append(t)
-            smurf_frame_counters.append(frame['primary'].data[fc_idx])
-            frame_idxs.append(np.full(len(t), frame_idx, dtype=np.int32))
-
-            self.nframes += 1
-            frame_idx += 1
+            for frame in core.G3File(file):
+                if frame.type != core.G3FrameType.Scan:
+                    continue
+
+                # Populate attributes from the first scan frame
+                if self.nchans is None:
+                    self._set_stream_info(frame)
+                if fc_idx is None:
+                    fc_idx = list(frame['primary'].names).index("FrameCounter")
+
+                good, t = get_frame_times(frame, self.allow_bad_timing)
+                timing = timing and good
+                ts.append(t)
+                smurf_frame_counters.append(frame['primary'].data[fc_idx])
+                frame_idxs.append(np.full(len(t), frame_idx, dtype=np.int32))
+
+                self.nframes += 1
+                frame_idx += 1
 
         if len(ts) == 0:
             raise NoScanFrames(f"{self.obs_id} has no detector data")
@@ -477,15 +570,44 @@ class SmurfStreamProcessor:
 
         oframe_idxs = frame_idxs[sample_map]  # out-frame idx for each in sample
         oframe_idxs[~mapped] = -1 
-        _, offsets = np.unique(frame_idxs, return_index=True)
+        # Out-frames are contiguous ranges of the book samples
+        oframe_vals, oframe_starts, oframe_counts = np.unique(
+            frame_idxs, return_index=True, return_counts=True)
         # Sample idx within each out-frame for every input sample
-        out_offset_idxs = sample_map - offsets[frame_idxs[sample_map]]
+        out_offset_idxs = sample_map - oframe_starts[frame_idxs[sample_map]]
 
         iframe_idxs = self.frame_idxs  #in-frame idx for each in sample
         _, offsets = np.unique(self.frame_idxs, return_index=True)
         # Sample idx within each in-frame for every input sample
         in_offset_idxs = np.arange(len(self.times)) - offsets[self.frame_idxs]
 
+        # Build the copy plan once, up front. The mapped input samples,
+        # ordered by (out-frame, in-frame), are split into runs where both
+        # the in-frame and out-frame samples are contiguous, so each run
+        # can be copied with slices:
+        #    >> data[:, out0:out1] = iframe['data'].data[:, in0:in1]
+        # This is much faster than fancy indexing since numpy does not need
+        # to create a temporary copy of the data. The runs for each
+        # out-frame are then found by binary search, instead of masking
+        # the full sample arrays for every frame.
+        sel = np.nonzero(mapped)[0]
+        sel = sel[np.lexsort((sel, iframe_idxs[sel], oframe_idxs[sel]))]
+        run_oframe = oframe_idxs[sel]
+        run_iframe = iframe_idxs[sel]
+        insamps = in_offset_idxs[sel]
+        outsamps = out_offset_idxs[sel]
+        split_idxs = 1 + np.where(
+            (np.diff(run_oframe) != 0) | (np.diff(run_iframe) != 0)
+            | (np.diff(insamps) != 1) | (np.diff(outsamps) != 1))[0]
+        run_starts = np.concatenate([[0], split_idxs]).astype(int)[:len(sel)]
+        run_stops = np.concatenate([split_idxs, [len(sel)]]).astype(int)[:len(sel)]
+        run_oframe = run_oframe[run_starts]
+        run_iframe = run_iframe[run_starts]
+        run_in0, run_in1 = insamps[run_starts], insamps[run_stops - 1] + 1
+        run_out0, run_out1 = outsamps[run_starts], outsamps[run_stops - 1] + 1
+        oframe_run_starts = np.searchsorted(run_oframe, oframe_vals, side='left')
+        oframe_run_stops = np.searchsorted(run_oframe, oframe_vals, side='right')
+
         # Handle file writers
         writer = None
         cur_file_idx = None
@@ -497,7 +619,9 @@ class SmurfStreamProcessor:
         oframe_num = 0
         pbar.update()
 
-        for oframe_idx in np.unique(frame_idxs):
+        for oframe_idx, i0, nsamp, r0, r1 in zip(
+                oframe_vals, oframe_starts, oframe_counts,
+                oframe_run_starts, oframe_run_stops):
             # Update writer
             if file_idxs[oframe_idx] != cur_file_idx:
                 close_writer(writer)
@@ -508,14 +632,17 @@ class SmurfStreamProcessor:
                 writer = core.G3Writer(fname)
 
             # Initialize stuff
-            m = frame_idxs == oframe_idx
-            nsamp = np.sum(m)
-            ts = times[m]
+            i1 = i0 + nsamp - 1
+            ts = times[i0:i1 + 1]
             data = np.zeros((self.nchans, nsamp), dtype=np.int32)
             biases = np.zeros((len(self.bias_names), nsamp), dtype=np.int32)
             primary = np.zeros((len(self.primary_names), nsamp), dtype=np.int64)
             filled = np.zeros(nsamp, dtype=bool)
-            
+
+            # Last in-frame with samples for this out-frame
+            last_iframe = run_iframe[r1 - 1] if r1 > r0 else -1
+            r = r0
+
             # Loop through in_frames filling current out_frame
             while True:
                 # First, write any intermediate frames like observation and wiring
@@ -526,41 +653,19 @@ class SmurfStreamProcessor:
                     oframe_num += 1
                     writer(fr)
 
-                m = (oframe_idxs == oframe_idx) & (iframe_idxs == iframe_idx)
-                outsamps = out_offset_idxs[m]
-                insamps = in_offset_idxs[m]
-
-                # Below is equivalent to:
-                #    >> data[:, outsamps] = iframe['data'][:, insamps]
-                #    >> ...
-                # However it is much faster to copy arrays by mapping contiguous
-                # chunks to contiguous chunks using slices, like:
-                #    >> arr_out[:, o0:o1] = arr_in[:, i0:i1]
-                # since numpy does not need to create a temporary copy of the
-                # data, and can just do a direct mem-map. This speeds up binding
-                # by a factory of ~4.
-                #
-                # Here we are splitting outsamps and insamps into a list
-                # of ranges where both arrays are contiguous. Then we loop
-                # through each sub-range and copy data via slicing.
-                split_idxs = 1 + np.where(
-                    (np.diff(outsamps) > 1) | (np.diff(insamps) > 1))[0]
-                outsplits = np.split(outsamps, split_idxs)
-                insplits = np.split(insamps, split_idxs)
-                for i in range(len(outsplits)):
-                    if len(insplits[i]) == 0:
-                        continue
-
-                    in0, in1 = insplits[i][0], insplits[i][-1] + 1
-                    out0, out1 = outsplits[i][0], outsplits[i][-1] + 1
-
-                    data[:, out0:out1] = iframe['data'].data[:, in0:in1]
-                    biases[:, out0:out1] = iframe['tes_biases'].data[:, in0:in1]
-                    primary[:, out0:out1] = iframe['primary'].data[:, in0:in1]
-                    filled[out0:out1] = 1
+                # Copy runs that come from the current in_frame
+                while r < r1 and run_iframe[r] <= iframe_idx:
+                    if run_iframe[r] == iframe_idx:
+                        in0, in1 = run_in0[r], run_in1[r]
+                        out0, out1 = run_out0[r], run_out1[r]
+                        data[:, out0:out1] = iframe['data'].data[:, in0:in1]
+                        biases[:, out0:out1] = iframe['tes_biases'].data[:, in0:in1]
+                        primary[:, out0:out1] = iframe['primary'].data[:, in0:in1]
+                        filled[out0:out1] = 1
+                    r += 1
 
                 # If there are any remaining samples in the next in_frame, pull it and repeat
-                if np.any((oframe_idxs == oframe_idx) & (iframe_idxs > iframe_idx)):
+                if last_iframe > iframe_idx:
                     iframe, interm_frames = next_scan(inframe_iter)
                     iframe_idx += 1
                     pbar.update()
@@ -587,9 +692,6 @@ class SmurfStreamProcessor:
                     kind='linear', fill_value=fill_value, bounds_error=False
                 )(ts[~filled])
 
-            m = frame_idxs == oframe_idx
-            i0, i1 = np.where(m)[0][[0, -1]]
-
             oframe = core.G3Frame(core.G3FrameType.Scan)
 
             if ancil is not None:
@@ -654,6 +756,18 @@ class BookBinder:
         multiple copies of the same data
     allow_bad_time: bool, optional
         if not true, books will not be bound if the timing systems signals are not found. 
+    nproc : int, optional
+        Number of processes used to bind the smurf streams. Each stream is
+        bound in its own process, and log records and errors are passed
+        back to the main binder log.
+    max_memory : float, optional
+        Memory budget in bytes for parallel binding. Streams are only
+        started while their estimated memory use fits the budget. Defaults
+        to the available system memory.
+    use_frame_times : bool, optional
+        If true, smurf timestamps are read from the frame-times sidecars of
+        the level 2 files where they exist, so that each file is only read
+        once, during binding. See FrameTimesCollector.
     
     Attributes
     -----------
@@ -670,7 +784,8 @@ class BookBinder:
     """
     def __init__(self, book, obsdb, filedb, data_root, readout_ids, outdir,
                  max_samps_per_frame=50_000, max_file_size=1e9, 
-                ignore_tags=False, ancil_drop_duplicates=False, allow_bad_timing=False):
+                ignore_tags=False, ancil_drop_duplicates=False, allow_bad_timing=False,
+                nproc=1, max_memory=None, use_frame_times=True):
         self.filedb = filedb
         self.book = book
         self.data_root = data_root
@@ -686,6 +801,8 @@ class BookBinder:
         self.max_file_size = max_file_size
         self.ignore_tags = ignore_tags
         self.allow_bad_timing = allow_bad_timing
+        self.nproc = nproc
+        self.max_memory = max_memory
 
         if os.path.exists(outdir):
             if len(os.listdir(outdir)) > 1:
@@ -721,6 +838,7 @@ class BookBinder:
             self.streams[stream_id] = SmurfStreamProcessor(
                 obs_id, files, book.bid, readout_ids[obs_id], log=self.log,
                 allow_bad_timing=self.allow_bad_timing,
+                use_frame_times=use_frame_times,
             )
 
         self.times = None
@@ -935,13 +1053,77 @@ class BookBinder:
         
         tot = np.sum([s.nframes for s in self.streams.values()])
         pbar = tqdm(total=tot, disable=(not pbar))
-        for stream in self.streams.values():
-            stream.bind(self.outdir, self.times, self.frame_idxs,
-                        self.file_idxs, pbar=pbar, ancil=self.ancil)
+        if self.nproc > 1 and len(self.streams) > 1:
+            self._bind_streams_parallel(pbar)
+        else:
+            for stream in self.streams.values():
+                stream.bind(self.outdir, self.times, self.frame_idxs,
+                            self.file_idxs, pbar=pbar, ancil=self.ancil)
 
         self.log.info("Finished binding data. Exiting.")
         return True
 
+    def _estimate_bind_memory(self, stream):
+        """
+        Rough estimate of the peak memory in bytes used to bind a stream:
+        the sample mapping arrays, plus input and output frame buffers.
+        """
+        max_frame_len = np.bincount(self.frame_idxs).max()
+        nchans = stream.nchans + len(stream.bias_names) + len(stream.primary_names)
+        return (48 * len(stream.times) + 16 * nchans * max_frame_len
+                + 250e6)  # interpreter and libraries
+
+    def _bind_streams_parallel(self, pbar):
+        """
+        Binds smurf streams in a process pool, starting streams only while
+        their estimated memory use fits in the memory budget.
+        """
+        budget = self.max_memory
+        if budget is None:
+            budget = get_available_memory()
+        streams = sorted(self.streams.values(), key=self._estimate_bind_memory,
+                         reverse=True)
+        ancil = copy.copy(self.ancil)
+        ancil.log = None
+
+        errors = []
+        running = {}  # future -> (stream, mem estimate)
+        # Worker processes are spawned, not forked: forking after so3g /
+        # OpenMP threads have run in this process can deadlock.
+        ctx = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=self.nproc, mp_context=ctx) as pool:
+            while streams or running:
+                used = sum(m for _, m in running.values())
+                while streams and len(running) < self.nproc:
+                    mem = self._estimate_bind_memory(streams[0])
+                    if running and budget is not None and used + mem > budget:
+                        break
+                    stream = streams.pop(0)
+                    self.log.info(f"Starting to bind {stream.stream_id} "
+                                  f"(~{mem / 1e9:.1f} GB)")
+                    _stream = copy.copy(stream)
+                    _stream.log = None
+                    fut = pool.submit(_bind_stream, _stream, self.outdir,
+                                      self.times, self.frame_idxs,
+                                      self.file_idxs, ancil)
+                    running[fut] = (stream, mem)
+                    used += mem
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for fut in done:
+                    stream, _ = running.pop(fut)
+                    out_files, records, error = fut.result()
+                    for record in records:
+                        self.log.handle(record)
+                    if error is not None:
+                        self.log.error(f"Binding {stream.stream_id} failed:\n"
+                                       f"{error[1]}")
+                        errors.append(error[0])
+                    stream.out_files = out_files
+                    pbar.update(stream.nframes)
+        pbar.close()
+        if errors:
+            raise errors[0]
+
 
 def fill_time_gaps(ts):
     """
@@ -984,67 +1166,6 @@ def fill_time_gaps(ts):
     return new_ts, ~m
 
 
-_primary_idx_map = {}
-def get_frame_times(frame, allow_bad_timing=False):
-    """
-    Returns timestamps for a G3Frame of detector data.
-
-    Parameters
-    --------------
-    frame : G3Frame
-        Scan frame containing detector data
-    allow_bad_timing: bool, optional
-        if not true, raises an error if it finds data with imprecise timing
-
-    Returns
-    --------------
-    high_precision : bool
-        If true, timestamps are computed from timing counters. If not, they are
-        software timestamps
-    
-    timestamps : np.ndarray
-        Array of timestamps (sec) for samples in the frame
-
-    """
-    if len(_primary_idx_map) == 0:
-        for i, name in enumerate(frame['primary'].names):
-            _primary_idx_map[name] = i
-        
-    c0 = frame['primary'].data[_primary_idx_map['Counter0']]
-    c2 = frame['primary'].data[_primary_idx_map['Counter2']]
-
-    counters = np.all( np.diff(c0)!=0 ) and np.all( np.diff( c2 )!=0)
-
-    if counters:
-        return True, counters_to_timestamps(c0, c2)
-    elif allow_bad_timing:
-        return False, np.array(frame['data'].times) / core.G3Units.s
-    else:
-        ## don't change this error message. used in Imprinter CLI
-        raise TimingSystemOff("Timing counters not incrementing")
-
-
-def split_ts_bits(c):
-    """
-    Split up 64 bit to 2x32 bit
-    """
-    NUM_BITS_PER_INT = 32
-    MAXINT = (1 << NUM_BITS_PER_INT) - 1
-    a = (c >> NUM_BITS_PER_INT) & MAXINT
-    b = c & MAXINT
-    return a, b
-
-
-def counters_to_timestamps(c0, c2):
-    s, ns = split_ts_bits(c2)
-
-    # Add 20 years in seconds (accounting for leap years) to handle
-    # offset between EPOCH time referenced to 1990 relative to UNIX time.
-    c2 = s + ns*1e-9 + 5*(4*365 + 1)*24*60*60
-    ts = np.round(c2 - (c0 / 480000) ) + c0 / 480000
-    return ts
-
-
 def find_ref_idxs(refs, vs):
     """
     Creates a mapping from a list of timestamps (vs) to a list of reference
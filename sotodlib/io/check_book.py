@@ -12,7 +12,9 @@ from spt3g import core
 import os
 import fnmatch
 import glob
+import hashlib
 import yaml
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
 
@@ -39,6 +41,9 @@ _DEFAULT_CONFIG = {
     'tolerate_stray_files': False,
     'remove_fixed_tones': False, 
     'tolerate_missing_extra_files': False,
+
+    # Number of processes for check_frames (one per file set).
+    'nproc': 1,
 }
     
 
@@ -53,6 +58,143 @@ class _compact_list(list):
             return super.__repr__(self)
 
 
+def _iter_frames(filename):
+    """Iterate over the frames in a G3 file, yielding (byte_offset,
+    frame) for each.  The byte_offset can be passed to
+    G3IndexedReader.Seek to get back to the start of that frame.
+
+    """
+    reader = so3g.G3IndexedReader(filename)
+    while True:
+        byte_offset = reader.Tell()
+        frames = reader.Process(None)
+        if not frames:
+            break
+        yield byte_offset, frames[0]
+
+
+def _get_frame_timestamps(frame):
+    """Returns the timestamps (G3Time ticks) used for alignment checks
+    from a Scan frame, and a flag indicating whether they came from
+    "ancil" (if False, they came from "primary" or are missing).
+
+    """
+    if 'ancil' in frame:
+        return np.asarray(frame['ancil'].times), True
+    if 'primary' in frame:
+        return np.asarray(frame['primary'].times), False
+    return None, False
+
+
+def _read_timestamps(filenames):
+    """Read and concatenate the timestamps from the Scan frames of a
+    file set (see _get_frame_timestamps).
+
+    """
+    timestamps = []
+    for filename in filenames:
+        for _, frame in _iter_frames(filename):
+            if frame.type == core.G3FrameType.Scan:
+                t, _ = _get_frame_timestamps(frame)
+                if t is not None:
+                    timestamps.append(t)
+    if len(timestamps) == 0:
+        return np.zeros(0, dtype=int)
+    return np.hstack(timestamps)
+
+
+def _scan_fileset(filenames, config):
+    """Read the "Scan" frames from a file set (the ancil files, or the
+    files of one stream_id) and check sample_range structure.  This
+    is the per-file set part of BookScanner.check_frames, as a
+    function so it can run in a worker process.
+
+    Rather than keeping the timestamps, their count and a hash of
+    their values are returned; file sets with the same hash have
+    identical timestamps.
+
+    Returns:
+      A dict with entries 'errors' and 'warnings' (lists of
+      (basename, msg)); 'failed' (True if scanning was abandoned
+      because of an error); 'sample_ranges' (list of (start, end) for
+      each file); 'dets' (the detector names, or None);
+      'frame_offsets' (dict from filename to the list of frame index
+      rows); 'n_timestamps' and 'timestamps_hash'.
+
+    """
+    results = {
+        'errors': [],
+        'warnings': [],
+        'failed': False,
+        'sample_ranges': [],
+        'dets': None,
+        'frame_offsets': {},
+        'n_timestamps': 0,
+        'timestamps_hash': None,
+    }
+
+    def _err(filename, msg, warn=False):
+        results['warnings' if warn else 'errors'].append((filename, msg))
+
+    t_hash = hashlib.sha1()
+    start, end = 0, None
+    hack_offset = 0
+    for filename in filenames:
+        basename = os.path.split(filename)[1]
+        frame_offsets = []
+        results['frame_offsets'][filename] = frame_offsets
+        for frame_index, (byte_offset, frame) in enumerate(
+                _iter_frames(filename)):
+            frame_offsets.append(
+                [frame_index, byte_offset, str(frame.type), None, None])
+            if frame.type == core.G3FrameType.Scan:
+                a, b = list(frame['sample_range'])
+                if config['sample_range_inclusive_hack']:
+                    # Change (0, 999) into (0, 1000).
+                    b = b + 1  # schema hack
+
+                if end is None:
+                    # This is first frame in new file and
+                    # "start" is expected first sample index.
+                    if a == 0 and start != 0:
+                        _err(basename, 'sample_range is resetting on file boundaries.',
+                             warn=config['tolerate_sample_range_resetting'])
+                        hack_offset = start
+                    if a != start - hack_offset:
+                        _err(basename, f'sample_range entries are not abutting: '
+                             f'[..., {start - hack_offset}] -> [{a}, {b}].')
+                        results['failed'] = True
+                        return results
+                else:
+                    # This is not the first frame, "end" from
+                    # last frame should match start of this one.
+                    if a != end - hack_offset:
+                        _err(basename, f'sample_range entries are not abutting: '
+                             f'[..., {end - hack_offset}] -> [{a}, {b}].')
+                        results['failed'] = True
+                        return results
+                end = b + hack_offset
+                frame_offsets[-1][3:] = [a + hack_offset, end]
+
+                t, from_ancil = _get_frame_timestamps(frame)
+                if not from_ancil:
+                    _err(basename, f'No "ancil" entry',
+                         warn=config['tolerate_missing_ancil'])
+                if t is not None:
+                    t_hash.update(np.ascontiguousarray(t).tobytes())
+                    results['n_timestamps'] += len(t)
+
+                if 'signal' in frame and results['dets'] is None:
+                    results['dets'] = _compact_list(frame['signal'].names)
+
+        # Wrap up this file; for next file, requeue expectations.
+        results['sample_ranges'].append((start, end))
+        start, end = end, None
+
+    results['timestamps_hash'] = t_hash.hexdigest()
+    return results
+
+
 class BookScanner:
     """The BookScanner helps to catalog the contents of an obs/oper book,
     validate that the contents look right, and produce entries for
@@ -85,6 +227,7 @@ class BookScanner:
             'warnings': [],
             'det_lists': {},
             'sample_ranges': None,
+            'frame_offsets': {},
             'ready': False,
             'metadata': None,
         }
@@ -230,95 +373,71 @@ class BookScanner:
 
     def check_frames(self):
         """Read the "Scan" frames from all files and check structure /
-        consistency.
+        consistency.  The ancil files and the files of each stream_id
+        are scanned independently (see _scan_fileset), in parallel if
+        config['nproc'] > 1.  Timestamps of each file set are
+        compared to the first one (normally ancil) by hash, and are
+        only re-read to describe a discrepancy.
 
         """
         meta = self.results['metadata']
         to_check = ['ancil'] + meta['stream_ids']
 
-        timestamps_master = None
-        sample_ranges = []
+        filesets = {}
         for stream_id in to_check:
             if stream_id == 'ancil':
                 pattern = self.config['ancil_file_pattern']
             else:
                 pattern = self.config['stream_file_pattern']
+            filesets[stream_id] = [
+                self._get_filename(pattern, stream_id=stream_id, index=index)
+                for index in range(meta['file_count'])]
+
+        nproc = min(self.config['nproc'], len(to_check))
+        if nproc > 1:
+            with ProcessPoolExecutor(max_workers=nproc) as pool:
+                futures = [pool.submit(_scan_fileset, filesets[stream_id],
+                                       self.config)
+                           for stream_id in to_check]
+                scans = [fut.result() for fut in futures]
+        else:
+            scans = (_scan_fileset(filesets[stream_id], self.config)
+                     for stream_id in to_check)
 
-            timestamps = []
-            start, end = 0, None
-            hack_offset = 0
-            dets = None
-
-            for index in range(meta['file_count']):
-                filename = self._get_filename(pattern, stream_id=stream_id, index=index)
-                basename = os.path.split(filename)[1]
-                for frame in core.G3File(filename):
-                    if frame.type == core.G3FrameType.Scan:
-                        a, b = list(frame['sample_range'])
-                        if self.config['sample_range_inclusive_hack']:
-                            # Change (0, 999) into (0, 1000).
-                            b = b + 1  # schema hack
-
-                        if end is None:
-                            # This is first frame in new file and
-                            # "start" is expected first sample index.
-                            if a == 0 and start != 0:
-                                self._err(basename, 'sample_range is resetting on file boundaries.',
-                                          warn=self.config['tolerate_sample_range_resetting'])
-                                hack_offset = start
-                            if a != start - hack_offset:
-                                self._err(basename, f'sample_range entries are not abutting: '
-                                          f'[..., {start - hack_offset}] -> [{a}, {b}].')
-                                raise RuntimeError()
-                        else:
-                            # This is not the first frame, "end" from
-                            # last frame should match start of this one.
-                            if a != end - hack_offset:
-                                self._err(basename, f'sample_range entries are not abutting: '
-                                          f'[..., {end - hack_offset}] -> [{a}, {b}].')
-                                raise RuntimeError()
-                        end = b + hack_offset
-
-                        if 'ancil' in frame:
-                            timestamps.append(np.asarray(frame['ancil'].times))
-                        else:
-                            self._err(basename, f'No "ancil" entry',
-                                      warn=self.config['tolerate_missing_ancil'])
-                            if 'primary' in frame:
-                                timestamps.append(np.asarray(frame['primary'].times))
-
-                        if 'signal' in frame and dets is None:
-                            dets = _compact_list(frame['signal'].names)
-
-                # Wrap up this file
+        master = None
+        sample_ranges = []
+        for stream_id, scan in zip(to_check, scans):
+            self.results['errors'].extend(scan['errors'])
+            self.results['warnings'].extend(scan['warnings'])
+            self.results['frame_offsets'].update(scan['frame_offsets'])
+            if scan['failed']:
+                raise RuntimeError()
+
+            for index, sample_range in enumerate(scan['sample_ranges']):
                 if index >= len(sample_ranges):
-                    sample_ranges.append((start, end))
-                else:
-                    if sample_ranges[index] != (start, end):
-                        self._err(basename, f'sample_range discrepancy, {(start, end)} '
-                                  f'instead of {sample_ranges[index]}')
-
-                # For next file, requeue expectations.
-                start, end = end, None
+                    sample_ranges.append(sample_range)
+                elif sample_ranges[index] != sample_range:
+                    basename = os.path.split(filesets[stream_id][index])[1]
+                    self._err(basename, f'sample_range discrepancy, {sample_range} '
+                              f'instead of {sample_ranges[index]}')
 
             # Check / record stuff for the stream_id.
-            self.results['det_lists'][stream_id] = dets
+            self.results['det_lists'][stream_id] = scan['dets']
 
-            if len(timestamps) == 0:
+            if scan['n_timestamps'] == 0:
                 self._err(None, f'No timestamps in fileset.',
                           warn=(stream_id == 'ancil' and self.config['tolerate_missing_ancil_timestamps']))
-            else:
-                timestamps = np.hstack(timestamps)
-                if timestamps_master is None:
-                    timestamps_master = timestamps
-                else:
-                    if len(timestamps) != len(timestamps_master):
-                        self._err(None, f'Timestamps length discrepancy.')
-                    elif not (timestamps == timestamps_master).all():
-                        dmax_us = np.max(abs(timestamps - timestamps_master)) \
-                                  / core.G3Units.microseconds
-                        self._err(None, f'Timestamps value discrepancy (up to {dmax_us:.3} us).',
-                                  warn=self.config['tolerate_timestamps_value_discrepancy'])
+            elif master is None:
+                master = stream_id, scan
+            elif scan['n_timestamps'] != master[1]['n_timestamps']:
+                self._err(None, f'Timestamps length discrepancy.')
+            elif scan['timestamps_hash'] != master[1]['timestamps_hash']:
+                timestamps = _read_timestamps(filesets[stream_id])
+                timestamps_master = _read_timestamps(filesets[master[0]])
+                dmax_us = np.max(abs(timestamps - timestamps_master)) \
+                          / core.G3Units.microseconds
+                self._err(None, f'Timestamps value discrepancy (up to {dmax_us:.3} us).',
+                          warn=self.config['tolerate_timestamps_value_discrepancy'])
 
         # If metadata included sample_ranges, check that.
         _sample_ranges = meta.get('sample_ranges')
@@ -343,6 +462,9 @@ class BookScanner:
           file_rows: list of file table entries; each entry is a dict
             that can be passed as kwargs to ObsFileDb.add_file.
 
+        If db is passed, the frame index of each file (see
+        prep_frame_offsets) is also recorded there.
+
         """
         meta, det_lists, sample_ranges = [
             self.results[k] for k in ['metadata', 'det_lists', 'sample_ranges']]
@@ -381,8 +503,41 @@ class BookScanner:
                     db.add_detset(name, dets)
             for row in file_rows:
                 db.add_obsfile(**row)
+            for filename, rows in self.prep_frame_offsets(filebase_root).items():
+                db.add_frame_offsets(filename, rows)
 
         return detset_rows, file_rows
+
+    def prep_frame_offsets(self, filebase_root):
+        """Get the frame index of each detector data file, for the
+        ObsFileDb frame_offsets table.  This lets loaders seek
+        directly to the frames covering a requested sample range.
+
+        Args:
+          filebase_root (str): As for prep_obsfiledb.
+
+        Returns:
+          dict mapping the filename (as in the file_rows from
+          prep_obsfiledb) to a list of rows, each of which can be
+          passed to ObsFileDb.add_frame_offsets.
+
+        """
+        meta = self.results['metadata']
+        output = {}
+        for stream_id in meta['stream_ids']:
+            for index in range(meta['file_count']):
+                path = self._get_filename(
+                    self.config['stream_file_pattern'],
+                    stream_id=stream_id, index=index)
+                rows = self.results['frame_offsets'].get(path)
+                if rows is None:
+                    continue
+                if filebase_root == '/':
+                    relpath = os.path.abspath(path)
+                else:
+                    relpath = os.path.relpath(path, filebase_root)
+                output[relpath] = [tuple(row) for row in rows]
+        return output
     
     def report(self):
         """Print a summary of warning and error messages."""
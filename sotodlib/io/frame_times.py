@@ -0,0 +1,166 @@
+"""frame_times.py
+
+Timestamps of level 2 smurf frames, computed from the timing counters,
+and the frame-times sidecar files that cache them (see
+FrameTimesCollector).  These are shared by the G3tSmurf archive, which
+writes the sidecars while indexing, and the bookbinder, which reads
+them.
+
+"""
+
+import os
+import logging
+
+import numpy as np
+from spt3g import core
+
+
+log = logging.getLogger(__name__)
+
+
+class TimingSystemOff(Exception):
+    """Exception raised when we try to bind books where the timing system is found to be off and the books have imprecise timing counters"""
+    pass
+
+
+_primary_idx_map = {}
+def get_frame_times(frame, allow_bad_timing=False):
+    """
+    Returns timestamps for a G3Frame of detector data.
+
+    Parameters
+    --------------
+    frame : G3Frame
+        Scan frame containing detector data
+    allow_bad_timing: bool, optional
+        if not true, raises an error if it finds data with imprecise timing
+
+    Returns
+    --------------
+    high_precision : bool
+        If true, timestamps are computed from timing counters. If not, they are
+        software timestamps
+    
+    timestamps : np.ndarray
+        Array of timestamps (sec) for samples in the frame
+
+    """
+    if len(_primary_idx_map) == 0:
+        for i, name in enumerate(frame['primary'].names):
+            _primary_idx_map[name] = i
+        
+    c0 = frame['primary'].data[_primary_idx_map['Counter0']]
+    c2 = frame['primary'].data[_primary_idx_map['Counter2']]
+
+    counters = np.all( np.diff(c0)!=0 ) and np.all( np.diff( c2 )!=0)
+
+    if counters:
+        return True, counters_to_timestamps(c0, c2)
+    elif allow_bad_timing:
+        return False, np.array(frame['data'].times) / core.G3Units.s
+    else:
+        ## don't change this error message. used in Imprinter CLI
+        raise TimingSystemOff("Timing counters not incrementing")
+
+
+def frame_times_path(filename):
+    """Path of the frame-times sidecar of a level 2 smurf file."""
+    return filename + '.frame_times.npz'
+
+
+class FrameTimesCollector:
+    """
+    Collects the per-frame sample times of a level 2 smurf file, as computed
+    by ``get_frame_times``, so they can be saved in a sidecar file next to it.
+    With the sidecar, SmurfStreamProcessor.preprocess does not need to read
+    the file, which is then only read once, while binding.
+    """
+    def __init__(self):
+        self.good = []
+        self.times = []
+        self.frame_counters = []
+
+    def add_frame(self, frame):
+        """Adds a Scan frame"""
+        good, t = get_frame_times(frame, allow_bad_timing=True)
+        fc_idx = list(frame['primary'].names).index("FrameCounter")
+        self.good.append(good)
+        self.times.append(t)
+        self.frame_counters.append(frame['primary'].data[fc_idx])
+
+    def write(self, filename):
+        """Writes the sidecar for level 2 file ``filename``"""
+        path = frame_times_path(filename)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                file_size=os.path.getsize(filename),
+                n_samples=np.array([len(t) for t in self.times], dtype=int),
+                good=np.array(self.good, dtype=bool),
+                times=np.hstack(self.times) if self.times else np.zeros(0),
+                frame_counters=(np.hstack(self.frame_counters)
+                                if self.frame_counters else np.zeros(0, int)),
+            )
+        os.replace(tmp_path, path)
+
+
+def write_frame_times(filename):
+    """Scans a level 2 smurf file and writes its frame-times sidecar"""
+    collector = FrameTimesCollector()
+    for frame in core.G3File(filename):
+        if frame.type == core.G3FrameType.Scan:
+            collector.add_frame(frame)
+    collector.write(filename)
+
+
+def load_frame_times(filename, log=log):
+    """
+    Loads the frame-times sidecar of a level 2 smurf file. Problems with
+    the sidecar are reported to ``log``.
+
+    Returns
+    --------
+    frame_times : dict or None
+        Dict with per-frame lists ``good``, ``times`` and ``frame_counters``.
+        None if there is no sidecar, or if it does not match the file (e.g.
+        the file was still being written when the sidecar was made).
+    """
+    path = frame_times_path(filename)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            if int(data['file_size']) != os.path.getsize(filename):
+                log.warning(f"Ignoring out of date sidecar {path}")
+                return None
+            splits = np.cumsum(data['n_samples'])[:-1]
+            return {
+                'good': list(data['good']),
+                'times': np.split(data['times'], splits),
+                'frame_counters': np.split(data['frame_counters'], splits),
+            }
+    except Exception as e:
+        log.warning(f"Could not load sidecar {path}: {e}")
+        return None
+
+
+def split_ts_bits(c):
+    """
+    Split up 64 bit to 2x32 bit
+    """
+    NUM_BITS_PER_INT = 32
+    MAXINT = (1 << NUM_BITS_PER_INT) - 1
+    a = (c >> NUM_BITS_PER_INT) & MAXINT
+    b = c & MAXINT
+    return a, b
+
+
+def counters_to_timestamps(c0, c2):
+    s, ns = split_ts_bits(c2)
+
+    # Add 20 years in seconds (accounting for leap years) to handle
+    # offset between EPOCH time referenced to 1990 relative to UNIX time.
+    c2 = s + ns*1e-9 + 5*(4*365 + 1)*24*60*60
+    ts = np.round(c2 - (c0 / 480000) ) + c0 / 480000
+    return ts
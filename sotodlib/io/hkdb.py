@@ -13,6 +13,9 @@ from typing import Union, List, Optional, Dict
 import so3g
 from spt3g import core as spt3g_core
 from tqdm.auto import tqdm
+from concurrent.futures import ProcessPoolExecutor
+import shutil
+import tempfile
 import time
 from sotodlib.site_pipeline.util import init_logger
 
@@ -41,6 +44,17 @@ class HkConfig:
         Time [sec] to look back when scanning for new files to index
     show_index_pb: bool
         If true, shows progress bar when indexing
+    index_nproc: int
+        Number of processes used to scan files in update_frame_index.
+    cache_dir: Optional[str]
+        If set, data loaded by ``load_hk`` are also written to a local
+        columnar cache in this directory (one memory-mappable ``.npy``
+        file per field, for each agent, feed and time chunk), and later
+        loads read from the cache instead of decoding the G3 frames
+        again.  Only chunks that are complete according to the frame
+        index are cached.
+    cache_chunk_len: float
+        Length [sec] of the cache time chunks.
     aliases: Dict[str, str]
         Aliases for hk fields. In this dict, the key is the alias name, and the
         value is the field descriptor, in the format of ``agent.feed.field``.
@@ -60,6 +74,9 @@ class HkConfig:
     echo_db: bool = False
     file_idx_lookback_time: Optional[float] = None
     show_index_pb: bool = True
+    index_nproc: int = 1
+    cache_dir: Optional[str] = None
+    cache_chunk_len: float = 3600.
     aliases: Dict[str, str] = field(default_factory=dict)
 
     def __post_init__(self):
@@ -164,7 +181,10 @@ class HkDb:
 
 
 def update_file_index(hkcfg: HkConfig, session=None):
-    """Updates HkFiles database with new files on disk"""
+    """Updates HkFiles database with new files on disk.  Indexed files
+    whose size or modification time changed (e.g. files that were still
+    being written when last indexed) are marked as unindexed, so that
+    update_frame_index picks up their new frames."""
     if session is None:
         hkdb = HkDb(hkcfg)
         session = hkdb.Session()
@@ -174,60 +194,75 @@ def update_file_index(hkcfg: HkConfig, session=None):
     else:
         min_ctime = 0
 
-    all_files = []
+    files = []
+    n_updated = 0
     for subdir in os.listdir(hkcfg.hk_root):
         sdir = os.path.join(hkcfg.hk_root, subdir)
         if min_ctime > os.path.getmtime(sdir):
             continue
-        all_files.extend([
-            os.path.join(sdir, f)
-            for f in os.listdir(sdir)
-            if f.endswith('.g3')
-        ])
-
-    existing_files = [path for path, in session.query(HkFile.path).all()]
-    new_files = sorted(list(set(all_files) - set(existing_files)))
-
-    files = []
-    log.info(f"Adding {len(new_files)} new files to index...")
-    for path in new_files:
-        files.append(HkFile(
-            path=path,
-            size=os.path.getsize(path),
-            mod_time=os.path.getmtime(path),
-            index_status='unindexed'
-        ))
-
+        existing_files = {
+            f.path: f for f in session.query(HkFile).filter(
+                HkFile.path.startswith(sdir + os.sep, autoescape=True))
+        }
+        for entry in os.scandir(sdir):
+            if not entry.name.endswith('.g3'):
+                continue
+            stat = entry.stat()
+            file = existing_files.get(entry.path)
+            if file is None:
+                files.append(HkFile(
+                    path=entry.path,
+                    size=stat.st_size,
+                    mod_time=stat.st_mtime,
+                    index_status='unindexed'
+                ))
+            elif file.size != stat.st_size or file.mod_time != stat.st_mtime:
+                file.size = stat.st_size
+                file.mod_time = stat.st_mtime
+                file.index_status = 'unindexed'
+                n_updated += 1
+
+    log.info(f"Adding {len(files)} new files to index, "
+             f"{n_updated} files were modified...")
+    files.sort(key=lambda f: f.path)
     session.add_all(files)
     session.commit()
 
-def get_frames_from_file(file: HkFile, return_on_fail=True) -> List[HkFrame]:
+
+def _scan_hk_file(path, resume_offset=None, return_on_fail=True):
     """
-    Returns HkFile and HkFrame objects corresponding to a given hk file.
+    Scans an hk file for data frames.
 
     Args
     --------
-    file : HkFile
-        HkFile object corresponding to the file
+    path : str
+        Path to the hk file
+    resume_offset : int
+        If set, byte offset of the last frame that was already indexed.
+        Scanning starts with the frame after it.
     return_on_fail : bool
         If True, if there is a runtime error while reading the g3 file (usually
-        caused by a forced shutdown), the function will still return parsed
-        frames.
+        caused by a forced shutdown or a file still being written), the frames
+        read so far are returned.
 
     Returns
     ---------
-    frames : List[HkFrame]
-        List of all HkFrames in the file
+    frames : List[dict]
+        List of dicts with the agent, feed, byte_offset, start_time and
+        end_time of each data frame.
     """
     frames = []
-    reader = so3g.G3IndexedReader(file.path)
+    reader = so3g.G3IndexedReader(path)
+    if resume_offset is not None:
+        reader.Seek(resume_offset)
+        reader.Process(None)
 
     while True:
         byte_offset = reader.Tell()
         try:
             frame = reader.Process(None)
         except RuntimeError:
-            log.error(f"Error processing file {file.path} byte offset: {byte_offset}")
+            log.error(f"Error processing file {path} byte offset: {byte_offset}")
             if return_on_fail:
                 break
             else:
@@ -245,42 +280,126 @@ def get_frames_from_file(file: HkFile, return_on_fail=True) -> List[HkFrame]:
         _, agent, _, feed = addr.split('.')
         start_time, stop_time = 1<<32, 0
         for block in frame['blocks']:
-            ts = np.array(block.times) / spt3g_core.G3Units.s
-            start_time = min(start_time, ts[0])
-            stop_time = max(stop_time, ts[-1])
-        frames.append(HkFrame(
+            if len(block.times) == 0:
+                continue
+            start_time = min(start_time, block.times[0].time / spt3g_core.G3Units.s)
+            stop_time = max(stop_time, block.times[-1].time / spt3g_core.G3Units.s)
+        frames.append(dict(
             agent=agent, feed=feed, byte_offset=byte_offset,
-            start_time=start_time, end_time=stop_time, file=file
+            start_time=start_time, end_time=stop_time
         ))
 
     return frames
 
 
-def update_frame_index(hkcfg: HkConfig, session=None):
-    """Updates HkFrames database with frames from unindexed files"""
+def _scan_hk_file_safe(args):
+    """Wrapper of _scan_hk_file for process pools; returns (frames, error)."""
+    try:
+        return _scan_hk_file(*args), None
+    except Exception as e:
+        return [], e
+
+
+def get_frames_from_file(file: HkFile, return_on_fail=True) -> List[HkFrame]:
+    """
+    Returns HkFile and HkFrame objects corresponding to a given hk file.
+
+    Args
+    --------
+    file : HkFile
+        HkFile object corresponding to the file
+    return_on_fail : bool
+        If True, if there is a runtime error while reading the g3 file (usually
+        caused by a forced shutdown), the function will still return parsed
+        frames.
+
+    Returns
+    ---------
+    frames : List[HkFrame]
+        List of all HkFrames in the file
+    """
+    return [HkFrame(file=file, **f) for f in
+            _scan_hk_file(file.path, return_on_fail=return_on_fail)]
+
+
+def update_frame_index(hkcfg: HkConfig, session=None, batch_size=100):
+    """
+    Updates HkFrames database with frames from unindexed files.  Files
+    are scanned in parallel using ``hkcfg.index_nproc`` processes.  For
+    files that already have indexed frames (files that were modified
+    since they were indexed), only the frames after the last indexed one
+    are read.
+
+    Args
+    --------
+    hkcfg : HkConfig
+        Configuration object
+    session : Session
+        Database session.  If None, a new one is created.
+    batch_size : int
+        Number of files whose frames are inserted per commit.
+    """
     if session is None:
         hkdb = HkDb(hkcfg)
         session = hkdb.Session()
 
-    files = session.query(HkFile).filter(HkFile.index_status == 'unindexed').all()
+    files = session.query(HkFile).filter(
+        HkFile.index_status == 'unindexed').order_by(HkFile.path).all()
+    # Last indexed frame of each file.
+    resume = dict(session.query(
+        HkFrame.file_id, db.func.max(HkFrame.byte_offset)
+    ).join(HkFile).filter(
+        HkFile.index_status == 'unindexed'
+    ).group_by(HkFrame.file_id).all())
     log.info(f"Indexing {len(files)} files")
-    for file in tqdm(files, disable=(not hkcfg.show_index_pb), ascii=True):
-        frames = get_frames_from_file(file)
-        file_start, file_end = 1<<32, 0
-        for f in frames:
-            file_start = min(file_start, f.start_time)
-            file_end = max(file_end, f.end_time)
-        file.start_time = file_start
-        file.end_time = file_end
-        file.index_status ='indexed'
+
+    args = [(f.path, resume.get(f.id)) for f in files]
+    if hkcfg.index_nproc > 1:
+        pool = ProcessPoolExecutor(max_workers=hkcfg.index_nproc)
+        results = pool.map(_scan_hk_file_safe, args, chunksize=4)
+    else:
+        pool = None
+        results = map(_scan_hk_file_safe, args)
+
+    def commit(batch, rows):
         try:
-            session.add_all(frames)
+            if rows:
+                session.execute(db.insert(HkFrame), rows)
             session.commit()
-        except Exception as e:
+        except Exception:
+            log.exception("Failed to insert frames")
             session.rollback()
-            file.index_status = 'failed'
+            for file in batch:
+                file.index_status = 'failed'
             session.commit()
 
+    batch, rows = [], []
+    try:
+        for file, (frames, err) in tqdm(zip(files, results), total=len(files),
+                                        disable=(not hkcfg.show_index_pb),
+                                        ascii=True):
+            batch.append(file)
+            if err is not None:
+                log.error(f"Error indexing file {file.path}: {err}")
+                file.index_status = 'failed'
+                continue
+            file_start = 1<<32 if file.start_time is None else file.start_time
+            file_end = 0 if file.end_time is None else file.end_time
+            for f in frames:
+                file_start = min(file_start, f['start_time'])
+                file_end = max(file_end, f['end_time'])
+                rows.append(dict(f, file_id=file.id))
+            file.start_time = file_start
+            file.end_time = file_end
+            file.index_status = 'indexed'
+            if len(batch) >= batch_size:
+                commit(batch, rows)
+                batch, rows = [], []
+        commit(batch, rows)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
 
 def update_index_all(cfg: Union[HkConfig, str]):
     """Updates all HK index databases"""
@@ -343,12 +462,24 @@ class LoadSpec:
         End time to load
     downsample_factor: int
         Downsample factor for data
+    downsample_mode: str
+        How to downsample: ``'stride'`` keeps every downsample_factor-th
+        sample; ``'mean'`` averages blocks of downsample_factor samples
+        (timestamps included).  Non-numeric fields are always strided.
+    nproc: int
+        Number of processes used to decode the G3 files.
+    use_cache: bool
+        If False, ignore ``cfg.cache_dir`` and decode all data from the
+        G3 files.
     """
     cfg: HkConfig
     fields: List[str]
     start: float
     end: float
     downsample_factor: int = 1
+    downsample_mode: str = 'stride'
+    nproc: int = 1
+    use_cache: bool = True
 
     def __post_init__(self):
         fs = []
@@ -358,6 +489,8 @@ class LoadSpec:
             else:
                 fs.append(Field.from_str(f))
         self.fields = fs
+        if self.downsample_mode not in ['stride', 'mean']:
+            raise ValueError(f"Unknown downsample_mode: {self.downsample_mode}")
 
 
 class HkResult:
@@ -391,6 +524,130 @@ class HkResult:
         return cls(data, aliases=aliases)
 
 
+def _decode_hk_frames(file_spec, fields=None, start=None, end=None):
+    """
+    Decodes HK frames.
+
+    Args
+    ------
+    file_spec: List[Tuple[str, List[int]]]
+        List of (path, byte_offsets) of the frames to decode.
+    fields: Optional[List[Field]]
+        If set, only fields matching one of these are returned.
+    start, end: Optional[float]
+        If set, only samples with start <= t < end are returned.
+
+    Returns
+    ---------
+    data: dict
+        Dict where the key is the field descriptor and the value is a
+        tuple (timestamps, data).
+    """
+    result = {}  # {field: [timestamps, data]}
+    for path, offsets in file_spec:
+        reader = so3g.G3IndexedReader(path)
+        for offset in sorted(offsets):
+            reader.Seek(offset)
+            frame = reader.Process(None)[0]
+            addr = frame['address']
+            _, agent, _, feed = addr.split('.')
+            for block in frame['blocks']:
+                ts = np.array(block.times) / spt3g_core.G3Units.s
+                s = slice(None)
+                if start is not None or end is not None:
+                    s = np.ones(len(ts), bool)
+                    if start is not None:
+                        s &= (ts >= start)
+                    if end is not None:
+                        s &= (ts < end)
+                    if not s.any():
+                        continue
+                for field_name, data in block.items():
+                    f = Field(agent, feed, field_name)
+                    if fields is not None and not any(
+                            _f.matches(f) for _f in fields):
+                        continue
+                    key = str(f)
+                    if key not in result:
+                        result[key] = [[], []]
+                    result[key][0].append(ts[s])
+                    result[key][1].append(np.array(data)[s])
+    return {k: (np.hstack(v[0]), np.hstack(v[1])) for k, v in result.items()}
+
+
+def _downsample(ts, data, factor, mode):
+    """Downsamples a field by striding or by block-averaging."""
+    if factor <= 1:
+        return ts, data
+    if mode == 'stride' or not np.issubdtype(data.dtype, np.number):
+        return ts[::factor], data[::factor]
+    n = len(ts) // factor * factor
+    blocks = [ts[:n].reshape(-1, factor).mean(axis=1),
+              data[:n].reshape(-1, factor).mean(axis=1)]
+    if n < len(ts):
+        # Partial block at the end.
+        blocks = [np.append(blocks[0], ts[n:].mean()),
+                  np.append(blocks[1], data[n:].mean())]
+    return blocks[0], blocks[1]
+
+
+class _HkCache:
+    """
+    Columnar on-disk cache of decoded HK data.  Each chunk of
+    ``chunk_len`` seconds of an agent/feed is stored in the directory
+    ``<cache_dir>/<agent>/<feed>/<chunk_start>/``, with files
+    ``<field>.times.npy`` and ``<field>.data.npy``.
+    """
+    def __init__(self, cache_dir, chunk_len):
+        self.cache_dir = cache_dir
+        self.chunk_len = chunk_len
+
+    def chunks(self, start, end):
+        """Returns the chunk start times covering [start, end]."""
+        k0 = int(np.floor(start / self.chunk_len))
+        k1 = int(np.floor(end / self.chunk_len))
+        return [k * self.chunk_len for k in range(k0, k1 + 1)]
+
+    def path(self, agent, feed, chunk):
+        return os.path.join(self.cache_dir, agent, feed, '%i' % chunk)
+
+    def read(self, agent, feed, chunk):
+        """Returns the cached {field: (timestamps, data)} for a chunk, or
+        None if it is not cached.  Arrays are memory-mapped."""
+        path = self.path(agent, feed, chunk)
+        if not os.path.isdir(path):
+            return None
+        result = {}
+        for fn in os.listdir(path):
+            if not fn.endswith('.times.npy'):
+                continue
+            field_name = fn[:-len('.times.npy')]
+            key = str(Field(agent, feed, field_name))
+            result[key] = (
+                np.load(os.path.join(path, fn), mmap_mode='r'),
+                np.load(os.path.join(path, field_name + '.data.npy'),
+                        mmap_mode='r'))
+        return result
+
+    def write(self, agent, feed, chunk, data):
+        """Writes {field: (timestamps, data)} for a chunk."""
+        path = self.path(agent, feed, chunk)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = tempfile.mkdtemp(dir=os.path.dirname(path),
+                                    prefix='.tmp%i_' % chunk)
+        for key, (ts, d) in data.items():
+            field_name = Field.from_str(key).field
+            np.save(os.path.join(tmp_path, field_name + '.times.npy'), ts)
+            np.save(os.path.join(tmp_path, field_name + '.data.npy'), d)
+        try:
+            os.rename(tmp_path, path)
+        except OSError:
+            # Someone else got there first.
+            shutil.rmtree(tmp_path, ignore_errors=True)
+
+
 def load_hk(load_spec: Union[LoadSpec, dict], show_pb=False):
     """
     Loads hk data
@@ -401,6 +658,13 @@ def load_hk(load_spec: Union[LoadSpec, dict], show_pb=False):
         Load specification. See docstrings of the LoadSpec class.
     show_pb: bool
         If true, will show a progressbar :)
+
+    Notes
+    ------
+    The data returned are those with start <= t <= end.  If
+    ``load_spec.cfg.cache_dir`` is set, data are read from the cache
+    where possible, and the complete chunks that had to be decoded are
+    added to it.
     """
     if isinstance(load_spec, dict):
         load_spec = LoadSpec(**load_spec)
@@ -408,53 +672,110 @@ def load_hk(load_spec: Union[LoadSpec, dict], show_pb=False):
     hkdb = HkDb(load_spec.cfg)
     agent_set = list(set(f.agent for f in load_spec.fields))
 
+    def wanted(agent, feed):
+        return any(f.matches(Field(agent, feed, '*')) for f in load_spec.fields)
+
+    use_cache = load_spec.cfg.cache_dir is not None and load_spec.use_cache
+    if use_cache:
+        # Cache chunks are decoded in full, so the frames covering
+        # the whole chunks are needed, not just [start, end].
+        cache = _HkCache(load_spec.cfg.cache_dir, load_spec.cfg.cache_chunk_len)
+        chunks = cache.chunks(load_spec.start, load_spec.end)
+        frame_filter = [HkFrame.start_time < chunks[-1] + cache.chunk_len,
+                        HkFrame.end_time >= chunks[0]]
+    else:
+        frame_filter = [HkFrame.start_time <= load_spec.end,
+                        HkFrame.end_time >= load_spec.start]
+
     file_spec = {}  # {path: [offsets]}
+    feed_spec = {}  # {(agent, feed): [(start_time, end_time, path, offset)]}
     with hkdb.Session.begin() as sess:
         query = sess.query(HkFrame).filter(
-            HkFrame.start_time <= load_spec.end,
-            HkFrame.end_time >= load_spec.start,
+            *frame_filter,
             HkFrame.agent.in_(agent_set)
         ).order_by(HkFrame.start_time)
         for frame in query:
-            if frame.file.path not in file_spec:
-                file_spec[frame.file.path] = []
-            file_spec[frame.file.path].append(frame.byte_offset)
-
-    result = {}  # {field: [timestamps, data]}
-    def get_result_field(agent, feed, field_name):
-        f = Field(agent, feed, field_name)
-        key = str(f)
-        if key in result:
-            return result[key]
-        for field in load_spec.fields:
-            if field.matches(f):
-                result[key] = [[], []]
-        return None
-    ds_factor = load_spec.downsample_factor
-
-    nframes = np.sum([len(offsets) for offsets in file_spec.values()])
-    pb = tqdm(total=nframes, disable=(not show_pb))
-    for path, offsets in file_spec.items():
-        reader = so3g.G3IndexedReader(path)
-        for offset in sorted(offsets):
-            reader.Seek(offset)
-            frame = reader.Process(None)[0]
-            addr = frame['address']
-            _, agent, _, feed = addr.split('.')
-            for block in frame['blocks']:
-                ts = np.array(block.times)[::ds_factor] / spt3g_core.G3Units.s
-                for field_name, data in block.items():
-                    field = get_result_field(agent, feed, field_name)
-                    if field is None:
-                        continue
-                    field[0].append(ts)
-                    field[1].append(np.array(data)[::ds_factor])
+            if not wanted(frame.agent, frame.feed):
+                continue
+            file_spec.setdefault(frame.file.path, []).append(frame.byte_offset)
+            feed_spec.setdefault((frame.agent, frame.feed), []).append(
+                (frame.start_time, frame.end_time, frame.file.path,
+                 frame.byte_offset))
+        # Latest indexed data, for each agent/feed, to decide what
+        # cache chunks are complete.
+        index_end = {}
+        if use_cache:
+            query = sess.query(HkFrame.agent, HkFrame.feed,
+                               db.func.max(HkFrame.end_time)).filter(
+                HkFrame.agent.in_(agent_set)
+            ).group_by(HkFrame.agent, HkFrame.feed)
+            index_end = {(a, f): t for a, f, t in query}
+
+    # Plan the decoding jobs: (fields, start, end, file_spec, cache_key).
+    jobs = []
+    pieces = []  # Each a {field: (timestamps, data)}, in time order.
+    if not use_cache:
+        for path, offsets in file_spec.items():
+            jobs.append((load_spec.fields, load_spec.start, None,
+                         [(path, offsets)], None))
+    else:
+        for (agent, feed), frames in feed_spec.items():
+            for chunk in chunks:
+                chunk_end = chunk + cache.chunk_len
+                data = cache.read(agent, feed, chunk)
+                if data is not None:
+                    pieces.append((chunk, data))
+                    continue
+                _file_spec = {}
+                for t0, t1, path, offset in frames:
+                    if t0 < chunk_end and t1 >= chunk:
+                        _file_spec.setdefault(path, []).append(offset)
+                cache_key = None
+                if chunk_end <= index_end.get((agent, feed), -np.inf):
+                    cache_key = (agent, feed, chunk)
+                jobs.append((None if cache_key else load_spec.fields,
+                             chunk, chunk_end, list(_file_spec.items()),
+                             cache_key))
+
+    pb = tqdm(total=len(jobs), disable=(not show_pb))
+    if load_spec.nproc > 1 and len(jobs) > 1:
+        with ProcessPoolExecutor(max_workers=load_spec.nproc) as pool:
+            futures = [pool.submit(_decode_hk_frames, job[3], job[0],
+                                   job[1], job[2]) for job in jobs]
+            results = []
+            for fut in futures:
+                results.append(fut.result())
+                pb.update()
+    else:
+        results = []
+        for job in jobs:
+            results.append(_decode_hk_frames(job[3], job[0], job[1], job[2]))
             pb.update()
     pb.close()
+
+    for job, data in zip(jobs, results):
+        if job[4] is not None:
+            cache.write(*job[4], data)
+        pieces.append((job[1], data))
+    pieces.sort(key=lambda p: p[0])
+
+    result = {}  # {field: [timestamps, data]}
+    for _, data in pieces:
+        for key, (ts, d) in data.items():
+            f = Field.from_str(key)
+            if not any(_f.matches(f) for _f in load_spec.fields):
+                continue
+            s = (ts >= load_spec.start) & (ts <= load_spec.end)
+            result.setdefault(key, [[], []])
+            result[key][0].append(ts[s])
+            result[key][1].append(d[s])
     for k, d in result.items():
         if len(d[0]) == 0:
             result[k] = np.array([])
         else:
-            result[k] = np.array([np.hstack(d[0]), np.hstack(d[1])])
+            ts, data = _downsample(np.hstack(d[0]), np.hstack(d[1]),
+                                   load_spec.downsample_factor,
+                                   load_spec.downsample_mode)
+            result[k] = np.array([ts, data])
 
     return HkResult(result, aliases=load_spec.cfg.aliases)
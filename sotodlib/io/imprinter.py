@@ -171,6 +171,9 @@ class Imprinter:
           librarian_conn: string (optional)
           build_hk: True 
           build_det: True
+          bind_nproc: 1 (optional, processes used to bind smurf streams)
+          bind_max_memory: None (optional, memory budget in bytes for
+            parallel binding)
 
           tel_tubes:
             tel_tube1:
@@ -630,7 +633,8 @@ class Imprinter:
         book, 
         ignore_tags=False,
         ancil_drop_duplicates=False,
-        allow_bad_timing=False
+        allow_bad_timing=False,
+        nproc=1,
     ):
         """get the appropriate bookbinder for the book based on its type"""
         g3tsmurf_cfg = load_configs(self.g3tsmurf_config)
@@ -652,6 +656,8 @@ class Imprinter:
                 ignore_tags=ignore_tags,
                 ancil_drop_duplicates=ancil_drop_duplicates,
                 allow_bad_timing=allow_bad_timing,
+                nproc=nproc,
+                max_memory=self.config.get("bind_max_memory"),
             )
             return bookbinder
 
@@ -752,7 +758,8 @@ class Imprinter:
         ignore_tags=False,
         ancil_drop_duplicates=False,
         allow_bad_timing=False,
-        check_configs={}
+        check_configs={},
+        nproc=None,
     ):
         """Bind book using bookbinder
 
@@ -777,6 +784,10 @@ class Imprinter:
             precision
         check_configs: dict
             additional non-default configurations to send to check book
+        nproc: int
+            number of processes used to bind the smurf streams of obs and
+            oper books. Defaults to ``bind_nproc`` from the imprinter
+            config, or 1.
         """
         if session is None:
             session = self.get_session()
@@ -795,6 +806,8 @@ class Imprinter:
         if (book.status == BOUND) and (not test_mode):
             raise BookBoundError(f"Book {bid} is already bound")
         assert book.type in VALID_OBSTYPES
+        if nproc is None:
+            nproc = self.config.get("bind_nproc", 1)
 
         try:
             # find appropriate binder for the book type
@@ -803,6 +816,7 @@ class Imprinter:
                 ignore_tags=ignore_tags,
                 ancil_drop_duplicates=ancil_drop_duplicates,
                 allow_bad_timing=allow_bad_timing,
+                nproc=nproc,
             )
             binder.bind(pbar=pbar)
 
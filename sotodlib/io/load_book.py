@@ -22,6 +22,7 @@ import so3g
 from spt3g import core as spt3g_core
 import numpy as np
 
+from concurrent.futures import ThreadPoolExecutor
 from glob import glob
 import itertools
 import logging
@@ -46,13 +47,22 @@ DEG = np.pi / 180
 
 
 def load_obs_book(db, obs_id, dets=None, prefix=None, samples=None,
-                  no_signal=None,
+                  no_signal=None, n_threads=None,
                   **kwargs):
     """Obsloader function for SO "Level 3" obs/oper Books.
 
     See API template, `sotodlib.core.context.obsloader_template`, for
     details of all supported arguments.
 
+    In addition to the template arguments, this loader accepts:
+
+    Args:
+      n_threads (int): If greater than 1, the detsets are decoded
+        concurrently on a pool of (at most) this many threads.  Each
+        detset fills its own rows of the shared signal buffer, and
+        the ancillary data are still only decoded once (with the
+        first detset).  None or 1 gives the serial behavior.
+
     """
     if any([v is not None for v in kwargs.values()]):
         raise RuntimeError(
@@ -117,6 +127,10 @@ def load_obs_book(db, obs_id, dets=None, prefix=None, samples=None,
     samples[1] = min(max(samples), sample_range[1])
 
     file_map = db.get_files(obs_id)
+    # Frame indexes, to seek straight to the frames we need.
+    frame_offsets = None
+    if samples[0] > sample_range[0] or samples[1] < sample_range[1]:
+        frame_offsets = db.get_frame_offsets(obs_id)
 
     # Consider pre-allocating the signal buffer.
     signal_buffer = None
@@ -128,15 +142,32 @@ def load_obs_book(db, obs_id, dets=None, prefix=None, samples=None,
     timestamps = None
     results = {}
 
-    for detset in detsets_req:
-        files = file_map[detset]
-        results[detset] = _load_book_detset(
-            files, prefix=prefix, load_ancil=(ancil is None),
-            samples=samples, dets=dets_req, no_signal=no_signal,
-            signal_buffer=signal_buffer)
-        if ancil is None:
-            ancil = results[detset]['ancil']
-            timestamps = results[detset]['timestamps']
+    if n_threads is not None and n_threads > 1 and len(detsets_req) > 1:
+        # Only the first detset decodes the ancil data.  The detsets
+        # write to disjoint rows of signal_buffer, so no locking is
+        # needed.
+        with ThreadPoolExecutor(max_workers=min(n_threads, len(detsets_req))) as pool:
+            futures = [pool.submit(_load_book_detset, file_map[detset],
+                                   prefix=prefix, load_ancil=(i == 0),
+                                   samples=samples, dets=dets_req,
+                                   no_signal=no_signal,
+                                   signal_buffer=signal_buffer,
+                                   frame_offsets=frame_offsets)
+                       for i, detset in enumerate(detsets_req)]
+            for detset, fut in zip(detsets_req, futures):
+                results[detset] = fut.result()
+        ancil = results[detsets_req[0]]['ancil']
+        timestamps = results[detsets_req[0]]['timestamps']
+    else:
+        for detset in detsets_req:
+            files = file_map[detset]
+            results[detset] = _load_book_detset(
+                files, prefix=prefix, load_ancil=(ancil is None),
+                samples=samples, dets=dets_req, no_signal=no_signal,
+                signal_buffer=signal_buffer, frame_offsets=frame_offsets)
+            if ancil is None:
+                ancil = results[detset]['ancil']
+                timestamps = results[detset]['timestamps']
 
     if len(results) == 0:
         # Load the ancil files, to get ancil stuff.
@@ -239,7 +270,7 @@ def load_smurf_npy_data(ctx, obs_id, substr):
 
 def _load_book_detset(files, prefix='', load_ancil=True,
                       dets=None, samples=None, no_signal=False,
-                      signal_buffer=None):
+                      signal_buffer=None, frame_offsets=None):
     """Read data from a single detset.
 
     If a list of dets is specified, it may include dets that aren't
@@ -248,6 +279,9 @@ def _load_book_detset(files, prefix='', load_ancil=True,
     actual detectors found and loaded are returned as 'dets' in the
     output.
 
+    If frame_offsets is passed, it is used to read only the frames
+    in the samples range (see _frames_iterator).
+
     """
     stream_id = None
     ancil_acc = None
@@ -279,7 +313,8 @@ def _load_book_detset(files, prefix='', load_ancil=True,
     smurf_proc = load_smurf.SmurfStatus._get_frame_processor()
 
     for frame, frame_offset in _frames_iterator(files, prefix, samples,
-                                                smurf_proc=smurf_proc):
+                                                smurf_proc=smurf_proc,
+                                                frame_offsets=frame_offsets):
         more_data = True
 
         # Anything in ancil should be identical across
@@ -807,13 +842,20 @@ class Accumulator2d(Accumulator):
         return self.data
 
 
-def _frames_iterator(files, prefix, samples, smurf_proc=None):
+def _frames_iterator(files, prefix, samples, smurf_proc=None,
+                     frame_offsets=None):
     """Iterates over frames in files.  yields only frames that might be of
     interest for timestream unpacking.
 
     Yields each (frame, offset).  The offset is the global offset
     associated with the start of the frame.
 
+    If frame_offsets is passed (a dict mapping filename to frame
+    index, as returned by ObsFileDb.get_frame_offsets), then for each
+    indexed file the reader seeks directly to the first Scan frame
+    overlapping the samples range, and stops after the last one.  Any
+    non-Scan frames before the range are still passed to smurf_proc.
+
     """
     offset = 0
     for f, i0, i1 in files:
@@ -829,6 +871,47 @@ def _frames_iterator(files, prefix, samples, smurf_proc=None):
         filename = os.path.join(prefix, f)
         offset = i0
 
+        index = None
+        if frame_offsets is not None and samples is not None:
+            index = frame_offsets.get(f)
+        if index:
+            # Find the first Scan frame that reaches the samples range.
+            first = None
+            for row in index:
+                if row[2] == 'Scan' and row[4] is not None and row[4] > samples[0]:
+                    first = row
+                    break
+            if first is None:
+                continue
+            reader = so3g.G3IndexedReader(filename)
+            if smurf_proc is not None:
+                # Only decode the status frames we are skipping over.
+                for row in index:
+                    if row[0] >= first[0]:
+                        break
+                    if row[2] == 'Scan':
+                        continue
+                    reader.Seek(row[1])
+                    if smurf_proc.process(reader.Process(None)[0]):
+                        smurf_proc = None
+                        break
+            reader.Seek(first[1])
+            offset = first[3]
+            while True:
+                frames = reader.Process(None)
+                if not frames:
+                    break
+                frame = frames[0]
+                if smurf_proc is not None and smurf_proc.process(frame):
+                    smurf_proc = None
+                if frame.type is not spt3g_core.G3FrameType.Scan:
+                    continue
+                if samples[1] is not None and offset >= samples[1]:
+                    break
+                yield frame, offset
+                offset += len(frame['ancil'].times)
+            continue
+
         for frame in spt3g_core.G3File(filename):
             if smurf_proc is not None and smurf_proc.process(frame):
                 # We found a dump frame, so stop looking.
@@ -23,6 +23,7 @@ from . import load as io_load
 from .datapkg_utils import load_configs
 from .g3thk_db import G3tHk, HKFiles, HKAgents, HKFields
 from .g3thk_utils import pysmurf_monitor_control_list
+from .frame_times import FrameTimesCollector, frame_times_path
 
 from sotodlib.io.g3tsmurf_db import (
     Base,
@@ -162,6 +163,7 @@ class G3tSmurf:
         finalize={},
         hk_db_path=None,
         make_db=False,
+        write_frame_times=False,
     ):
         """
         Class to manage a smurf data archive.
@@ -187,6 +189,10 @@ class G3tSmurf:
             make_db: bool
                 if True and db_path does not exist it will make a new database.
                 otherwise will throw and error if database path does not exist
+            write_frame_times: bool
+                if True, write a frame-times sidecar next to each file as it
+                is indexed (see frame_times.FrameTimesCollector), so the
+                bookbinder does not need to read the files twice.
         """
         if db_path is None:
             db_path = os.path.join(archive_path, "frames.db")
@@ -195,6 +201,7 @@ class G3tSmurf:
         self.db_path = db_path
         self.hk_db_path = hk_db_path
         self.finalize = finalize
+        self.write_frame_times = write_frame_times
 
         if os.path.exists(self.db_path):
             new_db = False
@@ -261,6 +268,7 @@ class G3tSmurf:
             data_prefix : "/path/to/daq-node/"
             g3tsmurf_db: "/path/to/g3tsmurf.db"
             g3thk_db: "/path/to/g3hk.db"
+            write_frame_times: False  # optional, see __init__
 
 
             finalization:
@@ -290,6 +298,7 @@ class G3tSmurf:
             db_args=configs.get("db_args", {}),
             finalize=configs.get("finalization", {}),
             hk_db_path=configs.get("g3thk_db"),
+            write_frame_times=configs.get("write_frame_times", False),
             **kwargs
         )
 
@@ -394,6 +403,7 @@ class G3tSmurf:
         file_start, file_stop = None, None
         frame_idx = -1
         timing = None
+        frame_times = FrameTimesCollector() if self.write_frame_times else None
 
         while True:
             try:
@@ -453,7 +463,10 @@ class G3tSmurf:
                     fo = frame.get('primary', None)
                     if fo is None:
                         timing = False # no good timing without primary
+                        frame_times = None
                     else:
+                        if frame_times is not None:
+                            frame_times.add_frame(frame)
                         key_map = {k: i for i, k in enumerate(fo.names)}
                         counters = np.all(
                             np.diff( fo.data[ key_map['Counter0']] ) != 0 
@@ -492,6 +505,12 @@ class G3tSmurf:
         db_file.timing = timing
         session.commit()
 
+        if frame_times is not None and len(frame_times.times) > 0:
+            try:
+                frame_times.write(path)
+            except OSError as e:
+                logger.warning(f"Failed to write frame times for {path}: {e}")
+
         if len(status.tags) > 0:
             if status.tags[0] == "obs" or status.tags[0] == "oper":
                 ## this is where I tell it to make an observation
@@ -619,6 +638,8 @@ class G3tSmurf:
 
             if not dry_run:
                 os.remove(db_file.name)
+                if os.path.exists(frame_times_path(db_file.name)):
+                    os.remove(frame_times_path(db_file.name))
 
                 ## clean up directory if it is empty
                 base, _ = os.path.split(db_file.name)
@@ -1975,7 +1996,7 @@ def make_DetDb_single_obs(obsfiledb, obs_id):
         len(ch_list),
         dtype=[
             ("idx", int),
-            ("rchannel", np.unicode_, 30),
+            ("rchannel", np.str_, 30),
             ("band", int),
             ("channel", int),
             ("freqs", float),
@@ -2701,7 +2722,7 @@ def get_channel_info(
         len(ch_list),
         dtype=[
             ("idx", int),
-            ("rchannel", np.unicode_, 30),
+            ("rchannel", np.str_, 30),
             ("band", int),
             ("channel", int),
             ("freqs", float),
@@ -2775,7 +2796,7 @@ def _get_sample_info(filenames):
             if sostream_version >= 2:
                 samps += len(data.times)
             else:
-                samps += len(data)
+                samps += data.n_samples
         out.append({"filename": file, "sample_range": (start, start + samps)})
         start += samps
     return out
@@ -2842,6 +2863,93 @@ def _get_timestamps(streams, load_type=None, linearize_timestamps=True):
     logger.error("Timing System could not be determined")
 
 
+def _extract_signal(data, dest, channels, start, stop, cal):
+    """Decode samples [start, stop) of the SMuRF data object ``data`` into
+    ``dest``, which has one row per entry of ``channels``, applying
+    the calibration factor ``cal``.
+
+    """
+    if isinstance(data, io_load.G3SuperTimestream):
+        # As in load_book.Accumulator2d: calibrate before
+        # decompression, then decode straight into the destination.
+        data.calibrate(np.full(len(data.names), cal))
+        keys, src_idx, dest_idx = core.util.get_coindices(
+            list(data.names), list(channels))
+        if len(keys) != len(channels):
+            missing = set(channels) - set(keys)
+            raise KeyError(f"Channels not found in frame: {sorted(missing)}")
+        if hasattr(data, "extract"):
+            data.extract(dest, dest_idx, src_idx, start, stop)
+        else:
+            dest[dest_idx] = data.data[src_idx, start:stop]
+        return
+    for i, ch in enumerate(channels):
+        dest[i] = np.asarray(data[ch])[start:stop]
+    dest *= cal
+
+
+def _unpack_frames_into(filename, field_request, streams, samples, signal,
+                        channels, cal):
+    """Like io_load.unpack_frames, but with the detector data decoded
+    straight into the preallocated array ``signal``.
+
+    Arguments:
+      filename (str): Full path to the file to load.
+      field_request (FieldGroup): Instructions for what other fields
+        to load.
+      streams: Structure to which to append the streams from this
+        file (or None).
+      samples (int, int): Start and end of sample range to unpack
+        *from this file*.
+      signal (array): Destination for the data, with shape
+        (len(channels), samples[1] - samples[0]).
+      channels (list of str): readout channel names of the rows of
+        ``signal``.
+      cal (float): Calibration factor applied to the data.
+
+    Returns:
+      streams (structure containing lists of numpy arrays).
+
+    """
+    if streams is None:
+        streams = field_request.empty()
+    offset, to_read = samples[0], samples[1] - samples[0]
+    dest_offset = 0
+
+    reader = so3g.G3IndexedReader(filename)
+    while to_read > 0:
+        frames = reader.Process(None)
+        if len(frames) == 0:
+            break
+        frame = frames[0]
+        if frame.type != spt3g_core.G3FrameType.Scan:
+            continue
+        data = frame["data"]
+        if isinstance(data, io_load.G3SuperTimestream):
+            n = len(data.times)
+        else:
+            n = data.n_samples
+        if offset < n:
+            stop = min(n, offset + to_read)
+            _extract_signal(
+                data,
+                signal[:, dest_offset:dest_offset + stop - offset],
+                channels,
+                offset,
+                stop,
+                cal,
+            )
+            dest_offset += stop - offset
+        _consumed = io_load.unpack_frame_object(
+            frame, field_request, streams, offset=offset, max_count=to_read)
+        offset -= _consumed
+        if offset < 0:
+            to_read += offset
+            offset = 0
+
+    return streams
+
+
 def load_file(
     filename,
     channels=None,
@@ -2966,9 +3074,20 @@ def load_file(
     # flist will take the form [(file, sample_start, sample_stop)...] and will be
     # passed to io_load.unpack_frames
     flist = []
+    # Number of samples to load from each file, if known up front.
+    counts = None
     if samples is None:
         sample_start, sample_stop = 0, None
         flist = [(f, 0, None) for f in filenames]
+        if archive is not None or obsfiledb is not None:
+            X = [archive if archive is not None else obsfiledb][0]
+            outs = [X.lookup_file(file, fail_ok=True) for file in filenames]
+            # Files indexed but not yet built into an observation have
+            # no sample range; those are loaded without preallocation.
+            if not any(out is None or None in out["sample_range"]
+                       for out in outs):
+                counts = [out["sample_range"][1] - out["sample_range"][0]
+                          for out in outs]
     else:
         sample_start, sample_stop = samples
 
@@ -2978,6 +3097,7 @@ def load_file(
             X = [archive if archive is not None else obsfiledb][0]
             outs = [X.lookup_file(file) for file in filenames]
         stop = sample_stop
+        counts = []
         for filename, out in zip(filenames, outs):
             file_start, file_stop = out["sample_range"]
             if file_stop <= sample_start:
@@ -2989,38 +3109,81 @@ def load_file(
 
             start = max(0, sample_start - file_start)
             flist.append((filename, start, stop))
-
-    if no_signal:
-        subreq = [io_load.FieldGroup("data", [], timestamp_field="time")]
-    else:
-        subreq = [
-            io_load.FieldGroup(
-                "data",
-                ch_info.rchannel,
-                timestamp_field="time",
-                refs_ok=is_many_channels,
-            )
-        ]
-    if load_primary:
-        subreq.extend(
-            [io_load.FieldGroup("primary", [io_load.Field("*", wildcard=True)])]
-        )
-    if load_biases:
-        subreq.extend(
-            [
-                io_load.FieldGroup("tes_biases", [io_load.Field("*", wildcard=True)]),
+            counts.append(min(file_stop - file_start,
+                              file_stop - file_start if stop is None else stop)
+                          - start)
+
+    # Conversion from DAC counts to squid phase
+    rad_per_count = np.pi / 2**15
+
+    # If the sample counts are known, the signal is extracted straight
+    # into its final (calibrated) array instead of being accumulated
+    # per channel.
+    signal = None
+    if not no_signal and counts is not None:
+        signal = np.zeros((len(ch_info.rchannel), sum(counts)), "float32")
+
+    def _make_request(extract_signal):
+        if no_signal or extract_signal:
+            subreq = [io_load.FieldGroup("data", [], timestamp_field="time")]
+        else:
+            subreq = [
+                io_load.FieldGroup(
+                    "data",
+                    ch_info.rchannel,
+                    timestamp_field="time",
+                    refs_ok=is_many_channels,
+                )
             ]
-        )
+        if load_primary:
+            subreq.extend(
+                [io_load.FieldGroup("primary", [io_load.Field("*", wildcard=True)])]
+            )
+        if load_biases:
+            subreq.extend(
+                [
+                    io_load.FieldGroup("tes_biases", [io_load.Field("*", wildcard=True)]),
+                ]
+            )
+        return io_load.FieldGroup("root", subreq)
 
-    request = io_load.FieldGroup("root", subreq)
     streams = None
     try:
-        for filename, start, stop in tqdm(
-            flist, total=len(flist), disable=(not show_pb)
-        ):
-            streams = io_load.unpack_frames(
-                filename, request, streams=streams, samples=(start, stop)
-            )
+        if signal is not None:
+            request = _make_request(True)
+            dest_start = 0
+            for i, (filename, start, stop) in tqdm(
+                enumerate(flist), total=len(flist), disable=(not show_pb)
+            ):
+                streams = _unpack_frames_into(
+                    filename,
+                    request,
+                    streams,
+                    (start, start + counts[i]),
+                    signal[:, dest_start:dest_start + counts[i]],
+                    ch_info.rchannel,
+                    rad_per_count,
+                )
+                count = sum(map(len, streams["time"]))
+                if count != dest_start + counts[i]:
+                    # Don't leave a gap in signal; load the usual way.
+                    logger.warning(
+                        f"Loaded {count - dest_start} samples from {filename} "
+                        f"but the sample ranges predicted {counts[i]}; "
+                        "reloading without preallocation."
+                    )
+                    signal, streams = None, None
+                    break
+                dest_start = count
+
+        if signal is None:
+            request = _make_request(False)
+            for filename, start, stop in tqdm(
+                flist, total=len(flist), disable=(not show_pb)
+            ):
+                streams = io_load.unpack_frames(
+                    filename, request, streams=streams, samples=(start, stop)
+                )
     except KeyError:
         logger.error(
             "Frames do not contain expected fields. Did Channel Mask change during the file?"
@@ -3058,7 +3221,9 @@ def load_file(
         iir_params.wrap("fscale", 1 / status.flux_ramp_rate_hz)
         aman.wrap("iir_params", iir_params)
 
-    if not no_signal:
+    if signal is not None:
+        aman.wrap("signal", signal, [(0, det_axis), (1, "samps")])
+    elif not no_signal:
         aman.wrap(
             "signal",
             np.zeros((aman[det_axis].count, aman["samps"].count), "float32"),
@@ -3068,9 +3233,6 @@ def load_file(
             io_load.hstack_into(
                 aman.signal[idx], streams["data"][ch_info.rchannel[idx]]
             )
-
-        # Conversion from DAC counts to squid phase
-        rad_per_count = np.pi / 2**15
         aman.signal *= rad_per_count
 
     temp = core.AxisManager(aman.samps.copy())
@@ -175,49 +175,42 @@ class ResultSetHdfLoader(LoaderInterface):
         requests are made for data from a single file.
 
         """
-        # Gather all relevant HDF5 files.
+        # Group the requests by file and dataset, so each file is
+        # opened once and each dataset is read and decoded once.
         file_map = {}
         for idx, load_par in enumerate(load_params):
-            fn = load_par['filename']
-            if fn not in file_map:
-                file_map[fn] = []
-            file_map[fn].append(idx)
-        # Open each one and pull out the result.
+            datasets = file_map.setdefault(load_par['filename'], {})
+            datasets.setdefault(load_par['dataset'], []).append(idx)
+        # Open each one and pull out the results.
         results = [None] * len(load_params)
-        for filename, indices in file_map.items():
+        for filename, datasets in file_map.items():
             with h5py.File(filename, mode='r') as fin:
-                # Don't reread dataset unless it changes.
-                last_dataset = None
-                for idx in indices:
-                    dataset = load_params[idx]['dataset']
-                    if dataset is not last_dataset:
-                        data = fin[dataset][()]
-                        data = self._prefilter_data(data)
-                        last_dataset = dataset
-
-                    # Dereference the extrinsic axis request.  Every
-                    # extrinsic axis key in the dataset must have a
-                    # value specified in load_params.
-                    ex_keys = []
-                    mask = np.ones(len(data), bool)
-                    for k in data.dtype.names:
-                        if k.startswith('obs:'):
-                            ex_keys.append(k)
+                for dataset, indices in datasets.items():
+                    data = fin[dataset][()]
+                    data = self._prefilter_data(data)
+                    # Every extrinsic axis key in the dataset must
+                    # have a value specified in load_params.
+                    ex_keys = [k for k in data.dtype.names
+                               if k.startswith('obs:')]
+                    keys_out = [k for k in data.dtype.names
+                                if k not in ex_keys]
+                    for idx in indices:
+                        # Dereference the extrinsic axis request.
+                        mask = np.ones(len(data), bool)
+                        for k in ex_keys:
                             mask *= (data[k] == load_params[idx][k])
 
-                    # Has user made an intrinsic request as well?
-                    for k in data.dtype.names:
-                        if k.startswith('dets:') and k in load_params[idx]:
-                            mask *= (data[k] == load_params[idx][k])
+                        # Has user made an intrinsic request as well?
+                        for k in data.dtype.names:
+                            if k.startswith('dets:') and k in load_params[idx]:
+                                mask *= (data[k] == load_params[idx][k])
 
-                    # TODO: handle non-concordant extrinsic /
-                    # intrinsic requests.
+                        # TODO: handle non-concordant extrinsic /
+                        # intrinsic requests.
 
-                    # Output.
-                    keys_out = [k for k in data.dtype.names
-                                if k not in ex_keys]
-                    results[idx] = self._populate(data, keys=keys_out,
-                                                  row_order=mask.nonzero()[0])
+                        # Output.
+                        results[idx] = self._populate(data, keys=keys_out,
+                                                      row_order=mask.nonzero()[0])
         return results
 
 
@@ -1,4 +1,8 @@
 import numpy as np
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import time
 from pixell import enmap, utils, tilemap, bunch
 
 from .. import coords
@@ -6,7 +10,8 @@ from .utilities import *
 from .pointing_matrix import *
 
 class MLMapmaker:
-    def __init__(self, signals=[], noise_model=None, dtype=np.float32, verbose=False):
+    def __init__(self, signals=[], noise_model=None, dtype=np.float32, verbose=False,
+            nthread=1):
         """Initialize a Maximum Likelihood Mapmaker.
         Arguments:
         * signals: List of Signal-objects representing the models that will be solved
@@ -16,7 +21,12 @@ class MLMapmaker:
         * noise_model: A noise model constructor which will be used to initialize the
           noise model for each observation. Can be overriden in add_obs.
         * dtype: The data type to use for the time-ordered data. Only tested with float32
-        * verbose: Whether to print progress messages. Not implemented"""
+        * verbose: Whether to print progress messages. If True, A prints a per-stage
+          timing breakdown each call.
+        * nthread: The number of observations to process concurrently in A. Each thread
+          accumulates into its own copy of the work maps, which are summed at the end, so
+          memory use grows with nthread. The projection routines are OpenMP-parallel
+          internally, so OMP_NUM_THREADS should usually be reduced correspondingly."""
         if noise_model is None:
             noise_model = NmatUncorr()
         self.signals      = signals
@@ -26,6 +36,10 @@ class MLMapmaker:
         self.data         = []
         self.dof          = MultiZipper()
         self.ready        = False
+        self.x            = None
+        self.nthread      = nthread
+        self.times        = bunch.Bunch()
+        self._buffers     = []
 
     def add_obs(self, id, obs, deslope=True, noise_model=None, signal_estimate=None):
         # Prepare our tod
@@ -73,39 +87,83 @@ class MLMapmaker:
         self.ready = True
 
     def A(self, x):
+        """Apply the system matrix P'N"P to the flat degrees of freedom x.
+        Observations are processed by self.nthread threads, each with its own
+        scratch tod buffer and output work maps. The time spent in each stage
+        is stored in self.times. For forward, apply and backward this is
+        summed over threads."""
         # unzip goes from flat array of all the degrees of freedom to individual maps, cuts etc.
         # to_work makes a scratch copy and does any redistribution needed
-        #t0 = time()
-        #t1 = time()
+        t0 = time()
         iwork = [signal.to_work(m) for signal,m in zip(self.signals,self.dof.unzip(x))]
-        #t2 = time(); print(f" A    iwork : {t2-t1:8.3f}s", flush=True)
-        owork = [w*0 for w in iwork]
-        #t1 = time(); print(f" A    owork : {t1-t2:8.3f}s", flush=True)
-        #t_forward = 0
-        #t_apply = 0
-        #t_backward = 0
-        for di, data in enumerate(self.data):
-            tod = np.zeros([data.ndet, data.nsamp], self.dtype)
-            #t1 = time()
+        t1 = time()
+        nthread = max(1, min(self.nthread, len(self.data)))
+        owork = [[w*0 for w in iwork] for ithread in range(nthread)]
+        while len(self._buffers) < nthread:
+            self._buffers.append(np.zeros(0, self.dtype))
+        t2 = time()
+        # Observations are handed out one at a time, to balance uneven obs lengths
+        queue = iter(range(len(self.data)))
+        lock  = threading.Lock()
+        if nthread == 1:
+            stimes = [self._A_worker(0, queue, lock, iwork, owork[0])]
+        else:
+            with ThreadPoolExecutor(nthread) as executor:
+                futures = [executor.submit(self._A_worker, ithread, queue, lock, iwork, owork[ithread])
+                        for ithread in range(nthread)]
+                stimes  = [future.result() for future in futures]
+        t3 = time()
+        for tw in owork[1:]:
+            for si, w in enumerate(tw):
+                owork[0][si] += w
+        t4 = time()
+        result = self.dof.zip(*[signal.from_work(w) for signal,w in zip(self.signals,owork[0])])
+        t5 = time()
+        self.times = bunch.Bunch(iwork=t1-t0, owork=t2-t1, obs=t3-t2,
+            forward =sum([st[0] for st in stimes]),
+            apply   =sum([st[1] for st in stimes]),
+            backward=sum([st[2] for st in stimes]),
+            reduce=t4-t3, zip=t5-t4, total=t5-t0)
+        if self.verbose:
+            for key, val in self.times.items():
+                print(f" A {key:>8s} : {val:8.3f}s", flush=True)
+        return result
+
+    def _A_worker(self, ithread, queue, lock, iwork, owork):
+        """Process observations from queue until it is exhausted, accumulating
+        into owork. Returns the time spent in forward, nmat.apply and backward."""
+        t_forward = t_apply = t_backward = 0
+        while True:
+            with lock:
+                di = next(queue, None)
+            if di is None: break
+            data = self.data[di]
+            tod  = self._get_buffer(ithread, data.ndet, data.nsamp)
+            t1 = time()
             for si, signal in reversed(list(enumerate(self.signals))):
                 signal.forward(data.id, tod, iwork[si])
-            #t2 = time()
-            #t_forward += t2 - t1
+            t2 = time()
             data.nmat.apply(tod)
-            #t1 = time()
-            #t_apply += t1 - t2
+            t3 = time()
             for si, signal in enumerate(self.signals):
                 signal.backward(data.id, tod, owork[si])
-            #t2 = time()
-            #t_backward += t2 - t1
-        #print(f" A  forward : {t_forward:8.3f}s", flush=True)
-        #print(f" A    apply : {t_apply:8.3f}s", flush=True)
-        #print(f" A backward : {t_backward:8.3f}s", flush=True)
-        #t1 = time()
-        result = self.dof.zip(*[signal.from_work(w) for signal,w in zip(self.signals,owork)])
-        #t2 = time(); print(f" A      zip : {t2-t1:8.3f}s", flush=True)
-        #print(f" A    TOTAL : {t2-t0:8.3f}s", flush=True)
-        return result
+            t4 = time()
+            t_forward  += t2-t1
+            t_apply    += t3-t2
+            t_backward += t4-t3
+        return t_forward, t_apply, t_backward
+
+    def _get_buffer(self, ithread, ndet, nsamp):
+        """Return a zeroed [ndet,nsamp] tod backed by the scratch buffer of the given
+        thread. The buffers are sized for the largest observation, so they are only
+        allocated once."""
+        buf = self._buffers[ithread]
+        if buf.size < ndet*nsamp:
+            buf = np.empty(max([d.ndet*d.nsamp for d in self.data]+[ndet*nsamp]), self.dtype)
+            self._buffers[ithread] = buf
+        tod = buf[:ndet*nsamp].reshape(ndet, nsamp)
+        tod[:] = 0
+        return tod
 
     def M(self, x):
         #t1 = time()
@@ -115,14 +173,51 @@ class MLMapmaker:
         #t1 = time(); print(f" M      zip : {t1-t2:8.3f}s", flush=True)
         return result
 
-    def solve(self, maxiter=500, maxerr=1e-6, x0=None):
+    def solve(self, maxiter=500, maxerr=1e-6, x0=None, checkpoint=None, checkpoint_interval=10):
+        """Solve the mapmaking equation with preconditioned conjugate gradients,
+        yielding a bunch with the step number i, the error err and the unzipped
+        solution x after each step.
+
+        If checkpoint is given, it is the path to an hdf file where the CG state
+        (x, r, p, the step number and error) is saved every checkpoint_interval steps.
+        If that file already exists when solve is called, the state is restored from
+        it instead of starting over, and x0 is ignored. The mapmaker must have been
+        built from the same observations (and, with MPI, the same distribution of
+        them over tasks), so each task needs its own checkpoint file.
+
+        The latest unzipped solution is also kept in self.x, so it is available
+        even if no step is taken (e.g. when resuming from a checkpoint that has
+        already reached maxiter)."""
         self.prepare()
         rhs    = self.dof.zip(*[signal.rhs for signal in self.signals])
+        if checkpoint is not None and os.path.isfile(checkpoint): x0 = None
         if x0 is not None: x0 = self.dof.zip(*x0)
         solver = utils.CG(self.A, rhs, M=self.M, dot=self.dof.dot, x0=x0)
+        if checkpoint is not None and os.path.isfile(checkpoint):
+            self.read_checkpoint(solver, checkpoint)
+        self.x = self.dof.unzip(solver.x)
         while solver.i < maxiter and solver.err > maxerr:
             solver.step()
-            yield bunch.Bunch(i=solver.i, err=solver.err, x=self.dof.unzip(solver.x))
+            if checkpoint is not None and solver.i % checkpoint_interval == 0:
+                self.write_checkpoint(solver, checkpoint)
+            self.x = self.dof.unzip(solver.x)
+            yield bunch.Bunch(i=solver.i, err=solver.err, x=self.x)
+
+    def write_checkpoint(self, solver, fname):
+        """Save the state of the CG solver to fname. The file is written
+        under a temporary name first, so an interrupted write never
+        replaces a good checkpoint."""
+        tmpname = fname + ".tmp"
+        solver.save(tmpname)
+        os.replace(tmpname, fname)
+
+    def read_checkpoint(self, solver, fname):
+        """Restore the state of the CG solver from fname, as written by
+        write_checkpoint."""
+        solver.load(fname)
+        if solver.x.size != self.dof.ndof:
+            raise ValueError("Checkpoint %s has %d degrees of freedom, but the mapmaker has %d" % (
+                fname, solver.x.size, self.dof.ndof))
 
     def translate(self, other, x):
         """Translate degrees of freedom x from some other mapamaker to the current one.
@@ -176,11 +271,14 @@ class SignalMap(Signal):
     """Signal describing a non-distributed sky map."""
     def __init__(self, shape, wcs, comm, comps="TQU", name="sky", ofmt="{name}", output=True,
             ext="fits", dtype=np.float32, sys=None, recenter=None, tile_shape=(500,500), tiled=False,
-            interpol=None):
+            interpol=None, precompute=False):
         """Signal describing a sky map in the coordinate system given by "sys", which defaults
         to equatorial coordinates. If tiled==True, then this will be a distributed map with
         the given tile_shape, otherwise it will be a plain enmap. interpol controls the
-        pointing matrix interpolation mode. See so3g's Projectionist docstring for details."""
+        pointing matrix interpolation mode. See so3g's Projectionist docstring for details.
+        If precompute is True, each observation's pointing matrix caches its pixel indices
+        and spin factors instead of recomputing them every CG iteration. This trades memory
+        for speed; see coords.pmat.P and coords.pmat.PRECOMP_BUDGET."""
         Signal.__init__(self, name, ofmt, output, ext)
         self.comm  = comm
         self.comps = comps
@@ -189,6 +287,7 @@ class SignalMap(Signal):
         self.dtype = dtype
         self.tiled = tiled
         self.interpol = interpol
+        self.precompute = precompute
         self.data  = {}
         ncomp      = len(comps)
         shape      = tuple(shape[-2:])
@@ -219,7 +318,7 @@ class SignalMap(Signal):
             else: rot = None
             pmap = coords.pmat.P.for_tod(obs, comps=self.comps, geom=self.rhs.geometry,
                 rot=rot, threads="domdir", weather=unarr(obs.weather), site=unarr(obs.site),
-                interpol=self.interpol)
+                interpol=self.interpol, precompute=self.precompute)
         # Build the RHS for this observation
         pcut.clear(Nd)
         obs_rhs = pmap.zeros()
@@ -360,7 +360,9 @@ class Noise(_Preprocess):
 
     If ``fit: True`` this operation will run
     :func:`sotodlib.tod_ops.fft_ops.fit_noise_model`, else it will run
-    :func:`sotodlib.tod_ops.fft_ops.calc_wn`.
+    :func:`sotodlib.tod_ops.fft_ops.calc_wn`.  When fitting, passing
+    ``method: "batched"`` in the calc block fits all detectors at
+    once, which is much faster for large detector counts.
 
     """
     name = "noise"
@@ -0,0 +1,160 @@
+# Copyright (c) 2025 Simons Observatory.
+# Full license can be found in the top level "LICENSE" file.
+"""Time ObsFileDb, ObsDb and ManifestDb lookups on synthetic databases.
+
+The databases are written to disk with and without their indexes, and
+the usual per-observation lookups are timed on read-only connections
+and on in-memory copies.  Run with, e.g.::
+
+  python -m sotodlib.scripts.bench_metadata_db --n-obs 100000
+
+"""
+
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+
+import numpy as np
+
+from ..core import metadata
+from ..core.metadata import obsfiledb, obsdb
+
+
+def build_dbs(n_obs, n_detsets, n_dets):
+    """Return (ObsFileDb, ObsDb, ManifestDb), in memory."""
+    obs_ids = ['obs_%08i' % i for i in range(n_obs)]
+    detsets = ['ws%i' % i for i in range(n_detsets)]
+
+    fdb = metadata.ObsFileDb()
+    for detset in detsets:
+        fdb.add_detset(detset, ['%s_%04i' % (detset, i) for i in range(n_dets)],
+                       commit=False)
+    for obs_id in obs_ids:
+        for detset in detsets:
+            fdb.add_obsfile(f'{obs_id}/{detset}_000.g3', obs_id, detset,
+                            0, 1000, commit=False)
+    fdb.conn.commit()
+
+    odb = metadata.ObsDb()
+    for i, obs_id in enumerate(obs_ids):
+        odb.update_obs(obs_id, {'timestamp': 1.7e9 + 600 * i},
+                       tags=['tag%i' % (i % 10)], commit=False)
+    odb.conn.commit()
+
+    scheme = metadata.ManifestScheme() \
+                     .add_exact_match('obs:obs_id') \
+                     .add_exact_match('dets:detset') \
+                     .add_data_field('dataset')
+    mdb = metadata.ManifestDb(scheme=scheme)
+    for i, obs_id in enumerate(obs_ids):
+        for detset in detsets:
+            mdb.add_entry({'obs:obs_id': obs_id, 'dets:detset': detset,
+                           'dataset': f'{obs_id}_{detset}'},
+                          filename='cal_%03i.h5' % (i // 1000), commit=False)
+    mdb.conn.commit()
+    return fdb, odb, mdb
+
+
+def drop_indexes(conn, names):
+    for name in names:
+        conn.execute(f'drop index if exists `{name}`')
+    conn.commit()
+
+
+def time_lookups(fdb, odb, mdb, obs_ids, detsets):
+    """Return dict of mean time per lookup, in seconds."""
+    results = {}
+    tests = [
+        ('obsfiledb.get_detsets', lambda o: fdb.get_detsets(o)),
+        ('obsfiledb.get_files', lambda o: fdb.get_files(o)),
+        ('obsfiledb.get_det_table', lambda o: fdb.get_det_table(o)),
+        ('obsdb.get', lambda o: odb.get(o)),
+        ('obsdb.query(tag)', None),
+        ('manifestdb.match', lambda o: mdb.match(
+            {'obs:obs_id': o, 'dets:detset': detsets[0]})),
+        ('manifestdb.inspect(obs_id)', lambda o: mdb.inspect(
+            {'obs:obs_id': o})),
+    ]
+    for label, func in tests:
+        t0 = time.time()
+        if func is None:
+            odb.query(tags=['tag3'])
+            n = 1
+        else:
+            for obs_id in obs_ids:
+                func(obs_id)
+            n = len(obs_ids)
+        results[label] = (time.time() - t0) / n
+    return results
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--n-obs', type=int, default=100000,
+                        help="Number of observations.")
+    parser.add_argument('--n-detsets', type=int, default=2,
+                        help="Number of detsets per observation.")
+    parser.add_argument('--n-dets', type=int, default=100,
+                        help="Number of detectors per detset.")
+    parser.add_argument('--n-lookups', type=int, default=500,
+                        help="Number of (random) observations to look up.")
+    parser.add_argument('--output-dir', help=
+                        "Directory for the database files (default: a "
+                        "temporary directory).")
+    args = parser.parse_args(args)
+
+    print(f'Building databases for {args.n_obs} observations ...')
+    t0 = time.time()
+    dbs = build_dbs(args.n_obs, args.n_detsets, args.n_dets)
+    print(f'  ... {time.time() - t0:.1f} s')
+    detsets = ['ws%i' % i for i in range(args.n_detsets)]
+    index_names = [list(obsfiledb.INDEX_DEFS), list(obsdb.INDEX_DEFS),
+                   list(dbs[2].scheme._get_index_defs())]
+
+    rng = np.random.default_rng(0)
+    obs_ids = ['obs_%08i' % i for i in
+               rng.integers(args.n_obs, size=args.n_lookups)]
+
+    with tempfile.TemporaryDirectory(dir=args.output_dir) as tempdir:
+        files = {}
+        for indexed in [False, True]:
+            for name, db, names in zip(['obsfiledb', 'obsdb', 'manifestdb'],
+                                       dbs, index_names):
+                filename = os.path.join(
+                    tempdir, f'{name}_{"indexed" if indexed else "plain"}.sqlite')
+                db.to_file(filename)
+                if not indexed:
+                    conn = sqlite3.connect(filename)
+                    drop_indexes(conn, names)
+                    conn.execute('vacuum')
+                    conn.close()
+                files[name, indexed] = filename
+
+        modes = [
+            ('no indexes, on disk', False, False),
+            ('indexed, on disk', True, False),
+            ('indexed, in memory', True, True),
+        ]
+        all_results = []
+        for label, indexed, in_memory in modes:
+            fdb = metadata.ObsFileDb.from_file(
+                files['obsfiledb', indexed], force_new_db=in_memory)
+            odb = metadata.ObsDb.from_file(
+                files['obsdb', indexed], force_new_db=in_memory)
+            mdb = metadata.ManifestDb.readonly(
+                files['manifestdb', indexed], in_memory=in_memory)
+            all_results.append(time_lookups(fdb, odb, mdb, obs_ids, detsets))
+
+    print()
+    keys = list(all_results[0].keys())
+    width = max(len(k) for k in keys)
+    print(' ' * width + ''.join([f'  {label:>20}' for label, _, _ in modes]))
+    for k in keys:
+        print(f'{k:{width}}' + ''.join(
+            [f'  {r[k] * 1e3:>17.3f} ms' for r in all_results]))
+
+
+if __name__ == '__main__':
+    main()
@@ -45,6 +45,9 @@ enabled:
     tolerate_missing_ancil_timestamps: True
     tolerate_timestamps_value_discrepancy: False
 
+    # Scan the ancil files and each stream_id in parallel.
+    nproc: 4
+
     # Tolerate arbitrary extra files, except explicitly named ones
     tolerate_stray_files: True
     banned_files: ['frame_splits.txt']
@@ -148,6 +151,8 @@ def main(book_dir, config=None, add=None, overwrite=None):
             db.add_detset(name, dets)
     for row in file_rows:
         db.add_obsfile(**row)
+    for filename, rows in bs.prep_frame_offsets(config.get('root_path', '/')).items():
+        db.add_frame_offsets(filename, rows)
 
 
 if __name__ == '__main__':
@@ -1,10 +1,10 @@
 from argparse import ArgumentParser
 import numpy as np, sys, time, warnings, os, so3g
-from sotodlib.core import Context, AxisManager, IndexAxis, FlagManager
+from sotodlib.core import Context, MetaCache, AxisManager, IndexAxis, FlagManager
 from sotodlib import mapmaking
 from sotodlib.io import metadata   # PerDetectorHdf5 work-around
 from sotodlib import tod_ops
-from sotodlib.site_pipeline import util
+from sotodlib.site_pipeline import util, scheduling
 from pixell import enmap, utils, fft, bunch, wcsutils, mpi
 import yaml
 
@@ -30,6 +30,10 @@ defaults = {"query": "1",
             "maxiter": 500,
             "tiled": 1,
             "wafer": None,
+            "nthread": 1,
+            "checkpoint": None,
+            "checkpoint_interval": 10,
+            "meta_cache": None,
            }
 
 def get_parser(parser=None):
@@ -63,6 +67,10 @@ def get_parser(parser=None):
     parser.add_argument(      "--maxiter",    type=int, help="Maximum number of iterative steps")
     parser.add_argument("-T", "--tiled"  ,    type=int)
     parser.add_argument("-W", "--wafer"  ,   type=str, nargs='+', help="Detector wafer subset to map with")
+    parser.add_argument(      "--nthread",    type=int, help="Number of observations to process concurrently in each CG step")
+    parser.add_argument(      "--checkpoint", type=str, help="Directory for CG checkpoints. If checkpoints from an earlier run with the same arguments and number of MPI tasks are present, the solver resumes from them. Noise models are also cached there.")
+    parser.add_argument(      "--checkpoint-interval", type=int, help="Number of CG steps between checkpoints")
+    parser.add_argument(      "--meta-cache", type=float, help="If set, cache the metadata of each observation (up to this many bytes) instead of reloading it for every detset")
     return parser
 
 
@@ -112,6 +120,15 @@ def main(config_file=None, defaults=defaults, **args):
     prefix= args['odir'] + "/"
     if args['prefix']: prefix += args['prefix'] + "_"
     utils.mkdir(args['odir'])
+    checkpoint = None
+    if args['checkpoint']:
+        utils.mkdir(args['checkpoint'])
+        checkpoint = os.path.join(args['checkpoint'], "cg_%04d.hdf" % comm.rank)
+        # Keep the noise models with the checkpoints, so that a resumed
+        # run reads them instead of rebuilding them in add_obs
+        if args['nmat_mode'] == "build":
+            args['nmat_mode'] = "cache"
+            nmat_dir = os.path.join(args['checkpoint'], "nmats")
     L = mapmaking.init(level=mapmaking.DEBUG, rank=comm.rank)
 
     recenter = None
@@ -120,6 +137,8 @@ def main(config_file=None, defaults=defaults, **args):
 
     with mapmaking.mark('context'):
         context = Context(args['context'])
+    if args['meta_cache']:
+        context.meta_cache = MetaCache(max_bytes=args['meta_cache'])
 
     #ids = context.obsdb.query(args.query)['obs_id']
     ids = mapmaking.get_ids(args['query'], context = context)
@@ -150,13 +169,23 @@ def main(config_file=None, defaults=defaults, **args):
     signal_cut = mapmaking.SignalCut(comm, dtype=dtype_tod)
     signal_map = mapmaking.SignalMap(shape, wcs, comm, comps=comps, dtype=dtype_map, recenter=recenter, tiled=args['tiled'] > 0)
     signals    = [signal_cut, signal_map]
-    mapmaker   = mapmaking.MLMapmaker(signals, noise_model=noise_model, dtype=dtype_tod, verbose=verbose>0)
+    mapmaker   = mapmaking.MLMapmaker(signals, noise_model=noise_model, dtype=dtype_tod, verbose=verbose>0,
+            nthread=args['nthread'])
 
     #mapmaker = mapmaking.MLMapmaker(shape, wcs, comps=comps, noise_model=noise_model, dtype_tod=dtype_tod, dtype_map=dtype_map, comm=comm, recenter=recenter, verbose=verbose>0)
 
+    # Distribute the tods over tasks by estimated cost (n_dets x n_samps), so
+    # that a mix of short and long observations doesn't leave tasks idle.
+    # This is deterministic, so every task computes the same assignment.
+    costs  = scheduling.estimate_costs(ids, obsfiledb=context.obsfiledb, obsdb=context.obsdb)
+    assign = scheduling.lpt_assign(costs, comm.size)
+    if comm.rank == 0:
+        L.info(scheduling.format_balance([costs[a].sum() for a in assign], "Planned cost per task"))
+
     # First feed our mapmaker with data
+    t_build = time.time()
     nset_kept_tot = 0
-    for ind in range(comm.rank, len(ids), comm.size):
+    for ind in assign[comm.rank]:
         # Detsets correspond to separate files, so treat them as separate TODs.
         obs_id = ids[ind]
         detsets = context.obsfiledb.get_detsets(obs_id)
@@ -276,6 +305,11 @@ def main(config_file=None, defaults=defaults, **args):
         nset_kept_tot += nset_kept
 
     nset_kept_tot = comm.allreduce(nset_kept_tot)
+    build_times = np.zeros(comm.size)
+    build_times[comm.rank] = time.time() - t_build
+    build_times = utils.allreduce(build_times, comm)
+    if comm.rank == 0:
+        L.info(scheduling.format_balance(build_times, "Build time per task (s)"))
     if nset_kept_tot == 0:
         if comm.rank == 0:
             L.info("All tods failed. Giving up")
@@ -295,7 +329,9 @@ def main(config_file=None, defaults=defaults, **args):
     L.info("Wrote rhs, div, bin")
 
     t1 = time.time()
-    for step in mapmaker.solve(maxiter=args['maxiter']):
+    x = None
+    for step in mapmaker.solve(maxiter=args['maxiter'], checkpoint=checkpoint,
+            checkpoint_interval=args['checkpoint_interval']):
         t2 = time.time()
         dump = step.i % 10 == 0
         L.info("CG step %4d %15.7e %8.3f %s" % (step.i, step.err, t2-t1, "" if not dump else "(write)"))
@@ -303,10 +339,15 @@ def main(config_file=None, defaults=defaults, **args):
             for signal, val in zip(signals, step.x):
                 if signal.output:
                     signal.write(prefix, "map%04d" % step.i, val)
+        x = step.x
         t1 = time.time()
 
     L.info("Done")
-    for signal, val in zip(signals, step.x):
+    if x is None:
+        # No steps taken, e.g. resumed from a checkpoint that had
+        # already reached maxiter or converged.
+        x = mapmaker.x
+    for signal, val in zip(signals, x):
         if signal.output:
             signal.write(prefix, "map", val)
     comm.Barrier()
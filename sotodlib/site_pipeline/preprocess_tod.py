@@ -13,6 +13,7 @@ import copy
 
 from sotodlib import core
 import sotodlib.site_pipeline.util as sp_util
+from sotodlib.site_pipeline import scheduling
 from sotodlib.preprocess import _Preprocess, Pipeline, processes
 
 logger = sp_util.init_logger("preprocess")
@@ -645,16 +646,27 @@ def main(
 
     logger.info(f'Starting dest_file set to {dest_file}')
 
+    # Submit the largest observations first, so that the pool's workers
+    # pick up the small ones as they become free and finish together.
+    costs = scheduling.estimate_costs([r[0]['obs_id'] for r in run_list],
+                                      obsfiledb=context.obsfiledb,
+                                      obsdb=context.obsdb)
+    run_list = [run_list[i] for i in scheduling.lpt_order(costs)]
+    task_times = []
+    t_start = time.time()
+
     # Run write_block obs-ids in parallel at once then write all to the sqlite db.
     with ProcessPoolExecutor(nproc) as exe:
-        futures = [exe.submit(preprocess_tod, obs_id=r[0]['obs_id'],
+        futures = [exe.submit(scheduling.timed_call, preprocess_tod,
+                     obs_id=r[0]['obs_id'],
                      group_list=r[1], verbosity=verbosity,
                      configs=swap_archive(configs, f'temp/{r[0]["obs_id"]}.h5'),
                      overwrite=overwrite, run_parallel=True) for r in run_list]
         for future in as_completed(futures):
             logger.info('New future as_completed result')
             try:
-                err, src_file, db_datasets = future.result()
+                (err, src_file, db_datasets), dt = future.result()
+                task_times.append(dt)
             except Exception as e:
                 errmsg = f'{type(e)}: {e}'
                 tb = ''.join(traceback.format_tb(e.__traceback__))
@@ -697,5 +709,12 @@ def main(
                 f.write(f'\n{time.time()}, {err}, {db_datasets[0]}\n{db_datasets[1]}\n')
                 f.close()
 
+    wall_time = time.time() - t_start
+    if len(task_times) and wall_time > 0:
+        logger.info(scheduling.format_balance(task_times, 'Task time (s)'))
+        logger.info(f'Worker utilization: '
+                    f'{sum(task_times) / (nproc * wall_time) * 100:.1f}% '
+                    f'of {nproc} processes over {wall_time:.1f} s')
+
 if __name__ == '__main__':
     sp_util.main_launcher(main, get_parser)
@@ -0,0 +1,166 @@
+"""Distribution of observations over MPI tasks or worker processes.
+
+Observations vary a lot in size (number of detectors and samples), so
+handing them out round-robin leaves some workers idle while others are
+still busy.  The functions here estimate a relative cost for each
+observation from the databases and assign the work so that each
+worker ends up with a similar total:
+
+- For a fixed set of workers (e.g. MPI tasks), use ``lpt_assign``,
+  which assigns observations longest-processing-time-first.
+- For a pool that hands out tasks as workers become free (e.g.
+  ``ProcessPoolExecutor``), submit the tasks in the order given by
+  ``lpt_order``, so that the large observations start first and the
+  small ones fill the gaps at the end.
+
+``balance_stats`` and ``format_balance`` summarize how well a
+schedule, planned or achieved, is balanced.
+
+"""
+import time
+
+import numpy as np
+
+
+def _select_in(conn, query, values, chunk=900):
+    """Run query, which has a single ``{}`` where the placeholders of an
+    ``in (...)`` clause go, over values in chunks (to stay within
+    sqlite's limit on the number of parameters), and yield the rows.
+
+    """
+    for i0 in range(0, len(values), chunk):
+        block = list(values[i0:i0 + chunk])
+        yield from conn.execute(query.format(','.join('?' * len(block))),
+                                block)
+
+
+def estimate_costs(obs_ids, obsfiledb=None, obsdb=None):
+    """Estimate the relative processing cost of each observation.
+
+    If an ObsFileDb is given, the cost is the total number of detector
+    samples (n_dets x n_samps, summed over detsets).  Otherwise, if an
+    ObsDb is given, the cost is taken from its ``n_samples`` column,
+    or else its ``duration`` column.  Observations for which no
+    estimate is available get the median cost of the others (or 1, if
+    there are none).
+
+    Args:
+      obs_ids (list of str): The observations to estimate.
+      obsfiledb (ObsFileDb): Source of per-detset sample ranges.
+      obsdb (ObsDb): Source of n_samples or duration.
+
+    Returns:
+      Array of float, the cost of each observation.
+
+    """
+    obs_ids = list(obs_ids)
+    costs = np.full(len(obs_ids), np.nan)
+    index = {obs_id: i for i, obs_id in enumerate(obs_ids)}
+    keys = list(index)
+
+    if obsfiledb is not None:
+        rows = list(_select_in(
+            obsfiledb.conn,
+            'select obs_id, detset, min(sample_start), max(sample_stop) '
+            'from files where obs_id in ({}) group by obs_id, detset', keys))
+        ndets = dict(_select_in(
+            obsfiledb.conn,
+            'select name, count(det) from detsets where name in ({}) '
+            'group by name', sorted(set([r[1] for r in rows]))))
+        for obs_id, detset, start, stop in rows:
+            i = index.get(obs_id)
+            if i is None or start is None or stop is None:
+                continue
+            cost = ndets.get(detset, 0) * (stop - start)
+            costs[i] = cost if np.isnan(costs[i]) else costs[i] + cost
+
+    if obsdb is not None and np.all(np.isnan(costs)):
+        columns = [r[1] for r in obsdb.conn.execute(
+            'pragma table_info("obs")')]
+        for col in ['n_samples', 'duration']:
+            if col in columns:
+                c = _select_in(
+                    obsdb.conn,
+                    f'select obs_id, `{col}` from obs where obs_id in ({{}})',
+                    keys)
+                for obs_id, val in c:
+                    i = index.get(obs_id)
+                    if i is not None and val is not None:
+                        costs[i] = val
+                break
+
+    known = ~np.isnan(costs)
+    costs[~known] = np.median(costs[known]) if known.any() else 1.
+    return costs
+
+
+def lpt_order(costs):
+    """Return the indices of costs sorted from most to least expensive.
+    Ties keep their original order.
+
+    """
+    return np.argsort(-np.asarray(costs), kind='stable')
+
+
+def lpt_assign(costs, n_workers):
+    """Assign items to workers, longest-processing-time-first: each
+    item, in decreasing order of cost, goes to the worker with the
+    least total cost so far.  This is deterministic, so every MPI
+    task can compute the same assignment independently.
+
+    Args:
+      costs (array): The cost of each item.
+      n_workers (int): The number of workers.
+
+    Returns:
+      List of n_workers arrays of item indices.  Each array is sorted,
+      so items are processed in their original order.
+
+    """
+    loads = np.zeros(n_workers)
+    assign = [[] for _ in range(n_workers)]
+    for i in lpt_order(costs):
+        w = int(np.argmin(loads))
+        assign[w].append(i)
+        loads[w] += costs[i]
+    return [np.sort(np.array(a, dtype=int)) for a in assign]
+
+
+def balance_stats(loads):
+    """Summarize the balance of per-worker loads (estimated costs or
+    measured times).
+
+    Returns:
+      Dict with the number of workers (n), the total, mean, min and
+      max load, and the efficiency, mean/max; i.e. the fraction of the
+      available worker time that is used if all workers start
+      together and the job ends when the slowest finishes.
+
+    """
+    loads = np.asarray(loads, dtype=float)
+    stats = {'n': len(loads), 'total': loads.sum(), 'mean': 0., 'min': 0.,
+             'max': 0., 'efficiency': 1.}
+    if len(loads):
+        stats.update(mean=loads.mean(), min=loads.min(), max=loads.max())
+        if stats['max'] > 0:
+            stats['efficiency'] = stats['mean'] / stats['max']
+    return stats
+
+
+def format_balance(loads, label='load'):
+    """Return a one-line summary of balance_stats(loads), for logging."""
+    s = balance_stats(loads)
+    return (f"{label}: n={s['n']} total={s['total']:.4g} mean={s['mean']:.4g} "
+            f"min={s['min']:.4g} max={s['max']:.4g} "
+            f"efficiency={s['efficiency']*100:.1f}%")
+
+
+def timed_call(func, *args, **kwargs):
+    """Call func(*args, **kwargs) and return (result, elapsed seconds).
+    Submit this to an executor in place of func to measure the time
+    each task takes in its worker.
+
+    """
+    t0 = time.time()
+    result = func(*args, **kwargs)
+    return result, time.time() - t0
@@ -1,10 +1,12 @@
 import numpy as np
 import logging
+from concurrent.futures import ThreadPoolExecutor
 logger = logging.getLogger(__name__)
 
 def bin_signal(aman, bin_by, signal=None,
                    range=None, bins=100, flags=None,
-                   weight_for_signal=None):
+                   weight_for_signal=None, chunk_size=2**16,
+                   n_threads=None):
     """
     Bin time-ordered data by the ``bin_by`` and return the binned signal and its standard deviation.
 
@@ -29,6 +31,12 @@ def bin_signal(aman, bin_by, signal=None,
     weight_for_signal : array-like, optional
         Array of weights for the signal values. If None, all weights are assumed to be 1. You can get a apodizing window by
         'sotodlib.tod_ops.apodize.get_apodize_window_for_ends' or 'get_apodize_window_from_flags'.
+    chunk_size : int, optional
+        Number of samples accumulated at a time; this bounds the size of
+        temporary arrays. Default is 2**16.
+    n_threads : int, optional
+        If greater than 1, sample chunks are accumulated concurrently on
+        this many threads.
 
     Returns
     -------
@@ -43,68 +51,98 @@ def bin_signal(aman, bin_by, signal=None,
         signal = aman.signal
     if range is None:
         range = (np.nanmin(bin_by), np.nanmax(bin_by))
-    
+
     if weight_for_signal is None:
         weight_for_signal = np.ones(aman.samps.count)
-        
+    if weight_for_signal.shape not in [(aman.dets.count, aman.samps.count),
+                                       (aman.samps.count, )]:
+        raise ValueError('weight_for_signal should have shape of (`dets`, `samps`) or (`samps`,)')
+    if flags is not None and flags.shape not in [(aman.dets.count, aman.samps.count),
+                                                 (aman.samps.count, )]:
+        raise ValueError('flags should have shape of (`dets`, `samps`) or (`samps`,)')
+
     # get bin_edges
-    _, bin_edges = np.histogram(bin_by, bins=bins, range=range,)
+    bin_edges = np.histogram_bin_edges(bin_by, bins=bins, range=range)
     bin_centers = (bin_edges[1] - bin_edges[0])/2. + bin_edges[:-1] # edge to center
     nbins = len(bin_centers)
-    
-    # prepare binned signal array
+
+    # Bin index of each sample, computed once; out-of-range samples
+    # get index nbins.
+    bin_idx = _get_bin_index(bin_by, bin_edges)
+
+    bin_counts_dets, binned_sum, binned_sum_squared = _bin_accumulate(
+        bin_idx, nbins, signal, weight_for_signal, flags,
+        chunk_size=chunk_size, n_threads=n_threads)
+
     binned_signal = np.full([aman.dets.count, nbins], np.nan)
-    binned_signal_squared_mean = np.full([aman.dets.count, nbins], np.nan)
     binned_signal_sigma = np.full([aman.dets.count, nbins], np.nan)
-        
-    # bin tod
-    if flags is None:
-        bin_counts, _ = np.histogram(bin_by, bins=bins, range=range, weights = weight_for_signal)
-        for i, dets in enumerate(aman.dets.vals):
-            # find indexes of bins with non-zero counts
-            mcnts = bin_counts > 0
-            binned_signal[i][mcnts] = np.histogram(bin_by, bins=bins, range=range,
-                                                  weights = signal[i] * weight_for_signal,
-                                                  )[0][mcnts] / bin_counts[mcnts]
-            
-            binned_signal_squared_mean[i][mcnts] = np.histogram(bin_by, bins=bins, range=range,
-                                                           weights=(signal[i] * weight_for_signal)**2)[0][mcnts] / bin_counts[mcnts]
-                                                               
-            
-        binned_signal_sigma[:, mcnts] = np.sqrt(np.abs(binned_signal_squared_mean[:,mcnts] - binned_signal[:,mcnts]**2)
-                                     ) / np.sqrt(bin_counts[mcnts])
-        bin_counts_dets = np.tile(bin_counts, (aman.dets.count, 1))
-            
-    else:
-        bin_counts_dets = np.full([aman.dets.count, nbins], np.nan)
-        for i, dets in enumerate(aman.dets.vals):
-            if flags.shape == (aman.dets.count, aman.samps.count):
-                m = ~flags.mask()[i]
-            elif flags.shape == (aman.samps.count, ):
-                m = ~flags.mask()
-            else:
-                raise ValueError('flags should have shape of (`dets`, `samps`) or (`samps`,)')
-                
-            if weight_for_signal.shape == (aman.dets.count, aman.samps.count):
-                weight_for_signal_det = weight_for_signal[i]
-            elif weight_for_signal.shape == (aman.samps.count, ):
-                weight_for_signal_det = weight_for_signal
-            else:
-                raise ValueError('weight_for_signal should have shape of (`dets`, `samps`) or (`samps`,)')
-                
-            
-            bin_counts_masked, _ = np.histogram(bin_by[m], bins=bins, range=range, weights=weight_for_signal_det[m])
-            mcnts_masked = bin_counts_masked > 0
-            
-            bin_counts_dets[i] = bin_counts_masked
-            binned_signal[i][mcnts_masked] = np.histogram(bin_by[m], bins=bins, range=range,
-                                              weights=signal[i][m] * weight_for_signal_det[m])[0][mcnts_masked] / bin_counts_masked[mcnts_masked]
-
-            binned_signal_squared_mean[i][mcnts_masked] = np.histogram(bin_by[m], bins=bins, range=range,
-                                                           weights=(signal[i][m] * weight_for_signal_det[m])**2)[0][mcnts_masked] / bin_counts_masked[mcnts_masked]
-
-            binned_signal_sigma[i, mcnts_masked] = np.sqrt(np.abs(binned_signal_squared_mean[i,mcnts_masked] - binned_signal[i,mcnts_masked]**2)
-                                         ) / np.sqrt(bin_counts_masked[mcnts_masked])
+    mcnts = bin_counts_dets > 0
+    binned_signal[mcnts] = binned_sum[mcnts] / bin_counts_dets[mcnts]
+    binned_signal_squared_mean = binned_sum_squared[mcnts] / bin_counts_dets[mcnts]
+    binned_signal_sigma[mcnts] = np.sqrt(np.abs(binned_signal_squared_mean - binned_signal[mcnts]**2)
+                                         ) / np.sqrt(bin_counts_dets[mcnts])
 
     return {'bin_edges': bin_edges, 'bin_centers': bin_centers, 'bin_counts': bin_counts_dets,
             'binned_signal': binned_signal, 'binned_signal_sigma': binned_signal_sigma}
+
+
+def _get_bin_index(bin_by, bin_edges):
+    """Return the index of the bin containing each element of bin_by,
+    with the same conventions as np.histogram (the last bin includes
+    its right edge).  Samples outside the bins (or NaN) get index
+    len(bin_edges) - 1.
+
+    """
+    nbins = len(bin_edges) - 1
+    bin_idx = np.searchsorted(bin_edges, bin_by, side='right') - 1
+    bin_idx[bin_by == bin_edges[-1]] = nbins - 1
+    bin_idx[(bin_idx < 0) | (bin_idx >= nbins)] = nbins
+    return bin_idx
+
+
+def _bin_accumulate(bin_idx, nbins, signal, weight, flags=None,
+                    chunk_size=2**16, n_threads=None):
+    """Accumulate the weighted counts, sums and sums of squares of
+    signal (dets, samps) in the bins given by bin_idx (samps,), for
+    all detectors at once.
+
+    The weighted signal is signal * weight, where weight is (samps,)
+    or (dets, samps), and the samples flagged in flags (a Ranges or
+    RangesMatrix; or None) are excluded.  Only one chunk of samples is
+    processed at a time, so flags are never expanded to a full mask.
+
+    Returns (counts, sums, sums_squared), each (dets, nbins).
+
+    """
+    signal = np.atleast_2d(signal)
+    ndets, nsamps = signal.shape
+    nb = nbins + 1  # including overflow bin
+    offsets = (np.arange(ndets) * nb)[:, None]
+
+    def _chunk(i0):
+        i1 = min(i0 + chunk_size, nsamps)
+        w = np.broadcast_to(weight[..., i0:i1], (ndets, i1 - i0))
+        if flags is not None:
+            if len(flags.shape) == 1:
+                m = flags[i0:i1].mask()
+            else:
+                m = flags[:, i0:i1].mask()
+            w = np.where(m, 0., w)
+        idx = (bin_idx[i0:i1] + offsets).ravel()
+        ws = (signal[:, i0:i1] * w).ravel()
+        return (np.bincount(idx, weights=w.ravel(), minlength=ndets * nb),
+                np.bincount(idx, weights=ws, minlength=ndets * nb),
+                np.bincount(idx, weights=ws**2, minlength=ndets * nb))
+
+    starts = range(0, nsamps, chunk_size)
+    if n_threads is not None and n_threads > 1:
+        with ThreadPoolExecutor(max_workers=n_threads) as pool:
+            results = list(pool.map(_chunk, starts))
+    else:
+        results = map(_chunk, starts)
+
+    totals = [np.zeros(ndets * nb) for i in range(3)]
+    for r in results:
+        for t, x in zip(totals, r):
+            t += x
+    return tuple(t.reshape(ndets, nb)[:, :nbins] for t in totals)
@@ -1,5 +1,12 @@
 """FFTs and related operations
 """
+import contextlib
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+
 import numdifftools as ndt
 import numpy as np
 import pyfftw
@@ -100,16 +107,17 @@ def rfft(
     else:
         raise ValueError('resize must be "zero_pad", "trim", or None')
 
-    a, b, t_fun = build_rfft_object(n_det, n, "FFTW_FORWARD")
-    if resize == "zero_pad":
-        a[:, : axis.count] = signal
-        a[:, axis.count :] = 0
-    elif resize == "trim":
-        a[:] = signal[:, :n]
-    else:
-        a[:] = signal[:]
+    with cached_rfft_object(n_det, n, "FFTW_FORWARD") as (a, b, t_fun):
+        if resize == "zero_pad":
+            a[:, : axis.count] = signal
+            a[:, axis.count :] = 0
+        elif resize == "trim":
+            a[:] = signal[:, :n]
+        else:
+            a[:] = signal[:]
 
-    t_fun()
+        t_fun()
+        b = b.copy()
 
     if delta_t is None:
         if "timestamps" in aman:
@@ -124,7 +132,8 @@ def rfft(
     return b, freqs
 
 
-def build_rfft_object(n_det, n, direction="FFTW_FORWARD", **kwargs):
+def build_rfft_object(n_det, n, direction="FFTW_FORWARD", dtype="float32",
+                      **kwargs):
     """Build PyFFTW object for fft-ing
 
     Arguments:
@@ -136,6 +145,9 @@ def build_rfft_object(n_det, n, direction="FFTW_FORWARD", **kwargs):
 
         direction: fft direction. Can be FFTW_FORWARD, FFTW_BACKWARD, or BOTH
 
+        dtype: dtype of the real valued array; 'float32' (default) or
+            'float64'.  The complex array has the matching precision.
+
         kwargs: additional arguments to pass to pyfftw.FFTW
 
     Returns:
@@ -149,8 +161,10 @@ def build_rfft_object(n_det, n, direction="FFTW_FORWARD", **kwargs):
     fftargs = {"threads": _get_num_threads(), "flags": ["FFTW_ESTIMATE"]}
     fftargs.update(kwargs)
 
-    a = pyfftw.empty_aligned((n_det, n), dtype="float32")
-    b = pyfftw.empty_aligned((n_det, (n + 2) // 2), dtype="complex64")
+    dtype = np.dtype(dtype)
+    cdtype = np.result_type(dtype, np.complex64)
+    a = pyfftw.empty_aligned((n_det, n), dtype=dtype)
+    b = pyfftw.empty_aligned((n_det, (n + 2) // 2), dtype=cdtype)
     if direction == "FFTW_FORWARD":
         t_fun = pyfftw.FFTW(a, b, direction=direction, **fftargs)
     elif direction == "FFTW_BACKWARD":
@@ -165,6 +179,147 @@ def build_rfft_object(n_det, n, direction="FFTW_FORWARD", **kwargs):
     return a, b, t_fun
 
 
+class RfftCache:
+    """Process-wide cache of the PyFFTW objects (and their aligned
+    buffers) returned by :func:`build_rfft_object`.
+
+    Entries are keyed by (n_det, n, dtype, direction, threads, flags)
+    and evicted in least-recently-used order once the total buffer
+    size exceeds ``max_bytes`` or the number of entries exceeds
+    ``max_entries``.  An entry is removed from the cache while it is
+    checked out, so concurrent users never share buffers; a second
+    request for the same key while the first is in use is simply a
+    miss.
+
+    The ``flags`` attribute sets the FFTW planner flags used for new
+    entries.  Planning with ``["FFTW_MEASURE"]`` is slow the first
+    time for each shape, but the result can be kept across processes
+    with :meth:`save_wisdom` and :meth:`load_wisdom`.
+
+    Attributes:
+      max_bytes (int): Maximum total buffer size to keep cached.
+      max_entries (int): Maximum number of entries to keep cached.
+      flags (list of str): FFTW planner flags for new plans.
+      hits, misses, evictions (int): Usage counters.
+
+    """
+    def __init__(self, max_bytes=2**30, max_entries=16,
+                 flags=("FFTW_ESTIMATE",)):
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.flags = list(flags)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _entry_bytes(entry):
+        return entry[0].nbytes + entry[1].nbytes
+
+    @property
+    def nbytes(self):
+        """Total size of the cached buffers."""
+        with self._lock:
+            return sum(self._entry_bytes(e) for e in self._entries.values())
+
+    def checkout(self, n_det, n, direction="BOTH", dtype="float32",
+                 threads=None):
+        """Get the objects for an rfft of the requested shape, from the
+        cache if possible.  Returns (key, entry), where entry is the
+        tuple that :func:`build_rfft_object` would return.  Pass both
+        to :meth:`checkin` when done.
+
+        """
+        if threads is None:
+            threads = _get_num_threads()
+        key = (n_det, n, np.dtype(dtype).str, direction, threads,
+               tuple(self.flags))
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self.hits += 1
+                return key, entry
+            self.misses += 1
+        entry = build_rfft_object(n_det, n, direction, dtype=dtype,
+                                  threads=threads, flags=list(self.flags))
+        return key, entry
+
+    def checkin(self, key, entry):
+        """Return an entry to the cache (evicting older entries as
+        needed)."""
+        size = self._entry_bytes(entry)
+        if size > self.max_bytes or self.max_entries < 1:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            total = sum(self._entry_bytes(e) for e in self._entries.values())
+            while (total > self.max_bytes
+                   or len(self._entries) > self.max_entries):
+                _, old = self._entries.popitem(last=False)
+                total -= self._entry_bytes(old)
+                self.evictions += 1
+
+    def clear(self):
+        """Drop all cached entries (the counters are not reset)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Return a dict with the cache counters and current size."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._entries),
+                "nbytes": sum(self._entry_bytes(e)
+                              for e in self._entries.values()),
+            }
+
+    def load_wisdom(self, filename):
+        """Import FFTW wisdom saved by :meth:`save_wisdom`.  Returns
+        False if the file does not exist."""
+        if not os.path.exists(filename):
+            return False
+        with open(filename, "rb") as fin:
+            wisdom = pickle.load(fin)
+        pyfftw.import_wisdom(wisdom)
+        return True
+
+    def save_wisdom(self, filename):
+        """Export the accumulated FFTW wisdom to filename."""
+        with open(filename, "wb") as fout:
+            pickle.dump(pyfftw.export_wisdom(), fout)
+
+
+#: The process-wide cache used by :func:`cached_rfft_object`.
+RFFT_CACHE = RfftCache()
+
+
+@contextlib.contextmanager
+def cached_rfft_object(n_det, n, direction="BOTH", dtype="float32"):
+    """Context manager version of :func:`build_rfft_object` that reuses
+    plans and buffers from :data:`RFFT_CACHE`.  The buffers are only
+    valid inside the with block; copy out anything that must outlive
+    it.  Example::
+
+      with cached_rfft_object(n_det, n, 'BOTH') as (a, b, t_1, t_2):
+          a[:] = signal
+          t_1()
+          ...
+          output = a.copy()
+
+    """
+    key, entry = RFFT_CACHE.checkout(n_det, n, direction, dtype=dtype)
+    try:
+        yield entry
+    finally:
+        RFFT_CACHE.checkin(key, entry)
+
+
 def find_inferior_integer(target, primes=[2, 3, 5, 7, 11, 13]):
     """Find the largest integer less than or equal to target whose prime
     factorization contains only the integers listed in primes.
@@ -339,6 +494,158 @@ def neglnlike(params, x, y):
     return output
 
 
+def _noise_model_guess(f, pxx, fwhite, lowf):
+    """Initial guess (fknee, white_noise, alpha) for each row of pxx."""
+    wnest = np.median(pxx[:, (f > fwhite[0]) & (f < fwhite[1])], axis=1)
+    pfit = np.polyfit(np.log10(f[f < lowf]), np.log10(pxx[:, f < lowf]).T, 1)
+    model = 10 ** (pfit[0][:, None] * np.log10(f)[None, :] + pfit[1][:, None])
+    fidx = np.argmin(np.abs(model - wnest[:, None]), axis=1)
+    return np.array([f[fidx], wnest, -pfit[0]]).T
+
+
+def _fit_noise_model_one(f, p, p0):
+    """Nelder-Mead fit plus numerical Hessian for a single PSD.  Returns
+    (fit, cov).
+
+    """
+    res = minimize(neglnlike, p0, args=(f, p), method="Nelder-Mead")
+    try:
+        Hfun = ndt.Hessian(lambda params: neglnlike(params, f, p), full_output=True)
+        hessian_ndt, _ = Hfun(res["x"])
+        # Inverse of the hessian is an estimator of the covariance matrix
+        # sqrt of the diagonals gives you the standard errors.
+        cov = np.linalg.inv(hessian_ndt)
+    except np.linalg.LinAlgError:
+        cov = np.full((3, 3), np.nan)
+    return res.x, cov
+
+
+def _noise_model_terms(f, params):
+    """Evaluate model pieces for a batch of parameters.
+
+    params has shape (n_det, 3) holding (fknee, white_noise, alpha).
+    Returns (model, g, L), each (n_det, n_freq), where g =
+    (fknee/f)**alpha and L = log(fknee/f).
+
+    """
+    fknee, w, alpha = params.T
+    L = np.log(fknee)[:, None] - np.log(f)[None, :]
+    g = np.exp(np.clip(alpha[:, None] * L, -700, 700))
+    model = w[:, None] * (1 + g)
+    return model, g, L
+
+
+def _batch_neglnlike(f, pxx, params):
+    with np.errstate(all="ignore"):
+        model, _, _ = _noise_model_terms(f, params)
+        out = np.sum(np.log(model) + pxx / model, axis=1)
+    out[~np.isfinite(out)] = np.inf
+    return out
+
+
+def _batch_hessian(f, pxx, params):
+    """Analytic Hessian of neglnlike with respect to (fknee,
+    white_noise, alpha), for each detector.  Shape (n_det, 3, 3).
+
+    """
+    fknee, w, alpha = [x[:, None] for x in params.T]
+    model, g, L = _noise_model_terms(f, params)
+    r = pxx / model
+    h = g / (1 + g)
+    h2 = g / (1 + g) ** 2
+    # First derivatives of log(model).
+    e = [alpha * h / fknee, np.broadcast_to(1 / w, g.shape), h * L]
+    # Second derivatives of log(model).
+    d2 = np.zeros((3, 3) + g.shape)
+    d2[0, 0] = alpha / fknee**2 * (alpha * h2 - h)
+    d2[0, 2] = d2[2, 0] = h / fknee + alpha * h2 * L / fknee
+    d2[1, 1] = -1 / w**2
+    d2[2, 2] = h2 * L**2
+    hess = np.empty((len(params), 3, 3))
+    for j in range(3):
+        for k in range(j, 3):
+            hess[:, j, k] = hess[:, k, j] = np.sum(
+                d2[j, k] * (1 - r) + e[j] * e[k] * r, axis=1)
+    return hess
+
+
+def fit_noise_model_batched(f, pxx, p0, max_iter=200, tol=1e-8):
+    """Fit the white + 1/f noise model to many PSDs at once.
+
+    This minimizes the same likelihood as :func:`neglnlike`, for all
+    detectors simultaneously, using Levenberg-Marquardt steps on the
+    Fisher information, in the parameters (log(fknee),
+    log(white_noise), alpha).  The covariance is the inverse of the
+    analytic Hessian of neglnlike with respect to (fknee,
+    white_noise, alpha) at the best fit.
+
+    Args:
+      f (ndarray): Frequencies, shape (n_freq,), all > 0.
+      pxx (ndarray): PSDs, shape (n_det, n_freq).
+      p0 (ndarray): Initial guesses, shape (n_det, 3).
+      max_iter (int): Maximum number of iterations.
+      tol (float): Convergence threshold on the fractional change
+        of the likelihood.
+
+    Returns:
+      (fit, cov), with shapes (n_det, 3) and (n_det, 3, 3).
+
+    """
+    pxx = np.asarray(pxx, dtype=float)
+    params = np.array(p0, dtype=float)
+    n_det = len(params)
+    lam = np.full(n_det, 1e-3)
+    active = np.ones(n_det, dtype=bool)
+    nll = _batch_neglnlike(f, pxx, params)
+
+    for _ in range(max_iter):
+        idx = np.nonzero(active)[0]
+        if len(idx) == 0:
+            break
+        _p, _pxx = params[idx], pxx[idx]
+        with np.errstate(all="ignore"):
+            model, g, L = _noise_model_terms(f, _p)
+            r = _pxx / model
+            h = g / (1 + g)
+            # Derivatives of log(model) wrt (log fknee, log w, alpha).
+            d = np.array([_p[:, 2:3] * h, np.ones_like(h), h * L])
+            grad = np.einsum("kdf,df->dk", d, 1 - r)
+            fisher = np.einsum("jdf,kdf->djk", d, d)
+        diag = np.einsum("djj->dj", fisher)
+        A = fisher + (lam[idx, None] * diag)[:, :, None] * np.eye(3)
+        try:
+            step = -np.linalg.solve(A, grad[..., None])[..., 0]
+        except np.linalg.LinAlgError:
+            step = np.zeros_like(grad)
+            for i in range(len(idx)):
+                try:
+                    step[i] = -np.linalg.solve(A[i], grad[i])
+                except np.linalg.LinAlgError:
+                    step[i] = np.nan
+        u = np.array([np.log(_p[:, 0]), np.log(_p[:, 1]), _p[:, 2]]).T + step
+        trial = np.array([np.exp(u[:, 0]), np.exp(u[:, 1]), u[:, 2]]).T
+        trial_nll = _batch_neglnlike(f, _pxx, trial)
+        better = np.isfinite(trial_nll) & (trial_nll <= nll[idx])
+        converged = better & (
+            nll[idx] - trial_nll <= tol * np.abs(trial_nll))
+        params[idx[better]] = trial[better]
+        nll[idx[better]] = trial_nll[better]
+        lam[idx[better]] /= 10
+        lam[idx[~better]] *= 10
+        # Give up on dets whose damping blows up.
+        active[idx[converged | (lam[idx] > 1e10)]] = False
+
+    cov = np.full((n_det, 3, 3), np.nan)
+    with np.errstate(all="ignore"):
+        hess = _batch_hessian(f, pxx, params)
+    for i in range(n_det):
+        try:
+            cov[i] = np.linalg.inv(hess[i])
+        except np.linalg.LinAlgError:
+            pass
+    return params, cov
+
+
 def fit_noise_model(
     aman,
     signal=None,
@@ -351,6 +658,8 @@ def fit_noise_model(
     f_max=100,
     merge_name="noise_fit_stats",
     merge_psd=True,
+    method="exact",
+    nproc=None,
 ):
     """
     Fits noise model with white and 1/f noise to the PSD of signal.
@@ -390,6 +699,14 @@ def fit_noise_model(
         If ``merge_fit`` is True then addes into axis manager with merge_name.
     merge_psd : bool
         If ``merg_psd`` is True then adds fres and Pxx to the axis manager.
+    method : str
+        ``"exact"`` runs Nelder-Mead and a numerical Hessian for each
+        detector.  ``"batched"`` fits all detectors at once with
+        :func:`fit_noise_model_batched`, which is much faster for
+        large detector counts.
+    nproc : int
+        If greater than 1 and ``method="exact"``, the per-detector fits
+        are distributed over a pool of this many processes.
     Returns
     -------
     noise_fit_stats : AxisManager
@@ -417,25 +734,24 @@ def fit_noise_model(
     f = f[1:eix]
     pxx = pxx[:, 1:eix]
 
-    fitout = np.zeros((aman.dets.count, 3))
-    # This is equal to np.sqrt(np.diag(cov)) when doing curve_fit
-    covout = np.zeros((aman.dets.count, 3, 3))
-    for i in range(aman.dets.count):
-        p = pxx[i]
-        wnest = np.median(p[((f > fwhite[0]) & (f < fwhite[1]))])
-        pfit = np.polyfit(np.log10(f[f < lowf]), np.log10(p[f < lowf]), 1)
-        fidx = np.argmin(np.abs(10 ** np.polyval(pfit, np.log10(f)) - wnest))
-        p0 = [f[fidx], wnest, -pfit[0]]
-        res = minimize(neglnlike, p0, args=(f, p), method="Nelder-Mead")
-        try:
-            Hfun = ndt.Hessian(lambda params: neglnlike(params, f, p), full_output=True)
-            hessian_ndt, _ = Hfun(res["x"])
-            # Inverse of the hessian is an estimator of the covariance matrix
-            # sqrt of the diagonals gives you the standard errors.
-            covout[i] = np.linalg.inv(hessian_ndt)
-        except np.linalg.LinAlgError:
-            covout[i] = np.full((3, 3), np.nan)
-        fitout[i] = res.x
+    p0 = _noise_model_guess(f, pxx, fwhite, lowf)
+    if method == "batched":
+        fitout, covout = fit_noise_model_batched(f, pxx, p0)
+    elif method == "exact":
+        fitout = np.zeros((aman.dets.count, 3))
+        # This is equal to np.sqrt(np.diag(cov)) when doing curve_fit
+        covout = np.zeros((aman.dets.count, 3, 3))
+        if nproc is not None and nproc > 1:
+            with ProcessPoolExecutor(max_workers=nproc) as pool:
+                results = list(pool.map(_fit_noise_model_one,
+                                        [f] * len(pxx), pxx, p0))
+        else:
+            results = map(_fit_noise_model_one, [f] * len(pxx), pxx, p0)
+        for i, (fit, cov) in enumerate(results):
+            fitout[i] = fit
+            covout[i] = cov
+    else:
+        raise ValueError(f"Unknown method '{method}'")
 
     noise_model_coeffs = ["fknee", "white_noise", "alpha"]
     noise_fit_stats = core.AxisManager(
@@ -98,32 +98,32 @@ def fourier_filter(tod, filt_function,
 
     else:
         logger.info('fourier_filter: initializing rfft object.')
-        a, b, t_1, t_2 = fft_ops.build_rfft_object(n_det, n, 'BOTH')
+        with fft_ops.cached_rfft_object(n_det, n, 'BOTH') as (a, b, t_1, t_2):
 
-        if other_idx is not None and other_idx != 0:
-            ## so that code can be written always along axis 1
-            signal = signal.transpose()
+            if other_idx is not None and other_idx != 0:
+                ## so that code can be written always along axis 1
+                signal = signal.transpose()
 
-        # This copy is valid for all modes of "resize"
-        logger.info('fourier_filter: copying in data.')
-        a[:,:min(n, axis.count)] = signal[:,:min(n, axis.count)]
-        a[:,min(n, axis.count):] = 0
+            # This copy is valid for all modes of "resize"
+            logger.info('fourier_filter: copying in data.')
+            a[:,:min(n, axis.count)] = signal[:,:min(n, axis.count)]
+            a[:,min(n, axis.count):] = 0
 
-        ## FFT Signal
-        logger.info('fourier_filter: FFT.')
-        t_1()
+            ## FFT Signal
+            logger.info('fourier_filter: FFT.')
+            t_1()
 
-        ## Get Filter
-        logger.info('fourier_filter: applying filter.')
-        freqs = np.fft.rfftfreq(n, delta_t)
-        filt_function.apply(freqs, tod, b, **kwargs)
+            ## Get Filter
+            logger.info('fourier_filter: applying filter.')
+            freqs = np.fft.rfftfreq(n, delta_t)
+            filt_function.apply(freqs, tod, b, **kwargs)
 
-        ## FFT Back
-        logger.info('fourier_filter: IFFT.')
-        t_2()
+            ## FFT Back
+            logger.info('fourier_filter: IFFT.')
+            t_2()
 
-        # Un-pad?
-        signal = a[:,:min(n, axis.count)]
+            # Un-pad (and copy out of the cached buffer).
+            signal = a[:,:min(n, axis.count)].copy()
 
         if other_idx is not None and other_idx != 0:
             return signal.transpose()
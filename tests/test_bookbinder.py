@@ -7,9 +7,14 @@ import numpy as np
 import so3g
 from spt3g import core
 import os
+import sys
+import subprocess
 from unittest import mock
 import unittest
 import tempfile
+import logging
+from types import SimpleNamespace
+from tqdm.auto import tqdm
 
 def load_data(files, data_name='data'):
     """
@@ -27,6 +32,132 @@ def load_data(files, data_name='data'):
     times = np.hstack(times)
     return times, data
 
+def write_l2_file(filename, nframes=4, nsamps=100, nchans=3, t0=0, drop=(),
+                  stream_id='test'):
+    """
+    Writes a minimal level 2 smurf file, with timing counters.  Sample
+    indices listed in drop are left out.  The data of channel j at
+    sample n is n * nchans + j.
+    """
+    writer = core.G3Writer(filename)
+    for i in range(nframes):
+        n = np.arange(i * nsamps, (i + 1) * nsamps) + t0
+        n = n[~np.isin(n, drop)]
+        ts = core.G3VectorTime((1.7e9 + n / 200.) * core.G3Units.s)
+        frame = core.G3Frame(core.G3FrameType.Scan)
+        frame['data'] = so3g.G3SuperTimestream(
+            [f'r{j:04d}' for j in range(nchans)], ts,
+            (n * nchans + np.arange(nchans)[:, None]).astype(np.int32))
+        frame['tes_biases'] = so3g.G3SuperTimestream(
+            ['b00'], ts, n[None, :].astype(np.int32))
+        frame['primary'] = so3g.G3SuperTimestream(
+            ['Counter0', 'Counter2', 'FrameCounter'], ts,
+            np.array([n * 2400, ((n // 200) << 32) + (n % 200) * 5_000_000, n],
+                     dtype=np.int64))
+        frame['timing_paradigm'] = 'High Precision'
+        frame['session_id'] = 1700000000
+        frame['sostream_version'] = 2
+        frame['sostream_id'] = stream_id
+        writer.Process(frame)
+    writer.Process(core.G3Frame(core.G3FrameType.EndProcessing))
+
+
+def write_hk_file(filename, t0, t1):
+    """
+    Writes an HK file with ACU_broadcast mount data at 10 Hz.
+    """
+    session = so3g.hk.HKSessionHelper(session_id=1, start_time=t0,
+                                      hkagg_version=2)
+    writer = core.G3Writer(filename)
+    writer.Process(session.session_frame())
+    prov_id = session.add_provider('observatory.acu.feeds.acu_broadcast')
+    writer.Process(session.status_frame())
+    t = np.arange(t0, t1, 0.1)
+    frame = session.data_frame(prov_id)
+    block = core.G3TimesampleMap()
+    block.times = core.G3VectorTime(t * core.G3Units.s)
+    block['Corrected_Azimuth'] = core.G3VectorDouble(180 + 0.5 * (t - t0))
+    block['Corrected_Elevation'] = core.G3VectorDouble(50 + 0 * t)
+    frame['block_names'].append('ACU_broadcast')
+    frame['blocks'].append(block)
+    writer.Process(frame)
+    writer.Process(core.G3Frame(core.G3FrameType.EndProcessing))
+
+
+SMURF_STREAM_DROPS = {'ufm0': [5, 6, 7, 399, 400], 'ufm1': [150, 620]}
+
+
+def get_smurf_streams(l2_dir):
+    """
+    Returns preprocessed SmurfStreamProcessors for two streams, writing
+    their level 2 files in l2_dir if needed.
+    """
+    streams = {}
+    for sid, drop in SMURF_STREAM_DROPS.items():
+        files = [os.path.join(l2_dir, f'{sid}_{i}.g3') for i in range(2)]
+        for i, f in enumerate(files):
+            if not os.path.exists(f):
+                write_l2_file(f, t0=400 * i, drop=drop, stream_id=sid)
+        streams[sid] = bb.SmurfStreamProcessor(
+            f'obs_{sid}', files, 'book', ['a', 'b', 'c'])
+        streams[sid].preprocess()
+    return streams
+
+
+def bind_smurf_streams(l2_dir, outdir, nproc=2):
+    """
+    Binds the streams of get_smurf_streams, with ancillary data, into
+    outdir using BookBinder._bind_streams_parallel.  Returns the binder.
+    """
+    streams = get_smurf_streams(l2_dir)
+    times, _ = bb.fill_time_gaps(streams['ufm1'].times)
+    hk_file = os.path.join(l2_dir, 'hk.g3')
+    if not os.path.exists(hk_file):
+        write_hk_file(hk_file, times[0] - 10, times[-1] + 10)
+    log = logging.Logger('bookbinder-test')
+    for stream in streams.values():
+        stream.log = log
+    ancil = bb.AncilProcessor([hk_file], 'book', log=log)
+    ancil.preprocess()
+    frame_idxs = np.arange(len(times)) // 130
+    file_idxs = np.arange(frame_idxs[-1] + 1) // 3
+    os.makedirs(outdir, exist_ok=True)
+    ancil.bind(outdir, times, frame_idxs, file_idxs)
+
+    binder = bb.BookBinder.__new__(bb.BookBinder)
+    binder.outdir = outdir
+    binder.times, binder.frame_idxs, binder.file_idxs = \
+        times, frame_idxs, file_idxs
+    binder.ancil = ancil
+    binder.streams = streams
+    binder.nproc = nproc
+    binder.max_memory = None
+    binder.log = log
+    binder._bind_streams_parallel(tqdm(disable=True))
+    return binder
+
+
+class FakeStream:
+    """Stand-in for SmurfStreamProcessor in parallel binding tests."""
+    def __init__(self, stream_id, nsamps):
+        self.stream_id = stream_id
+        self.times = np.arange(nsamps, dtype=float)
+        self.nchans = 10
+        self.nframes = 2
+        self.bias_names = ['b00']
+        self.primary_names = ['FrameCounter']
+        self.out_files = []
+        self.log = logging.getLogger('bookbinder')
+
+    def bind(self, outdir, times, frame_idxs, file_idxs, pbar=False, ancil=None):
+        self.log.info(f"binding {self.stream_id} in {os.getpid()}")
+        if self.stream_id == 'bad':
+            raise ValueError("bad stream")
+        fname = os.path.join(outdir, f'D_{self.stream_id}_000.g3')
+        open(fname, 'w').close()
+        self.out_files = [fname]
+
+
 class BookbinderTest(unittest.TestCase):
     def setUp(self):
         self.tempdir = tempfile.TemporaryDirectory()
@@ -96,5 +227,166 @@ class BookbinderTest(unittest.TestCase):
         self.assertTrue(np.all(out_ts[mask] == in_ts))
         self.assertTrue(np.all(out_data[:, mask] == in_data))
 
+    def test_frame_times_sidecar(self):
+        files = [os.path.join(self.l2_dir, f'{i}.g3') for i in range(2)]
+        for i, f in enumerate(files):
+            write_l2_file(f, t0=400 * i)
+        readout_ids = ['a', 'b', 'c']
+
+        ref = bb.SmurfStreamProcessor('obs', files, 'book', readout_ids)
+        ref.preprocess()
+
+        for f in files:
+            bb.write_frame_times(f)
+        ssp = bb.SmurfStreamProcessor('obs', files, 'book', readout_ids)
+        with mock.patch.object(bb, 'get_frame_times') as gft:
+            ssp.preprocess()
+            gft.assert_not_called()
+        for k in ['times', 'frame_idxs', 'smurf_frame_counters']:
+            np.testing.assert_array_equal(getattr(ssp, k), getattr(ref, k))
+        for k in ['nframes', 'nchans', 'stream_id', 'session_id',
+                  'timing_paradigm', 'sostream_version']:
+            self.assertEqual(getattr(ssp, k), getattr(ref, k))
+        self.assertEqual(list(ssp.primary_names), list(ref.primary_names))
+        self.assertEqual(list(ssp.bias_names), list(ref.bias_names))
+
+        # A sidecar that does not match its file is ignored.
+        write_l2_file(files[1], nframes=5, t0=400)
+        ssp = bb.SmurfStreamProcessor('obs', files, 'book', readout_ids)
+        ssp.preprocess()
+        self.assertEqual(ssp.nframes, 9)
+        self.assertEqual(len(ssp.times), 900)
+
+    def test_smurf_stream_bind(self):
+        # Dropped samples within frames and across the file boundary;
+        # out-frames that do not line up with the in-frames, spread
+        # over several files.
+        drop = [5, 6, 7, 150, 399, 400, 401, 620]
+        files = [os.path.join(self.l2_dir, f'{i}.g3') for i in range(2)]
+        for i, f in enumerate(files):
+            write_l2_file(f, t0=400 * i, drop=drop)
+        in_ts, in_data = load_data(files, data_name='data')
+        _, in_biases = load_data(files, data_name='tes_biases')
+        _, in_primary = load_data(files, data_name='primary')
+
+        ssp = bb.SmurfStreamProcessor('obs', files, 'book', ['a', 'b', 'c'])
+        ssp.preprocess()
+        times, mask = bb.fill_time_gaps(ssp.times)
+        self.assertEqual(len(times), 800)
+        frame_idxs = np.arange(len(times)) // 130
+        file_idxs = np.arange(frame_idxs[-1] + 1) // 3
+        ssp.bind(self.l3_dir, times, frame_idxs, file_idxs)
+        self.assertEqual(ssp.out_files,
+                         [os.path.join(self.l3_dir, f'D_test_{i:03d}.g3')
+                          for i in range(3)])
+
+        out_ts, out_data = load_data(ssp.out_files, data_name='signal')
+        _, out_biases = load_data(ssp.out_files, data_name='tes_biases')
+        _, out_primary = load_data(ssp.out_files, data_name='primary')
+        np.testing.assert_allclose(out_ts, times, rtol=0, atol=1e-7)
+        np.testing.assert_array_equal(out_data[:, mask], in_data)
+        np.testing.assert_array_equal(out_biases[:, mask], in_biases)
+        np.testing.assert_array_equal(out_primary[:, mask], in_primary)
+        # Gaps are flagged, and interpolated.
+        sample_ranges, gaps = [], []
+        for frame in bb.get_frame_iter(ssp.out_files):
+            if frame.type == core.G3FrameType.Scan:
+                sample_ranges.append(list(frame['sample_range']))
+                gaps.append(np.array(frame['flag_smurfgaps']))
+        self.assertEqual(sample_ranges, [[i, min(i + 130, 800)]
+                                         for i in range(0, 800, 130)])
+        np.testing.assert_array_equal(np.hstack(gaps), ~mask)
+        expected = np.arange(800) * 3 + np.arange(3)[:, None]
+        np.testing.assert_allclose(out_data, expected, atol=1)
+
+    def test_bind_streams_parallel(self):
+        binder = bb.BookBinder.__new__(bb.BookBinder)
+        binder.outdir = self.l3_dir
+        binder.times = np.arange(1000, dtype=float)
+        binder.frame_idxs = np.arange(1000) // 100
+        binder.file_idxs = np.zeros(10, dtype=int)
+        binder.ancil = SimpleNamespace(log=None)
+        binder.nproc = 2
+        collector = bb._RecordCollector()
+        binder.log = logging.Logger('bookbinder-test')
+        binder.log.addHandler(collector)
+
+        # A small memory budget forces streams to be bound one at a time.
+        for max_memory in [None, 1]:
+            binder.max_memory = max_memory
+            binder.streams = {sid: FakeStream(sid, 1000) for sid in ['s0', 's1', 's2']}
+            binder._bind_streams_parallel(tqdm(disable=True))
+            for sid, stream in binder.streams.items():
+                self.assertEqual(stream.out_files,
+                                 [os.path.join(self.l3_dir, f'D_{sid}_000.g3')])
+            msgs = [r.getMessage() for r in collector.records]
+            for sid in binder.streams:
+                self.assertTrue(any(m.startswith(f'binding {sid} in ') for m in msgs))
+            self.assertFalse(any(f'in {os.getpid()}' in m for m in msgs))
+
+        # Errors are logged and re-raised in the parent.
+        binder.streams = {sid: FakeStream(sid, 1000) for sid in ['s0', 'bad']}
+        with self.assertRaises(ValueError):
+            binder._bind_streams_parallel(tqdm(disable=True))
+        self.assertTrue(any('Binding bad failed' in r.getMessage() and
+                            'bad stream' in r.getMessage()
+                            for r in collector.records))
+
+    def test_bind_streams_parallel_smurf(self):
+        # Real stream and ancillary processors are pickled into the
+        # (spawned) worker processes; the result must match a serial bind.
+        binder = bind_smurf_streams(self.l2_dir, self.l3_dir)
+        # The parent's processors are updated, but not replaced.
+        self.assertIsNotNone(binder.ancil.log)
+        for sid, stream in binder.streams.items():
+            self.assertIs(stream.log, binder.log)
+            self.assertEqual(stream.out_files,
+                             [os.path.join(self.l3_dir, f'D_{sid}_{i:03d}.g3')
+                              for i in range(3)])
+
+        # Again, with OpenMP threads running in the parent before the
+        # pool starts (forked workers would deadlock).  so3g reads
+        # OMP_NUM_THREADS at startup, so this runs in a new process.
+        omp_dir = os.path.join(self.tempdir.name, 'omp')
+        code = ('from tests.test_bookbinder import bind_smurf_streams; '
+                f'bind_smurf_streams({self.l2_dir!r}, {omp_dir!r})')
+        subprocess.run(
+            [sys.executable, '-c', code], check=True, timeout=300,
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            env=dict(os.environ, OMP_NUM_THREADS='4'))
+
+        serial_dir = os.path.join(self.tempdir.name, 'serial')
+        os.makedirs(serial_dir)
+        times, frame_idxs, file_idxs = \
+            binder.times, binder.frame_idxs, binder.file_idxs
+        for sid, stream in get_smurf_streams(self.l2_dir).items():
+            stream.bind(serial_dir, times, frame_idxs, file_idxs,
+                        ancil=binder.ancil)
+            for outdir in [self.l3_dir, omp_dir]:
+                frames = [
+                    [fr for fr in bb.get_frame_iter(files)
+                     if fr.type == core.G3FrameType.Scan]
+                    for files in [
+                        [f.replace(serial_dir, outdir) for f in stream.out_files],
+                        stream.out_files]]
+                self.assertEqual(len(frames[0]), 7)
+                self.assertEqual(len(frames[1]), 7)
+                for fr0, fr1 in zip(*frames):
+                    self.assertEqual(sorted(fr0.keys()), sorted(fr1.keys()))
+                    self.assertEqual(list(fr0['sample_range']),
+                                     list(fr1['sample_range']))
+                    for k in ['signal', 'tes_biases', 'primary']:
+                        np.testing.assert_array_equal(fr0[k].data, fr1[k].data)
+                        self.assertEqual(list(fr0[k].names), list(fr1[k].names))
+                    np.testing.assert_array_equal(fr0['flag_smurfgaps'],
+                                                  fr1['flag_smurfgaps'])
+                    i0, i1 = fr0['sample_range']
+                    np.testing.assert_allclose(
+                        fr0['ancil']['az_enc'],
+                        180 + 0.5 * (times[i0:i1] - times[0] + 10), atol=1e-6)
+                    for k in ['az_enc', 'el_enc']:
+                        np.testing.assert_array_equal(fr0['ancil'][k],
+                                                      fr1['ancil'][k])
+
 if __name__ == '__main__':
     unittest.main()
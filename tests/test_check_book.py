@@ -0,0 +1,108 @@
+import unittest
+import os
+import tempfile
+
+import numpy as np
+import so3g
+from spt3g import core
+import yaml
+
+from sotodlib.io import check_book
+
+from ._helpers import mpi_multi
+
+
+T0 = 1.7e9
+
+
+def write_book(book_dir, stream_ids=['ufm_0', 'ufm_1'], n_files=2,
+               n_frames=3, frame_len=10, n_dets=4, time_shift={}):
+    # Minimal obs book: ancil files and detector data files with
+    # matching sample_ranges and timestamps.  time_shift maps
+    # stream_id to an offset (s) added to the last sample.
+    file_len = n_frames * frame_len
+    meta = {
+        'book_id': 'obs_1700000000_satp1_11',
+        'type': 'obs',
+        'telescope': 'satp1',
+        'stream_ids': stream_ids,
+        'detsets': [f'{s}_dets' for s in stream_ids],
+        'sample_ranges': [[i * file_len, (i + 1) * file_len]
+                          for i in range(n_files)],
+    }
+    for basename in ['M_index.yaml', 'M_book.yaml']:
+        with open(os.path.join(book_dir, basename), 'w') as fout:
+            yaml.dump(meta, fout)
+
+    for stream_id in ['ancil'] + stream_ids:
+        if stream_id == 'ancil':
+            pattern = 'A_ancil_{index:03d}.g3'
+        else:
+            pattern = 'D_{stream_id}_{index:03d}.g3'
+        for index in range(n_files):
+            writer = core.G3Writer(os.path.join(
+                book_dir, pattern.format(stream_id=stream_id, index=index)))
+            for i in range(n_frames):
+                i0 = index * file_len + i * frame_len
+                t = T0 + np.arange(i0, i0 + frame_len) / 200.
+                if index == n_files - 1 and i == n_frames - 1:
+                    t[-1] += time_shift.get(stream_id, 0.)
+                times = core.G3VectorTime(
+                    [core.G3Time(_t * core.G3Units.s) for _t in t])
+                frame = core.G3Frame(core.G3FrameType.Scan)
+                frame['sample_range'] = core.G3VectorInt([i0, i0 + frame_len])
+                ancil = core.G3TimesampleMap()
+                ancil.times = times
+                frame['ancil'] = ancil
+                if stream_id != 'ancil':
+                    names = [f'{stream_id}_{d:03d}' for d in range(n_dets)]
+                    frame['signal'] = so3g.G3SuperTimestream(
+                        names, times,
+                        np.zeros((n_dets, frame_len), dtype='int32'))
+                writer.Process(frame)
+            writer.Process(core.G3Frame(core.G3FrameType.EndProcessing))
+    return meta
+
+
+@unittest.skipIf(mpi_multi(), "Running with multiple MPI processes")
+class TestBookScanner(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def _scan(self, nproc):
+        bs = check_book.BookScanner(self.tempdir.name, {'nproc': nproc})
+        bs.go()
+        return bs
+
+    def test_check_frames(self):
+        meta = write_book(self.tempdir.name)
+        results = [self._scan(nproc).results for nproc in [1, 3]]
+        for r in results:
+            self.assertEqual(r['errors'], [])
+            self.assertEqual([list(x) for x in r['sample_ranges']],
+                             meta['sample_ranges'])
+            self.assertEqual(r['det_lists']['ancil'], None)
+            self.assertEqual(len(r['det_lists']['ufm_1']), 4)
+            # Frame index for every file.
+            self.assertEqual(len(r['frame_offsets']), 6)
+            offsets = r['frame_offsets'][os.path.join(
+                self.tempdir.name, 'D_ufm_0_001.g3')]
+            self.assertEqual([o[3:] for o in offsets],
+                             [[30, 40], [40, 50], [50, 60]])
+        for k in ['det_lists', 'sample_ranges', 'frame_offsets']:
+            self.assertEqual(results[0][k], results[1][k])
+
+    def test_timestamp_discrepancy(self):
+        write_book(self.tempdir.name, time_shift={'ufm_1': 1e-4})
+        errors = [self._scan(nproc).results['errors'] for nproc in [1, 3]]
+        self.assertEqual(errors[0], errors[1])
+        self.assertEqual(len(errors[0]), 1)
+        self.assertTrue(errors[0][0][1].startswith('Timestamps value discrepancy'))
+
+
+if __name__ == '__main__':
+    unittest.main()
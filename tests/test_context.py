@@ -6,6 +6,7 @@
 """
 
 import unittest
+from unittest import mock
 import tempfile
 
 from sotodlib import core
@@ -281,6 +282,10 @@ class ContextTest(unittest.TestCase):
         tod = ctx.get_obs(obs_id, samples=(10, n_samp // 2))
         self.assertEqual(tod.signal.shape, (n_det, n_samp // 2 - 10))
 
+        # Loader threading option is passed through.
+        tod = ctx.get_obs(obs_id, n_threads=4)
+        self.assertEqual(tod.signal.shape, (n_det, n_samp))
+
         # Loading via filename
         tod = ctx.get_obs(filename='obs_number_11_neard.txt')
         self.assertEqual(tod.signal.shape, (n_det // 2, n_samp))
@@ -311,6 +316,75 @@ class ContextTest(unittest.TestCase):
         self.assertCountEqual(tod.ondisk._fields.keys(), ['disk1', 'subaman'])
         self.assertCountEqual(tod.ondisk.subaman._fields.keys(), ['disk2'])
 
+    def test_130_meta_cache(self):
+        dataset_sim = DatasetSim()
+        obs_id = dataset_sim.obss['obs_id'][1]
+        ctx0 = dataset_sim.get_context()
+        ctx = dataset_sim.get_context()
+        ctx.meta_cache = core.MetaCache()
+        for kw in [
+                {},
+                {'dets': ['read05']},
+                {'dets': {'dets:detset': 'neard'}, 'samples': (10, 50)},
+                {'dets': {'dets:band': 'f090', 'dets:detset': ['neard']}},
+                {'dets': {'dets:det_id': ['NO_MATCH']}},
+                {'free_tags': ['f090']},
+        ]:
+            meta0 = ctx0.get_meta(obs_id, **kw)
+            meta = ctx.get_meta(obs_id, **kw)
+            self.assertEqual(list(meta.dets.vals), list(meta0.dets.vals),
+                             msg=f'{kw}')
+            self.assertEqual(meta.shape, meta0.shape, msg=f'{kw}')
+            np.testing.assert_array_equal(meta.cal, meta0.cal)
+        self.assertEqual(ctx.meta_cache.misses, 1)
+        self.assertEqual(len(ctx.meta_cache), 1)
+
+        # Cache hits do not query the detdb / obsfiledb.
+        with mock.patch.object(ctx, '_get_base_det_info') as gbdi:
+            ctx.get_meta(obs_id, dets=['read05'])
+            gbdi.assert_not_called()
+
+        # Results are copies, not views of the cached data.
+        meta.cal[:] = -1
+        meta = ctx.get_meta(obs_id, **kw)
+        np.testing.assert_array_equal(meta.cal, meta0.cal)
+
+        with self.assertRaises(RuntimeError):
+            ctx.get_meta(obs_id, free_tags=['not_a_tag'])
+
+        # Eviction.
+        ctx.meta_cache.max_bytes = ctx.meta_cache.nbytes
+        ctx.get_meta(dataset_sim.obss['obs_id'][0])
+        self.assertEqual(len(ctx.meta_cache), 1)
+        self.assertLessEqual(ctx.meta_cache.nbytes, ctx.meta_cache.max_bytes)
+
+    def test_140_get_meta_batch(self):
+        dataset_sim = DatasetSim()
+        ctx = dataset_sim.get_context()
+        obs_ids = list(dataset_sim.obss['obs_id']) + [
+            dataset_sim.obss['obs_id'][1] + ':f090']
+        for kw in [
+                {},
+                {'dets': ['read05']},
+                {'dets': {'dets:detset': 'neard'}},
+        ]:
+            metas = ctx.get_meta_batch(obs_ids, **kw)
+            self.assertEqual(len(metas), len(obs_ids))
+            for obs_id, meta in zip(obs_ids, metas):
+                meta0 = ctx.get_meta(obs_id, **kw)
+                self.assertEqual(list(meta.dets.vals), list(meta0.dets.vals),
+                                 msg=f'{obs_id} {kw}')
+                self.assertEqual(meta.obs_info.obs_id, meta0.obs_info.obs_id)
+                np.testing.assert_array_equal(meta.cal, meta0.cal)
+
+        # Errors can be returned in place of results.
+        metas = ctx.get_meta_batch([obs_ids[0], obs_ids[0] + ':not_a_tag'],
+                                   on_error='return')
+        self.assertIsInstance(metas[0], core.AxisManager)
+        self.assertIsInstance(metas[1], RuntimeError)
+        with self.assertRaises(RuntimeError):
+            ctx.get_meta_batch([obs_ids[0] + ':not_a_tag'])
+
     def test_200_load_metadata(self):
         """Test the simple metadata load wrapper."""
         dataset_sim = DatasetSim()
@@ -137,6 +137,50 @@ class FootprintTest(unittest.TestCase):
                 with self.assertRaises(ValueError, msg=msg):
                     sg = coords.get_supergeom((m1.shape, m1.wcs), (m2.shape, m2.wcs))
 
+class PmatTest(unittest.TestCase):
+    def test_10_precompute(self):
+        """Check that precomputed pointing gives the same projections as
+        on-the-fly pointing, including when spilled to scratch files."""
+        n, ndet = 2000, 20
+        t = 1.7e9 + np.arange(n) * .005
+        az = (180 + 5 * np.sin(np.arange(n) * .003)) * DEG
+        el = np.full(n, 50 * DEG)
+        sight = so3g.proj.CelestialSightLine.naive_az_el(t, az, el)
+        xi, eta = np.random.uniform(-.5, .5, size=(2, ndet)) * DEG
+        gamma = np.random.uniform(0, np.pi, ndet)
+        fp = so3g.proj.quat.rotation_xieta(xi, eta, gamma)
+        ra, dec = sight.coords()[:, :2].T
+        geom = enmap.geometry(pos=[[dec.min() - DEG, ra.max() + 3 * DEG],
+                                   [dec.max() + DEG, ra.min() - 3 * DEG]],
+                              res=.05 * DEG, proj='car')
+
+        budget = coords.pmat.PRECOMP_BUDGET
+        max_bytes0 = budget.max_bytes
+        try:
+            for comps, max_bytes in [('T', None), ('QU', None), ('TQU', 0)]:
+                budget.max_bytes = max_bytes
+                p0 = coords.pmat.P(sight=sight, fp=fp, geom=geom, comps=comps)
+                p1 = coords.pmat.P(sight=sight, fp=fp, geom=geom, comps=comps,
+                                   precompute=True)
+                m = p0.zeros()
+                m[:] = np.random.normal(size=m.shape)
+                tod0 = p0.from_map(m)
+                tod1 = p1.from_map(m)
+                self.assertTrue(np.all(tod0 != 0))
+                np.testing.assert_allclose(tod0, tod1, atol=1e-5)
+                np.testing.assert_allclose(p0.to_map(signal=tod0),
+                                           p1.to_map(signal=tod0), atol=1e-3)
+                np.testing.assert_allclose(p0.to_weights(), p1.to_weights(),
+                                           atol=1e-3)
+                self.assertEqual(isinstance(p1._precomp.pixels, np.memmap),
+                                 max_bytes is not None)
+                # An equal comps string is enough to reuse the cache.
+                precomp = p1._precomp
+                self.assertIs(p1._get_precomp(''.join(list(comps))), precomp)
+        finally:
+            budget.max_bytes = max_bytes0
+
+
 class CoordsUtilsTest(unittest.TestCase):
     def test_valid_arg(self):
         from sotodlib.coords.helpers import _valid_arg
@@ -1,12 +1,15 @@
 import unittest
+from unittest import mock
 import tempfile
 import os
 import shutil
 
+import h5py
 import numpy as np
 import astropy.units as u
 from sotodlib import core
 import sotodlib.core.axisman_util as amutil
+from sotodlib.core import axisman_io
 import so3g
 
 ## "temporary" fix to deal with scipy>1.8 changing the sparse setup
@@ -456,6 +459,112 @@ class TestAxisManager(unittest.TestCase):
                 self.assertCountEqual(target['subaman']._fields.keys(),
                                       subkeys)
 
+    def test_501_io_restrict(self):
+        # Test restricted and lazy load from HDF5.
+        dets = ['det%i' % i for i in range(6)]
+        n = 1000
+        aman = core.AxisManager(
+            core.LabelAxis('dets', dets),
+            core.OffsetAxis('samps', n, 100))
+        aman.wrap('sig', np.random.normal(size=(6, n)).astype('float32'),
+                  [(0, 'dets'), (1, 'samps')])
+        aman.wrap('names', np.array(dets), [(0, 'dets')])
+        mask = np.random.uniform(size=(6, n)) > 0.9
+        aman.wrap('flag', so3g.proj.RangesMatrix.from_mask(mask),
+                  [(0, 'dets'), (1, 'samps')])
+        aman.wrap('flags', core.FlagManager.for_tod(aman, 'dets', 'samps'))
+        aman.flags.wrap_dets_samps(
+            'glitch', so3g.proj.RangesMatrix.from_mask(mask[::-1]))
+
+        restrict = {'dets': ['det4', 'det1', 'det2'], 'samps': (300, 700)}
+        with tempfile.TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, 'test.h5')
+            aman.save(filename, 'x')
+            ref = aman.copy()
+            for k, v in restrict.items():
+                ref.restrict(k, v)
+            for kw in [{}, {'lazy': True}]:
+                aman2 = aman.load(filename, 'x', restrict=restrict, **kw)
+                self.assertEqual(list(aman2.dets.vals), restrict['dets'])
+                self.assertEqual(aman2.samps.offset, 300)
+                self.assertEqual(aman2.samps.count, 400)
+                np.testing.assert_array_equal(aman2.sig, ref.sig)
+                np.testing.assert_array_equal(aman2.names, ref.names)
+                np.testing.assert_array_equal(aman2.flag.mask(),
+                                              ref.flag.mask())
+                np.testing.assert_array_equal(aman2.flags.glitch.mask(),
+                                              ref.flags.glitch.mask())
+
+            # Lazy fields stay deferred through restrict.
+            aman2 = aman.load(filename, 'x', lazy=True)
+            aman2.restrict('dets', ['det5', 'det0'])
+            self.assertIsInstance(aman2._fields['sig'], core.axisman.DeferredField)
+            self.assertEqual(aman2.sig.shape, (2, n))
+            np.testing.assert_array_equal(aman2.sig, aman.sig[[5, 0]])
+
+            # The file is not held open by deferred fields, so it may
+            # be reopened for writing.
+            aman2 = aman.load(filename, 'x', lazy=True)
+            aman3 = aman.load(filename, 'x', lazy=True,
+                              restrict={'samps': (200, 300)})
+            with h5py.File(filename, 'r+') as h:
+                pass
+            np.testing.assert_array_equal(aman2.sig, aman.sig)
+            np.testing.assert_array_equal(aman3.sig, aman.sig[:, 100:200])
+            # An open h5py object is used as is.
+            with h5py.File(filename, 'r') as h:
+                aman2 = aman.load(h['x'], lazy=True)
+                np.testing.assert_array_equal(aman2.sig, aman.sig)
+
+            # A plain load opens the file just once.
+            with mock.patch.object(axisman_io.h5py, 'File',
+                                   wraps=h5py.File) as h5file:
+                aman.load(filename, 'x')
+                self.assertEqual(h5file.call_count, 1)
+
+    def test_502_io_write_options(self):
+        # Test chunked / filtered / background save.
+        dets = ['det%i' % i for i in range(20)]
+        n = 10000
+        aman = core.AxisManager(
+            core.LabelAxis('dets', dets),
+            core.OffsetAxis('samps', n))
+        aman.wrap('signal', np.random.normal(size=(20, n)).astype('float32'),
+                  [(0, 'dets'), (1, 'samps')])
+        mask = np.random.uniform(size=(20, n)) > 0.99
+        aman.wrap('flags', core.FlagManager.for_tod(aman, 'dets', 'samps'))
+        aman.flags.wrap_dets_samps(
+            'glitch', so3g.proj.RangesMatrix.from_mask(mask))
+
+        # Multi-dimensional RangesMatrix flattening.
+        rm = so3g.proj.RangesMatrix([aman.flags.glitch[:5],
+                                     aman.flags.glitch[5:10]])
+        flat = axisman_io.flatten_RangesMatrix(rm)
+        np.testing.assert_array_equal(
+            axisman_io.expand_RangesMatrix(flat).mask(), rm.mask())
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, 'test.h5')
+            aman.save(filename, 'a', chunks=True,
+                      compression='gzip',
+                      field_compression={
+                          'signal': {'compression': 'lzf', 'shuffle': True}})
+            with h5py.File(filename, 'r') as h:
+                self.assertEqual(h['a/signal'].compression, 'lzf')
+                self.assertEqual(h['a/signal'].chunks[1], n)
+                self.assertEqual(h['a/flags/glitch/intervals'].compression,
+                                 'gzip')
+            future = aman.save(filename, 'b', background=True)
+            future.result()
+            for group in ['a', 'b']:
+                aman2 = aman.load(filename, group)
+                np.testing.assert_array_equal(aman2.signal, aman.signal)
+                np.testing.assert_array_equal(aman2.flags.glitch.mask(), mask)
+            # Errors are raised through the future.
+            future = aman.save(filename, 'b', background=True)
+            with self.assertRaises(RuntimeError):
+                future.result()
+
     def test_900_everything(self):
         tod = core.AxisManager(
             core.LabelAxis('dets', list('abcdef')),
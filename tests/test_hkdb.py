@@ -0,0 +1,147 @@
+import unittest
+import os
+import tempfile
+
+import numpy as np
+import so3g
+from spt3g import core
+
+from sotodlib.io import hkdb
+
+from ._helpers import mpi_multi
+
+
+T0 = 1.7e9
+
+
+def write_hk_file(filename, t0, n_frames=6, frame_len=100):
+    # One feed with two fields, sampled at 1 Hz.
+    session = so3g.hk.HKSessionHelper(session_id=1, start_time=t0,
+                                      hkagg_version=2)
+    writer = core.G3Writer(filename)
+    writer.Process(session.session_frame())
+    prov_id = session.add_provider('observatory.agent1.feeds.feed1')
+    writer.Process(session.status_frame())
+    for i in range(n_frames):
+        t = t0 + i * frame_len + np.arange(frame_len)
+        frame = session.data_frame(prov_id)
+        frame['address'] = 'observatory.agent1.feeds.feed1'
+        block = core.G3TimesampleMap()
+        block.times = core.G3VectorTime(
+            [core.G3Time(_t * core.G3Units.s) for _t in t])
+        block['x'] = core.G3VectorDouble(t - T0)
+        block['y'] = core.G3VectorDouble(2 * (t - T0))
+        frame['block_names'].append('b')
+        frame['blocks'].append(block)
+        writer.Process(frame)
+    writer.Process(core.G3Frame(core.G3FrameType.EndProcessing))
+
+
+@unittest.skipIf(mpi_multi(), "Running with multiple MPI processes")
+class TestHkDb(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+        root = self.tempdir.name
+        os.makedirs(os.path.join(root, 'hk', '17000'))
+        for i in range(2):
+            write_hk_file(os.path.join(root, 'hk', '17000', f'{i}.g3'),
+                          T0 + i * 600)
+        self.cfg = hkdb.HkConfig(
+            hk_root=os.path.join(root, 'hk'),
+            db_file=os.path.join(root, 'hk.db'),
+            show_index_pb=False)
+        hkdb.update_index_all(self.cfg)
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_update_index(self):
+        hkdb_ = hkdb.HkDb(self.cfg)
+        with hkdb_.Session() as sess:
+            frames = sess.query(hkdb.HkFrame).order_by(hkdb.HkFrame.start_time).all()
+            self.assertEqual(len(frames), 12)
+            self.assertEqual(frames[0].start_time, T0)
+            self.assertEqual(frames[-1].end_time, T0 + 1199)
+
+        # Extend a file, as happens to the one being written; only the
+        # new frames are added.  Also check the parallel indexer.
+        self.cfg.index_nproc = 2
+        write_hk_file(os.path.join(self.cfg.hk_root, '17000', '1.g3'),
+                      T0 + 600, n_frames=9)
+        os.utime(os.path.join(self.cfg.hk_root, '17000', '1.g3'),
+                 (T0 + 2000, T0 + 2000))
+        hkdb.update_index_all(self.cfg)
+        with hkdb_.Session() as sess:
+            frames = sess.query(hkdb.HkFrame).order_by(hkdb.HkFrame.start_time).all()
+            self.assertEqual(len(frames), 15)
+            self.assertEqual([f.start_time - T0 for f in frames],
+                             list(range(0, 1500, 100)))
+            files = sess.query(hkdb.HkFile).order_by(hkdb.HkFile.path).all()
+            self.assertEqual([f.index_status for f in files], ['indexed'] * 2)
+            self.assertEqual(files[1].start_time, T0 + 600)
+            self.assertEqual(files[1].end_time, T0 + 1499)
+
+    def test_load_hk(self):
+        start, end = T0 + 150, T0 + 1050
+        expected = np.arange(150, 1051)
+
+        spec = hkdb.LoadSpec(cfg=self.cfg, fields=['agent1.feed1.*'],
+                             start=start, end=end)
+        result = hkdb.load_hk(spec)
+        ts, x = result.data['agent1.feed1.x']
+        np.testing.assert_array_equal(x, expected)
+        np.testing.assert_array_equal(ts - T0, expected)
+        self.assertIn('agent1.feed1.y', result.data)
+
+        # Parallel decoding.
+        spec.nproc = 2
+        ts, x = hkdb.load_hk(spec).data['agent1.feed1.x']
+        np.testing.assert_array_equal(x, expected)
+
+        # Block-averaged decimation.
+        spec.downsample_factor = 10
+        spec.downsample_mode = 'mean'
+        ts, x = hkdb.load_hk(spec).data['agent1.feed1.x']
+        self.assertEqual(len(x), 91)
+        np.testing.assert_allclose(x[:-1], expected[:900].reshape(-1, 10).mean(axis=1))
+        np.testing.assert_allclose(ts - T0, x)
+        with self.assertRaises(ValueError):
+            hkdb.LoadSpec(cfg=self.cfg, fields=['agent1.feed1.x'],
+                          start=start, end=end, downsample_mode='median')
+
+    def test_load_hk_cache(self):
+        self.cfg.cache_dir = os.path.join(self.tempdir.name, 'cache')
+        self.cfg.cache_chunk_len = 200.
+        start, end = T0 + 150, T0 + 1050
+        spec = hkdb.LoadSpec(cfg=self.cfg, fields=['agent1.feed1.x'],
+                             start=start, end=end)
+        for i in range(2):
+            result = hkdb.load_hk(spec)
+            ts, x = result.data['agent1.feed1.x']
+            np.testing.assert_array_equal(x, np.arange(150, 1051))
+            np.testing.assert_array_equal(ts - T0, x)
+            # The last chunk reaches beyond the indexed data, so it is
+            # not cached.
+            chunks = sorted(os.listdir(os.path.join(
+                self.cfg.cache_dir, 'agent1', 'feed1')))
+            self.assertEqual(chunks, ['%i' % (T0 + 200 * k)
+                                      for k in range(5)])
+
+        # Chunks filled by the query above must be complete, for a
+        # query that starts earlier.
+        spec = hkdb.LoadSpec(cfg=self.cfg, fields=['agent1.feed1.x'],
+                             start=T0, end=T0 + 500)
+        ts, x = hkdb.load_hk(spec).data['agent1.feed1.x']
+        np.testing.assert_array_equal(x, np.arange(0, 501))
+        np.testing.assert_array_equal(ts - T0, x)
+
+        # All fields of a feed are cached.
+        spec = hkdb.LoadSpec(cfg=self.cfg, fields=['agent1.feed1.y'],
+                             start=start, end=end)
+        ts, y = hkdb.load_hk(spec).data['agent1.feed1.y']
+        np.testing.assert_array_equal(y, 2 * np.arange(150, 1051))
+
+
+if __name__ == '__main__':
+    unittest.main()
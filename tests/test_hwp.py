@@ -7,6 +7,7 @@
 
 import unittest
 import numpy as np
+import so3g
 
 from sotodlib import core
 from sotodlib.hwp import hwp
@@ -98,11 +99,71 @@ class HwpssTest(unittest.TestCase):
         # to not change that even though it looks wrong.
         self.assertFalse(False in np.isfinite(tod.hwpss_stats.covars))
 
+    def test_batched_fit(self):
+        tod = make_fake_tod(input_coeffs=INPUT_COEFFS)
+        tod.signal += np.random.normal(size=tod.signal.shape)
+        modes = [1, 2, 3, 4, 5, 6, 7, 8]
+        yerrs = np.array([1., 2.])
+        # Agrees with curve_fit.
+        x, ys = tod.hwp_angle[:2000], tod.signal[:, :2000]
+        ref = hwp.hwpss_curvefit(x, ys, yerrs, modes)
+        out = hwp.hwpss_batched_fit(x, ys, yerrs, modes, chunk_size=300)
+        for a, b in zip(ref, out):
+            np.testing.assert_allclose(b, a, rtol=1e-4, atol=1e-6)
+        # The closed-form solve is done in double precision throughout.
+        basis = np.concatenate([[np.sin(m * x), np.cos(m * x)] for m in modes])
+        for i, y in enumerate(ys):
+            lstsq = np.linalg.lstsq(basis.T, y.astype(float), rcond=None)[0]
+            np.testing.assert_allclose(out[1][i], lstsq, rtol=1e-9, atol=1e-9)
+        # Per-detector masks.
+        mask = np.random.uniform(size=tod.signal.shape) > 0.8
+        flags = so3g.proj.RangesMatrix.from_mask(mask)
+        out = hwp.hwpss_batched_fit(tod.hwp_angle, tod.signal, yerrs, modes,
+                                    flags=flags)
+        for i in range(tod.dets.count):
+            m = ~mask[i]
+            ref = hwp.hwpss_linreg(tod.hwp_angle[m], tod.signal[i:i+1, m],
+                                   yerrs[i:i+1], modes)
+            np.testing.assert_allclose(out[1][i], ref[1][0], rtol=1e-4)
+            np.testing.assert_allclose(out[3][i], ref[3][0], rtol=1e-4)
+
+    def test_linregnobin_flags(self):
+        tod = make_fake_tod(input_coeffs=INPUT_COEFFS)
+        mask = np.random.uniform(size=tod.signal.shape) > 0.9
+        flags = so3g.proj.RangesMatrix.from_mask(mask)
+        tod.signal[mask] = 1e3
+        _ = hwp.get_hwpss(tod, lin_reg=True, bin_signal=False, flags=flags,
+                          apply_prefilt=False)
+        ommax = get_coeff_metric(tod)
+        self.assertTrue(ommax < 0.1)
+
     def test_fitnobin(self):
         lr, bn = False, False
         tod = make_fake_tod(input_coeffs=INPUT_COEFFS)
         with self.assertRaises(ValueError):
             _ = hwp.get_hwpss(tod, lin_reg=lr, bin_signal=bn, modes=[2, 4])
 
+
+class DemodTest(unittest.TestCase):
+    "Test the HWP demodulation engines"
+    def test_fused(self):
+        tod = make_fake_tod(input_coeffs=INPUT_COEFFS)
+        tod.signal += np.random.normal(size=tod.signal.shape)
+        tod_fused = tod.copy()
+        hwp.demod_tod(tod)
+        hwp.demod_tod(tod_fused, fused=True, det_chunk=1)
+        for k in ['dsT', 'demodQ', 'demodU']:
+            np.testing.assert_allclose(tod_fused[k], tod[k], atol=1e-5)
+
+        decim = hwp.demod_tod(tod_fused, fused=True, decimate=10)
+        self.assertEqual(decim.samps.count, (tod.samps.count + 9) // 10)
+        np.testing.assert_allclose(decim.timestamps, tod.timestamps[::10])
+        for k in ['dsT', 'demodQ', 'demodU']:
+            np.testing.assert_allclose(decim[k], tod[k][:, ::10], atol=1e-5)
+
+        with self.assertRaises(ValueError):
+            hwp.demod_tod(tod, decimate=10)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,76 @@
+import unittest
+import os
+import tempfile
+
+import so3g
+from spt3g import core
+
+from sotodlib.io import check_book, load_book, load_smurf
+
+from ._helpers import mpi_multi
+
+
+def write_book_file(filename, n_frames=5, frame_len=10):
+    # A status frame, followed by Scan frames with ancil timestamps.
+    writer = core.G3Writer(filename)
+    frame = core.G3Frame(core.G3FrameType.Wiring)
+    frame['dump'] = True
+    frame['status'] = '{}'
+    frame['time'] = core.G3Time(1.7e9 * core.G3Units.s)
+    frame['sostream_id'] = 'stream0'
+    frame['session_id'] = 1
+    writer.Process(frame)
+    for i in range(n_frames):
+        frame = core.G3Frame(core.G3FrameType.Scan)
+        ancil = core.G3TimesampleMap()
+        ancil.times = core.G3VectorTime(
+            [core.G3Time((1.7e9 + j) * core.G3Units.s)
+             for j in range(i * frame_len, (i + 1) * frame_len)])
+        frame['ancil'] = ancil
+        writer.Process(frame)
+    writer.Process(core.G3Frame(core.G3FrameType.EndProcessing))
+
+
+@unittest.skipIf(mpi_multi(), "Running with multiple MPI processes")
+class TestLoadBook(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def test_frames_iterator_indexed(self):
+        filename = os.path.join(self.tempdir.name, 'D_stream0_000.g3')
+        write_book_file(filename)
+
+        # Build the frame index as BookScanner does.
+        index = []
+        offset = 0
+        for i, (byte_offset, frame) in enumerate(check_book._iter_frames(filename)):
+            row = (i, byte_offset, str(frame.type), None, None)
+            if frame.type == core.G3FrameType.Scan:
+                n = len(frame['ancil'].times)
+                row = row[:3] + (offset, offset + n)
+                offset += n
+            index.append(row)
+        self.assertEqual([r[2] for r in index], ['Wiring'] + ['Scan'] * 5)
+
+        files = [(filename, 0, 50)]
+        for samples in [[0, 50], [25, 38], [30, 31], [45, 50]]:
+            results = []
+            for frame_offsets in [None, {filename: index}]:
+                smurf_proc = load_smurf.SmurfStatus._get_frame_processor()
+                offsets = [offset for frame, offset in load_book._frames_iterator(
+                    files, '', samples, smurf_proc=smurf_proc,
+                    frame_offsets=frame_offsets)]
+                self.assertEqual(smurf_proc.get_status().stream_id, 'stream0')
+                results.append(offsets)
+            # Only the overlapping frames are read with the index.
+            self.assertEqual(
+                results[1], [o for o in results[0]
+                             if o + 10 > samples[0] and o < samples[1]])
+
+
+if __name__ == '__main__':
+    unittest.main()
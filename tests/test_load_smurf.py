@@ -0,0 +1,178 @@
+import unittest
+import os
+import json
+import tempfile
+
+import numpy as np
+import so3g
+from spt3g import core
+
+from sotodlib.io import load_smurf
+from sotodlib.io.g3tsmurf_db import Files
+
+from ._helpers import mpi_multi
+
+
+NCHANS = 5
+NSAMPS = 40
+
+
+def write_smurf_file(filename, t0, nframes=3, nsamps=NSAMPS, seed=0,
+                     super_timestream=True):
+    """Write a small SMuRF file, with a status frame and data in a
+    G3SuperTimestream (or, for old files, a G3TimestreamMap).  Returns
+    the data, as a (nchans, nframes*nsamps) array.
+
+    """
+    rng = np.random.default_rng(seed)
+    writer = core.G3Writer(filename)
+    frame = core.G3Frame(core.G3FrameType.Wiring)
+    frame['status'] = json.dumps({
+        'AMCc.SmurfProcessor.ChannelMapper.NumChannels': NCHANS,
+        'AMCc.SmurfProcessor.ChannelMapper.Mask': str(list(range(NCHANS))),
+        'AMCc.SmurfProcessor.Filter.A': '[1.0, 0.0]',
+        'AMCc.SmurfProcessor.Filter.B': '[1.0, 0.0]',
+        'AMCc.SmurfProcessor.Filter.Gain': 1.0,
+        'AMCc.SmurfProcessor.Filter.Order': 1,
+        'AMCc.FpgaTopLevel.AppTop.AppCore.RtmCryoDet.RampMaxCnt': 30719,
+    })
+    frame['dump'] = 1
+    frame['time'] = core.G3Time(t0 * core.G3Units.s)
+    frame['sostream_id'] = 'test'
+    frame['session_id'] = 1
+    writer.Process(frame)
+    names = ['r%04i' % c for c in range(NCHANS)]
+    data = []
+    for i in range(nframes):
+        t = t0 + (i * nsamps + np.arange(nsamps)) / 200.
+        d = rng.integers(-2**20, 2**20, size=(NCHANS, nsamps)).astype('int32')
+        data.append(d)
+        frame = core.G3Frame(core.G3FrameType.Scan)
+        frame['time'] = core.G3Time(t[0] * core.G3Units.s)
+        if super_timestream:
+            ts = so3g.G3SuperTimestream()
+            ts.names = names
+            ts.times = core.G3VectorTime(
+                [core.G3Time(_t * core.G3Units.s) for _t in t])
+            ts.data = d
+            frame['data'] = ts
+            frame['sostream_version'] = 2
+        else:
+            tsm = core.G3TimestreamMap()
+            for name, row in zip(names, d):
+                _ts = core.G3Timestream(row.astype(float))
+                _ts.start = core.G3Time(t[0] * core.G3Units.s)
+                _ts.stop = core.G3Time(t[-1] * core.G3Units.s)
+                tsm[name] = _ts
+            frame['data'] = tsm
+            frame['sostream_version'] = 1
+        writer.Process(frame)
+    writer.Process(core.G3Frame(core.G3FrameType.EndProcessing))
+    return np.hstack(data)
+
+
+@unittest.skipIf(mpi_multi(), "Running with multiple MPI processes")
+class TestLoadFile(unittest.TestCase):
+
+    def setUp(self):
+        self.tempdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tempdir.cleanup()
+
+    def _write(self, super_timestream=True, nframes=[3, 2, 3]):
+        filenames, data = [], []
+        for i, n in enumerate(nframes):
+            filename = os.path.join(self.tempdir.name, '1700000000_%03i.g3' % i)
+            data.append(write_smurf_file(
+                filename, 1.7e9 + 10 * i, nframes=n, seed=i,
+                super_timestream=super_timestream))
+            filenames.append(filename)
+        return filenames, np.hstack(data) * np.pi / 2**15
+
+    def _archive(self, filenames, sample_counts=None):
+        # Index the files, and set the sample ranges as observation
+        # building would (unless sample_counts is None).
+        archive = load_smurf.G3tSmurf(
+            self.tempdir.name, db_path=os.path.join(self.tempdir.name, 'g3t.db'),
+            make_db=True)
+        archive.index_archive(show_pb=False)
+        if sample_counts is None:
+            return archive
+        session = archive.Session()
+        start = 0
+        for filename, n in zip(filenames, sample_counts):
+            db_file = session.query(Files).filter(Files.name == filename).one()
+            db_file.sample_start, db_file.sample_stop = start, start + n
+            start += n
+        session.commit()
+        return archive
+
+    def _check(self, super_timestream):
+        filenames, data = self._write(super_timestream=super_timestream)
+        counts = [3 * NSAMPS, 2 * NSAMPS, 3 * NSAMPS]
+        archive = self._archive(filenames, counts)
+        kw = dict(show_pb=False, merge_det_info=False, load_primary=False,
+                  load_biases=False)
+
+        # No sample counts up front: the accumulating path.
+        ref = load_smurf.load_file(filenames, **kw)
+        np.testing.assert_allclose(ref.signal, data, rtol=1e-6)
+
+        for samples in [None, (0, sum(counts)), (30, 250), (130, 190),
+                        (119, 121), (200, None)]:
+            sl = slice(None) if samples is None else slice(*samples)
+            for archive_ in [archive, None]:
+                if samples is None and archive_ is None:
+                    continue
+                aman = load_smurf.load_file(filenames, samples=samples,
+                                            archive=archive_, **kw)
+                # Calibration before decompression can differ in the
+                # last bit.
+                np.testing.assert_allclose(aman.signal, ref.signal[:, sl],
+                                           rtol=1e-6, atol=1e-5)
+                np.testing.assert_array_equal(aman.timestamps,
+                                              ref.timestamps[sl])
+
+        # Channel subsets, in a different order.
+        ref = load_smurf.load_file(filenames, channels=[4, 1], **kw)
+        aman = load_smurf.load_file(filenames, channels=[4, 1],
+                                    samples=(30, 250), archive=archive, **kw)
+        self.assertEqual(list(aman.dets.vals), list(ref.dets.vals))
+        np.testing.assert_allclose(aman.signal, ref.signal[:, 30:250],
+                                   rtol=1e-6, atol=1e-5)
+
+    def test_load_file(self):
+        self._check(super_timestream=True)
+
+    def test_load_file_timestream_map(self):
+        self._check(super_timestream=False)
+
+    def test_load_file_unbuilt(self):
+        # Files that are indexed, but not yet built into an observation,
+        # have no sample ranges.
+        filenames, data = self._write()
+        archive = self._archive(filenames)
+        self.assertEqual(archive.lookup_file(filenames[0])['sample_range'],
+                         (None, None))
+        aman = load_smurf.load_file(filenames, archive=archive,
+                                    show_pb=False, merge_det_info=False,
+                                    load_primary=False, load_biases=False)
+        self.assertEqual(aman.signal.shape, data.shape)
+        np.testing.assert_allclose(aman.signal, data, rtol=1e-6)
+
+    def test_load_file_short(self):
+        # If the archive sample counts are wrong, the data are still
+        # loaded without gaps.
+        filenames, data = self._write()
+        archive = self._archive(filenames, [3 * NSAMPS, 2 * NSAMPS + 10,
+                                            3 * NSAMPS])
+        aman = load_smurf.load_file(filenames, archive=archive,
+                                    show_pb=False, merge_det_info=False,
+                                    load_primary=False, load_biases=False)
+        self.assertEqual(aman.signal.shape, data.shape)
+        np.testing.assert_allclose(aman.signal, data, rtol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
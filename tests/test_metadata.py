@@ -15,6 +15,7 @@ from sotodlib.io.metadata import ResultSetHdfLoader, write_dataset, _decode_arra
 
 import os
 import h5py
+import numpy as np
 import sqlite3
 
 from ._helpers import mpi_multi
@@ -76,6 +77,76 @@ class MetadataTest(unittest.TestCase):
         data = loader.from_loadspec(req)
         self.assertEqual(list(data['timeconst']), [TGOOD])
 
+    def test_002_resultset_columnar(self):
+        """Test that columnar ResultSet operations agree with row-based
+        ones.
+
+        """
+        rows = [('det%02i' % (i % 7), ['f090', 'f150'][i % 2], i % 3, 0.5 * i)
+                for i in range(20)]
+        keys = ['name', 'band', 'idx', 'val']
+        rs_row = metadata.ResultSet(keys, rows)
+        rs_col = metadata.ResultSet.from_friend(rs_row.asarray())
+        self.assertIsNone(rs_col._rows)
+        for rs in [rs_row, rs_col]:
+            self.assertEqual(len(rs), 20)
+            self.assertEqual(rs[3], rs_row[3])
+            self.assertEqual(list(rs), list(rs_row))
+            self.assertEqual(list(rs['val']), [r[3] for r in rows])
+
+            # Subset by keys, integer rows and boolean mask.
+            sub = rs.subset(keys=['band', 'idx'], rows=[4, 1, 4])
+            self.assertEqual(sub.rows, [(r[1], r[2]) for r in
+                                        [rows[4], rows[1], rows[4]]])
+            mask = rs['idx'] == 1
+            sub = rs.subset(rows=mask)
+            self.assertEqual(sub.rows, [r for r in rows if r[2] == 1])
+
+            # Distinct rows come back sorted.
+            dist = rs.subset(keys=['band', 'idx']).distinct()
+            self.assertEqual(dist.rows, sorted(set([(r[1], r[2]) for r in rows])))
+
+            # Slicing, concatenation and merge.
+            cat = metadata.ResultSet.concatenate([rs[::2], rs[1::2], rs[:0]])
+            self.assertEqual(cat.rows, rows[::2] + rows[1::2])
+            rs2 = rs.subset(keys=['name', 'band'])
+            rs2.merge(metadata.ResultSet(['x'], [(i,) for i in range(20)]))
+            self.assertEqual(rs2.keys, ['name', 'band', 'x'])
+            self.assertEqual(rs2[19], {'name': 'det05', 'band': 'f150', 'x': 19})
+
+        # Accessing rows converts to row storage, and edits stick.
+        rs_col.rows.pop(0)
+        self.assertEqual(len(rs_col), 19)
+        self.assertEqual(rs_col['name'][0], 'det01')
+
+        # Vectorized multi-column matching.
+        i0 = metadata.loader._get_row_index(
+            rs_row[:5], rs_col, ['name', 'band'])
+        short = [r[:2] for r in rows[:5]]
+        np.testing.assert_array_equal(
+            i0, [short.index(r[:2]) if r[:2] in short else -1
+                 for r in rows[1:]])
+
+    def test_003_resultset_mixed_types(self):
+        """Test that values in mixed-type columns are not coerced."""
+        rows = [('x', 1, None), (1, 2.5, 'a'), (None, 3, 4.)]
+        rs = metadata.ResultSet(['a', 'b', 'c'], rows)
+        self.assertEqual(rs.subset(keys=['a', 'b']).rows,
+                         [r[:2] for r in rows])
+        self.assertEqual(rs.subset(rows=[2, 0]).rows, [rows[2], rows[0]])
+        cat = metadata.ResultSet.concatenate([rs, rs[:1]])
+        self.assertEqual(cat.rows, rows + rows[:1])
+        for a, b in zip(cat.rows, rows + rows[:1]):
+            self.assertEqual(list(map(type, a)), list(map(type, b)))
+        rs2 = rs.subset(keys=['a'])
+        rs2.merge(rs.subset(keys=['b', 'c']))
+        self.assertEqual(rs2.rows, rows)
+        # Concatenating int and float columns keeps the ints.
+        cat = metadata.ResultSet.concatenate([
+            metadata.ResultSet(['x'], [(1,)]).subset(),
+            metadata.ResultSet(['x'], [(2.5,)]).subset()])
+        self.assertEqual([type(r[0]) for r in cat.rows], [int, float])
+
     def test_010_manifest_basics(self):
         """Test that you can create a ManifestScheme and ManifestDb and add
         records but not duplicates unless you need to.
@@ -271,6 +342,83 @@ class MetadataTest(unittest.TestCase):
         c = mandb.conn.execute('select count(id) from files where name="x"')
         self.assertEqual(1, c.fetchone()[0])
 
+    def test_040_match_many(self):
+        """Test that ManifestDb.match_many agrees with match.
+
+        """
+        scheme = metadata.ManifestScheme() \
+                         .add_range_match('obs:timestamp') \
+                         .add_exact_match('wafer') \
+                         .add_data_field('dataset')
+        mandb = metadata.ManifestDb(scheme=scheme)
+        for i in range(5):
+            for wafer in ['A', 'B']:
+                mandb.add_entry({'wafer': wafer,
+                                 'obs:timestamp': (i * 100, (i + 1) * 100),
+                                 'dataset': f'{wafer}{i}'},
+                                filename=f'f{i % 2}.h5')
+        mandb.add_entry({'wafer': 'A', 'obs:timestamp': (150, 250),
+                         'dataset': 'overlap'}, filename='g.h5')
+
+        params_list = [{'wafer': w, 'obs:timestamp': t}
+                       for t in [-50, 50, 120, 220, 499, 500]
+                       for w in ['A', 'B', 'C']]
+        results = mandb.match_many(params_list, prefix='/x')
+        self.assertEqual(len(results), len(params_list))
+        key = lambda row: row['dataset']
+        for params, rows in zip(params_list, results):
+            self.assertEqual(
+                sorted(rows, key=key),
+                sorted(mandb.match(params, multi=True, prefix='/x'), key=key))
+        self.assertEqual(len(results[9]), 2)
+        self.assertEqual(mandb.match_many([]), [])
+        with self.assertRaises(ValueError):
+            mandb.match_many([{'wafer': 'A'}])
+
+    def test_050_manifest_indexes(self):
+        """Test that ManifestDb indexes the map on each input field, and
+        that readonly / in-memory copies work.
+
+        """
+        scheme = metadata.ManifestScheme() \
+                         .add_range_match('obs:timestamp') \
+                         .add_exact_match('wafer') \
+                         .add_data_field('dataset')
+        self.assertEqual(sorted(scheme._get_index_defs().keys()),
+                         ['files_name', 'map_wafer'])
+        with tempfile.TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, 'db.sqlite')
+            mandb = metadata.ManifestDb(filename, scheme=scheme)
+            for i in range(5):
+                mandb.add_entry({'wafer': 'A', 'dataset': f'A{i}',
+                                 'obs:timestamp': (i * 100, (i + 1) * 100)},
+                                filename='a.h5')
+            plan = ' '.join([r[-1] for r in mandb.conn.execute(
+                'explain query plan select id from map where wafer=?',
+                ('A',))])
+            self.assertIn('map_wafer', plan)
+            # Opening an existing db does not add indexes to it ...
+            mandb.conn.execute('drop index map_wafer')
+            mandb.conn.commit()
+            mandb.conn.close()
+            mandb = metadata.ManifestDb(filename)
+            self.assertFalse(mandb.conn.in_transaction)
+            self.assertEqual(mandb.conn.execute(
+                'select count(*) from sqlite_master where name="map_wafer"'
+            ).fetchone()[0], 0)
+            # ... unless asked to.
+            self.assertIn('map_wafer', mandb.create_indexes())
+            mandb.conn.close()
+
+            for in_memory in [False, True]:
+                db = metadata.ManifestDb.readonly(filename, in_memory=in_memory)
+                self.assertEqual(
+                    db.match({'wafer': 'A', 'obs:timestamp': 250})['dataset'],
+                    'A2')
+                with self.assertRaises(sqlite3.OperationalError):
+                    db.add_entry({'wafer': 'B', 'dataset': 'B0',
+                                  'obs:timestamp': (0, 100)}, filename='b.h5')
+
 
 if __name__ == '__main__':
     unittest.main()
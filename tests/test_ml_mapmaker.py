@@ -0,0 +1,112 @@
+# Copyright (c) 2025 Simons Observatory.
+# Full license can be found in the top level "LICENSE" file.
+
+"""Check MLMapmaker threading and CG checkpointing on a small synthetic
+data set.
+
+"""
+
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import so3g
+from pixell import enmap
+
+from sotodlib import core, mapmaking
+
+from ._helpers import mpi_multi
+
+DEG = np.pi / 180
+
+
+def make_obs(seed, nsamp, ndet=10):
+    rng = np.random.default_rng(seed)
+    dets = core.LabelAxis('dets', ['d%02i' % k for k in range(ndet)])
+    samps = core.OffsetAxis('samps', nsamp)
+    obs = core.AxisManager(dets, samps)
+    obs.wrap('timestamps', 1.7e9 + seed * 1000 + np.arange(nsamp) * 0.005,
+             [(0, 'samps')])
+    obs.wrap('signal', rng.normal(size=(ndet, nsamp)).astype('float32'),
+             [(0, 'dets'), (1, 'samps')])
+    bs = core.AxisManager(samps)
+    bs.wrap('az', (180 + 5 * np.sin(np.arange(nsamp) * 0.003 + seed)) * DEG,
+            [(0, 'samps')])
+    bs.wrap('el', np.full(nsamp, 50 * DEG), [(0, 'samps')])
+    bs.wrap('roll', np.zeros(nsamp), [(0, 'samps')])
+    obs.wrap('boresight', bs)
+    fp = core.AxisManager(dets)
+    fp.wrap('xi', rng.uniform(-.5, .5, ndet) * DEG, [(0, 'dets')])
+    fp.wrap('eta', rng.uniform(-.5, .5, ndet) * DEG, [(0, 'dets')])
+    fp.wrap('gamma', rng.uniform(0, np.pi, ndet), [(0, 'dets')])
+    obs.wrap('focal_plane', fp)
+    flags = core.AxisManager(dets, samps)
+    flags.wrap('glitch_flags', so3g.proj.RangesMatrix.from_mask(
+        rng.uniform(size=(ndet, nsamp)) < 0.002), [(0, 'dets'), (1, 'samps')])
+    obs.wrap('flags', flags)
+    obs.wrap('site', np.array(['so']))
+    obs.wrap('weather', np.array(['typical']))
+    return obs
+
+
+@unittest.skipIf(mpi_multi(), "Running with multiple MPI processes")
+class MLMapmakerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.shape, self.wcs = enmap.geometry(
+            pos=[[-70 * DEG, -10 * DEG], [-50 * DEG, -70 * DEG]],
+            res=0.2 * DEG, proj='car')
+
+    def build(self, nthread=1):
+        signals = [mapmaking.SignalCut(None),
+                   mapmaking.SignalMap(self.shape, self.wcs, None, comps='TQU',
+                                       dtype=np.float64)]
+        mapmaker = mapmaking.MLMapmaker(
+            signals, noise_model=mapmaking.NmatUncorr(), nthread=nthread)
+        for i in range(4):
+            mapmaker.add_obs('obs%i' % i, make_obs(i, 2000 + 500 * i))
+        mapmaker.prepare()
+        return mapmaker
+
+    def test_A_threads(self):
+        results = []
+        for nthread in [1, 3]:
+            mapmaker = self.build(nthread)
+            x = np.random.default_rng(1).normal(
+                size=mapmaker.dof.ndof).astype(np.float32)
+            results.append(mapmaker.A(x))
+            self.assertIn('forward', mapmaker.times)
+        self.assertGreater(np.abs(results[0]).max(), 0)
+        np.testing.assert_allclose(results[1], results[0], rtol=1e-6,
+                                   atol=1e-6 * np.abs(results[0]).max())
+
+    def test_solve_checkpoint(self):
+        full = list(self.build().solve(maxiter=6))
+        with tempfile.TemporaryDirectory() as tempdir:
+            checkpoint = os.path.join(tempdir, 'cg.hdf')
+            # Stop after 4 steps ...
+            steps = list(self.build().solve(
+                maxiter=4, checkpoint=checkpoint, checkpoint_interval=2))
+            self.assertEqual(len(steps), 4)
+            self.assertTrue(os.path.exists(checkpoint))
+            # ... and resume.
+            resumed = list(self.build().solve(
+                maxiter=6, checkpoint=checkpoint, checkpoint_interval=2))
+            # Resuming a checkpoint already at maxiter takes no steps,
+            # but the solution is available.
+            mapmaker = self.build()
+            self.assertEqual(list(mapmaker.solve(
+                maxiter=6, checkpoint=checkpoint, checkpoint_interval=2)), [])
+            for a, b in zip(mapmaker.x, full[-1].x):
+                np.testing.assert_allclose(a, b, rtol=1e-10,
+                                           atol=1e-10 * np.abs(b).max())
+        self.assertEqual([s.i for s in resumed], [5, 6])
+        np.testing.assert_allclose(resumed[-1].err, full[-1].err, rtol=1e-10)
+        for a, b in zip(resumed[-1].x, full[-1].x):
+            np.testing.assert_allclose(a, b, rtol=1e-10,
+                                       atol=1e-10 * np.abs(b).max())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,6 +2,7 @@ import unittest
 from sotodlib.core import metadata
 
 import os
+import tempfile
 import time
 
 from ._helpers import mpi_multi
@@ -78,6 +79,24 @@ class TestObsDb(unittest.TestCase):
             print('  -- removing.')
             os.remove(fn)
 
+    def test_indexes(self):
+        """Check that indexes are created with new tables, but not added
+        to existing dbs unless requested."""
+        def get_indexes(db):
+            return [r[0] for r in db.conn.execute(
+                'select name from sqlite_master where type="index"')]
+        db0 = get_example()
+        self.assertIn('obs_timestamp', get_indexes(db0))
+        db0.conn.execute('drop index obs_timestamp')
+        with tempfile.TemporaryDirectory() as tempdir:
+            fn = os.path.join(tempdir, 'test.sqlite')
+            db0.to_file(fn)
+            db1 = metadata.ObsDb(fn)
+            self.assertNotIn('obs_timestamp', get_indexes(db1))
+            self.assertEqual(len(db1.query()), len(db0.query()))
+            self.assertIn('obs_timestamp', db1.create_indexes())
+            db1.conn.close()
+
     def test_info(self):
         """Check the .info method."""
         db0 = get_example()
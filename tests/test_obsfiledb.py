@@ -136,6 +136,56 @@ class TestObsFileDB(unittest.TestCase):
         with self.assertRaises(RuntimeError):
             db.lookup_file('notx/../x/' + target, resolve_paths=False)
 
+    def test_050_indexes(self):
+        def get_indexes(conn):
+            return [r[0] for r in conn.execute(
+                'select name from sqlite_master where type="index"')]
+
+        db = self.get_simple_db()
+        self.assertIn('files_obs_id', get_indexes(db.conn))
+        # Uncommitted changes are written out too.
+        db.add_detset('group8', ['det8_0'], commit=False)
+        db.to_file(self.test_filename)
+        files = db.get_files('obs1')
+
+        # Read-only connections are tuned, and refuse writes.
+        for kw in [{}, {'in_memory': True}]:
+            db2 = metadata.ObsFileDb(self.test_filename, readonly=True,
+                                     prefix=self.test_dir, **kw)
+            self.assertEqual(db2.get_files('obs1'), files)
+            self.assertEqual(db2.get_dets('group8'), ['det8_0'])
+            self.assertIn('files_obs_id', get_indexes(db2.conn))
+            self.assertEqual(
+                db2.conn.execute('pragma query_only').fetchone()[0], 1)
+            with self.assertRaises(Exception):
+                db2.add_detset('group9', ['det9_0'])
+
+        # Frame offsets.
+        name = db.get_files('obs1')['group0'][0][0]
+        rows = [(0, 0, 'Wiring', None, None), (1, 100, 'Scan', 0, 500),
+                (2, 900, 'Scan', 500, 1000)]
+        db.add_frame_offsets(os.path.relpath(name, self.test_dir), rows[::-1])
+        offsets = db.get_frame_offsets('obs1')
+        self.assertEqual(list(offsets.keys()), [name])
+        self.assertEqual(offsets[name], rows)
+        self.assertEqual(db.get_frame_offsets('obs1', detsets=['group1']), {})
+        db.drop_obs('obs1')
+        self.assertEqual(db.get_frame_offsets('obs1'), {})
+
+        # The index is used for lookups by obs_id.
+        plan = ' '.join([r[-1] for r in db.conn.execute(
+            'explain query plan select name from files where obs_id=?',
+            ('obs0',))])
+        self.assertIn('files_obs_id', plan)
+
+        # Opening an existing db does not add indexes to it, unless
+        # asked to.
+        db.conn.execute('drop index files_obs_id')
+        db.to_file(self.test_filename)
+        db2 = metadata.ObsFileDb(self.test_filename)
+        self.assertNotIn('files_obs_id', get_indexes(db2.conn))
+        self.assertIn('files_obs_id', db2.create_indexes())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,139 @@
+# Copyright (c) 2025 Simons Observatory.
+# Full license can be found in the top level "LICENSE" file.
+
+"""Check the ephemeris cache and source position functions in
+coords.planets against direct skyfield computations.
+
+"""
+
+import datetime
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+import so3g
+from skyfield import jpllib, api as skyfield_api
+from skyfield.starlib import Star
+
+from sotodlib import core
+from sotodlib.coords import planets
+
+from ._helpers import mpi_multi
+
+# 2015-03-02, within the span of the skyfield test kernel.
+T0 = 1425297600.
+
+
+def _get_ephemeris():
+    # Use de421.bsp if it can be found / downloaded; otherwise the
+    # small de430 kernel included in skyfield's test data.
+    try:
+        return core.get_local_file("de421.bsp")
+    except Exception:
+        pass
+    import skyfield
+    filename = os.path.join(os.path.dirname(skyfield.__file__), 'tests',
+                            'data', 'de430-2015-03-02.bsp')
+    if os.path.exists(filename):
+        return filename
+    return None
+
+
+def _reference_pos(filename, source, timestamp, azel=False):
+    # As planets._get_astrometric computed it before caching.  source
+    # may also be a tuple (name, ra, dec) for a fixed source.
+    kernel = jpllib.SpiceKernel(filename)
+    if isinstance(source, tuple):
+        target = Star(ra_hours=source[1] / 15, dec_degrees=source[2])
+    else:
+        target = planets._get_target(kernel, source)
+    observatory = so3g.proj.SITES['_default'].skyfield_site(kernel)
+    sf_time = skyfield_api.load.timescale().from_datetime(
+        datetime.datetime.fromtimestamp(timestamp, tz=datetime.timezone.utc))
+    amet = observatory.at(sf_time).observe(target)
+    if azel:
+        el, az, dist = amet.apparent().altaz()
+        return az.radians, el.radians, dist.au
+    ra, dec, dist = amet.radec()
+    return ra.radians, dec.radians, dist.au
+
+
+@unittest.skipIf(mpi_multi(), "Running with multiple MPI processes")
+class PlanetsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.ephemeris = _get_ephemeris()
+
+    def setUp(self):
+        if self.ephemeris is None:
+            self.skipTest("No ephemeris file available.")
+        patcher = mock.patch.dict(os.environ, {
+            'SOTODLIB_RESOURCES': repr({'de421.bsp': 'file://' + self.ephemeris})})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        planets.EPHEMERIS_CACHE.clear()
+        self.addCleanup(planets.EPHEMERIS_CACHE.clear)
+
+    def test_skyfield_time(self):
+        timescale = skyfield_api.load.timescale()
+        timestamps = T0 + np.array([0., 0.25, 3600.5, 86399.75, 86400.])
+        t = planets._get_skyfield_time(timestamps)
+        for i, timestamp in enumerate(timestamps):
+            ref = timescale.from_datetime(datetime.datetime.fromtimestamp(
+                timestamp, tz=datetime.timezone.utc))
+            self.assertAlmostEqual((t[i].tt - ref.tt) * 86400, 0., delta=1e-5)
+
+    def test_cache(self):
+        cache = planets.EphemerisCache(max_entries=1)
+        k1 = cache.kernel(self.ephemeris)
+        self.assertIs(cache.kernel(self.ephemeris), k1)
+        obs = cache.observatory('_default', self.ephemeris)
+        self.assertIs(cache.observatory('_default', self.ephemeris), obs)
+        # Load another entry (same file, different key), evicting the
+        # first; objects already handed out must remain usable.
+        other = os.path.join(os.path.dirname(self.ephemeris), '.',
+                             os.path.basename(self.ephemeris))
+        k2 = cache.kernel(other)
+        self.assertIsNot(k2, k1)
+        t = planets._get_skyfield_time(T0)
+        obs.at(t).observe(planets._get_target(k1, 'mars'))
+        self.assertIsNot(cache.kernel(self.ephemeris), k1)
+        cache.clear()
+        obs.at(t).observe(planets._get_target(k2, 'mars'))
+
+    def test_source_pos(self):
+        for source in ['mars', 'jupiter']:
+            for azel in [False, True]:
+                func = planets.get_source_azel if azel else planets.get_source_pos
+                pos = func(source, T0 + 100.)
+                ref = _reference_pos(self.ephemeris, source, T0 + 100., azel=azel)
+                np.testing.assert_allclose(pos, ref, rtol=1e-12, atol=1e-12)
+
+    def test_source_positions(self):
+        timestamps = T0 + np.arange(0, 3600, 600.)
+        sources = ['mars', ('tauA', 83.6272579, 22.02159891), 'J123.4-56.7']
+        for azel in [False, True]:
+            lon, lat, dist = planets.get_source_positions(
+                sources, timestamps, azel=azel)
+            self.assertEqual(lon.shape, (3, len(timestamps)))
+            for j, t in enumerate(timestamps):
+                ref = _reference_pos(self.ephemeris, 'mars', t, azel=azel)
+                np.testing.assert_allclose(
+                    [lon[0, j], lat[0, j], dist[0, j]], ref, rtol=1e-9, atol=1e-9)
+                if azel:
+                    for i, fixed in [(1, sources[1]), (2, ('', 123.4, -56.7))]:
+                        ref = _reference_pos(self.ephemeris, fixed, t, azel=True)
+                        np.testing.assert_allclose(
+                            [lon[i, j], lat[i, j]], ref[:2], rtol=1e-9, atol=1e-9)
+            self.assertTrue(np.all(np.isinf(dist[1:])))
+            if not azel:
+                np.testing.assert_allclose(
+                    lon[1:, 0], np.radians([83.6272579, 123.4]))
+                np.testing.assert_allclose(
+                    lat[1:, 0], np.radians([22.02159891, -56.7]))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,57 @@
+import unittest
+
+import numpy as np
+
+from sotodlib.core import metadata
+from sotodlib.site_pipeline import scheduling
+
+
+class TestScheduling(unittest.TestCase):
+
+    def test_000_estimate_costs(self):
+        # obs0 has 2 dets x 3000 samples in each of 2 detsets; obs1 is
+        # half as long.
+        db = metadata.ObsFileDb()
+        for detset in ['ds0', 'ds1']:
+            db.add_detset(detset, [f'{detset}_{i}' for i in range(2)])
+        for obs_id, n_files in [('obs0', 3), ('obs1', 1)]:
+            for detset in ['ds0', 'ds1']:
+                for i in range(n_files):
+                    db.add_obsfile(f'{obs_id}_{detset}_{i}.g3', obs_id, detset,
+                                   i * 1000, (i + 1) * 1000)
+        costs = scheduling.estimate_costs(['obs1', 'obs0', 'obsX'],
+                                          obsfiledb=db)
+        np.testing.assert_array_equal(costs, [4000, 12000, 8000])
+        # Many obs_ids are queried in chunks.
+        obs_ids = ['obs1', 'obs0'] + [f'obsX{i}' for i in range(2000)]
+        costs = scheduling.estimate_costs(obs_ids, obsfiledb=db)
+        np.testing.assert_array_equal(costs[:3], [4000, 12000, 8000])
+        self.assertEqual(len(costs), len(obs_ids))
+
+        obsdb = metadata.ObsDb()
+        obsdb.add_obs_columns(['n_samples int'])
+        obsdb.update_obs('obs0', {'n_samples': 300})
+        obsdb.update_obs('obs1', {'n_samples': 100})
+        costs = scheduling.estimate_costs(['obs0', 'obs1'], obsdb=obsdb)
+        np.testing.assert_array_equal(costs, [300, 100])
+        costs = scheduling.estimate_costs(['obs1'] + ['obsX'] * 1000,
+                                          obsdb=obsdb)
+        np.testing.assert_array_equal(costs[:2], [100, 100])
+
+    def test_010_lpt(self):
+        costs = np.array([1, 6, 1, 1, 5, 1, 1, 2])
+        np.testing.assert_array_equal(scheduling.lpt_order(costs),
+                                      [1, 4, 7, 0, 2, 3, 5, 6])
+        assign = scheduling.lpt_assign(costs, 2)
+        self.assertEqual(sorted(np.concatenate(assign)), list(range(8)))
+        loads = [costs[a].sum() for a in assign]
+        self.assertEqual(loads, [9, 9])
+        # Round-robin gets this wrong.
+        rr = [costs[i::2].sum() for i in range(2)]
+        stats = scheduling.balance_stats(rr)
+        self.assertLess(stats['efficiency'], 1)
+        self.assertEqual(scheduling.balance_stats(loads)['efficiency'], 1)
+        self.assertIn('efficiency=100.0%', scheduling.format_balance(loads))
+        # More workers than items.
+        assign = scheduling.lpt_assign(costs[:2], 3)
+        self.assertEqual([len(a) for a in assign], [1, 1, 0])
@@ -5,6 +5,8 @@
 
 """
 
+import os
+import tempfile
 import unittest
 import numpy as np
 import pylab as pl
@@ -296,6 +298,32 @@ class JumpfindTest(unittest.TestCase):
         self.assertTrue(np.all(np.abs(np.array([10, -13, -8]) - np.round(heights)) < 3))
 
 
+class BinningTest(unittest.TestCase):
+    def test_bin_signal(self):
+        tod = get_tod('white', ndets=4, nsamps=5000)
+        bin_by = np.random.uniform(0, 2 * np.pi, tod.samps.count)
+        mask = np.random.uniform(size=tod.shape) > 0.9
+        flags = so3g.proj.RangesMatrix.from_mask(mask)
+        weight = np.random.uniform(size=tod.samps.count)
+        for kw in [{}, {'chunk_size': 700, 'n_threads': 2}]:
+            res = tod_ops.bin_signal(tod, bin_by, bins=30, range=[0, 2 * np.pi],
+                                     flags=flags, weight_for_signal=weight,
+                                     **kw)
+            for i in range(tod.dets.count):
+                m = ~mask[i]
+                counts, _ = np.histogram(bin_by[m], bins=30, range=[0, 2 * np.pi],
+                                         weights=weight[m])
+                sums, _ = np.histogram(bin_by[m], bins=30, range=[0, 2 * np.pi],
+                                       weights=tod.signal[i][m] * weight[m])
+                assert_allclose(res['bin_counts'][i], counts)
+                assert_allclose(res['binned_signal'][i], sums / counts, rtol=1e-5)
+
+        # Unflagged, with an empty bin.
+        res = tod_ops.bin_signal(tod, bin_by, bins=30, range=[0, 3 * np.pi])
+        self.assertTrue(np.all(np.isnan(res['binned_signal'][:, -1])))
+        self.assertTrue(np.all(np.isfinite(res['binned_signal'][:, 0])))
+
+
 class FFTTest(unittest.TestCase):
     def test_psd(self):
         tod = get_tod("white")
@@ -304,5 +332,61 @@ class FFTTest(unittest.TestCase):
         f, Pxx = tod_ops.fft_ops.calc_psd(tod, freq_spacing=.1)
         self.assertEqual(np.round(np.median(np.diff(f)), 1), .1)
 
+    def test_fit_noise_model_batched(self):
+        np.random.seed(0)
+        ndets = 10
+        aman = core.AxisManager(
+            core.LabelAxis('dets', ['det%i' % i for i in range(ndets)]))
+        f = np.linspace(0, 100, 2049)
+        params = np.array([np.random.uniform(0.5, 1.5, ndets),
+                           np.random.uniform(1e-3, 2e-3, ndets),
+                           np.random.uniform(1.5, 2.5, ndets)]).T
+        pxx = np.zeros((ndets, len(f)))
+        for i, p in enumerate(params):
+            pxx[i, 1:] = (tod_ops.fft_ops.noise_model(f[1:], p)
+                          * np.random.chisquare(2, len(f) - 1) / 2)
+        exact = tod_ops.fft_ops.fit_noise_model(
+            aman, signal=pxx, f=f, pxx=pxx, method='exact')
+        batched = tod_ops.fft_ops.fit_noise_model(
+            aman, signal=pxx, f=f, pxx=pxx, method='batched')
+        assert_allclose(batched.fit, exact.fit, rtol=1e-2)
+        self.assertEqual(batched.cov.shape, (ndets, 3, 3))
+        self.assertTrue(np.all(np.isfinite(batched.cov)))
+        # Fit errors should be sensible.
+        self.assertTrue(np.all(np.sqrt(batched.cov[:, 2, 2]) < 1.))
+        with self.assertRaises(ValueError):
+            tod_ops.fft_ops.fit_noise_model(
+                aman, signal=pxx, f=f, pxx=pxx, method='other')
+
+    def test_rfft_cache(self):
+        tod = get_tod("white")
+        cache = tod_ops.fft_ops.RFFT_CACHE
+        cache.clear()
+        filt = tod_ops.filters.low_pass_butter4(SAMPLE_FREQ_HZ / 4)
+        h0 = cache.stats()['hits']
+        sig0 = tod_ops.fourier_filter(tod, filt)
+        sig1 = tod_ops.fourier_filter(tod, filt)
+        # Outputs must not share the cached buffer.
+        self.assertFalse(np.shares_memory(sig0, sig1))
+        assert_allclose(sig0, sig1)
+        self.assertEqual(cache.stats()['hits'], h0 + 1)
+        self.assertEqual(cache.stats()['entries'], 1)
+
+        # Eviction on memory cap.
+        max_bytes = cache.max_bytes
+        try:
+            cache.max_bytes = 0
+            tod_ops.fourier_filter(tod, filt)
+            self.assertEqual(cache.stats()['entries'], 0)
+        finally:
+            cache.max_bytes = max_bytes
+
+        # Wisdom round trip.
+        with tempfile.TemporaryDirectory() as tempdir:
+            filename = os.path.join(tempdir, 'wisdom.pkl')
+            self.assertFalse(cache.load_wisdom(filename))
+            cache.save_wisdom(filename)
+            self.assertTrue(cache.load_wisdom(filename))
+
 if __name__ == '__main__':
     unittest.main()